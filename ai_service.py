@@ -2,15 +2,23 @@ import json
 import os
 from pathlib import Path
 
-from google import genai
-
-from db import search_products_for_ai
+from llm_providers import ProviderConfigError, get_provider
+from metrics import REPLY_STAGE_SECONDS
+from tracing import span
 
 BASE_DIR = Path(__file__).resolve().parent
 PROFILE_PATH = Path(os.getenv("STORE_PROFILE_PATH", "store_profile.json"))
 if not PROFILE_PATH.is_absolute():
     PROFILE_PATH = BASE_DIR / PROFILE_PATH
 
+# Orcamento de tokens do prompt (estimativa ~4 caracteres por token).
+PROMPT_MAX_TOKENS = int(os.getenv("PROMPT_MAX_TOKENS", "6000"))
+PROMPT_CATALOG_MAX_TOKENS = int(os.getenv("PROMPT_CATALOG_MAX_TOKENS", "800"))
+PROMPT_HISTORY_ITEM_MAX_TOKENS = int(os.getenv("PROMPT_HISTORY_ITEM_MAX_TOKENS", "300"))
+PROMPT_USER_MAX_TOKENS = int(os.getenv("PROMPT_USER_MAX_TOKENS", "1500"))
+PROMPT_SUMMARY_MAX_TOKENS = int(os.getenv("PROMPT_SUMMARY_MAX_TOKENS", "400"))
+_CHARS_PER_TOKEN = 4
+
 
 def load_profile() -> dict:
     if not PROFILE_PATH.exists():
@@ -50,33 +58,10 @@ def build_system_prompt(profile: dict) -> str:
 
 
 def _has_product_intent(user_text: str) -> bool:
-    text = (user_text or "").lower()
-    keywords = [
-        "produto",
-        "produtos",
-        "preco",
-        "preço",
-        "valor",
-        "custa",
-        "tem ",
-        "vocês tem",
-        "voce tem",
-        "estoque",
-        "disponivel",
-        "disponível",
-        "marca",
-        "ml",
-        "litro",
-        "essencia",
-        "essência",
-        "base",
-        "sabonete",
-        "sabao",
-        "sabão",
-        "fragrancia",
-        "fragrância",
-    ]
-    return any(k in text for k in keywords)
+    # intent/db puxam o SQLAlchemy; importados so na primeira resposta.
+    from intent import has_product_intent
+
+    return has_product_intent(user_text)
 
 
 def _format_products_context(products: list[dict]) -> str:
@@ -97,10 +82,82 @@ def _format_products_context(products: list[dict]) -> str:
     return "\n".join(lines)
 
 
-def build_prompt(system_prompt: str, history: list[dict], user_text: str, products_context: str = "") -> str:
-    lines = [system_prompt]
+def estimate_tokens(text: str) -> int:
+    if not text:
+        return 0
+    return (len(text) + _CHARS_PER_TOKEN - 1) // _CHARS_PER_TOKEN
+
+
+def _truncate_to_tokens(text: str, max_tokens: int) -> str:
+    text = text or ""
+    if max_tokens <= 0:
+        return ""
+    max_chars = max_tokens * _CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+    # Mantem inicio e fim: listas coladas costumam ter o pedido no final.
+    head = max_chars * 2 // 3
+    tail = max_chars - head
+    return text[:head].rstrip() + " [...] " + text[-tail:].lstrip()
+
+
+def _cap_products_context(products_context: str, max_tokens: int) -> str:
+    if estimate_tokens(products_context) <= max_tokens:
+        return products_context
+    kept = []
+    used = 0
+    for line in products_context.splitlines():
+        cost = estimate_tokens(line) + 1
+        if used + cost > max_tokens:
+            break
+        kept.append(line)
+        used += cost
+    if not kept:
+        return _truncate_to_tokens(products_context, max_tokens)
+    return "\n".join(kept)
+
+
+def resolve_prompt_budget(profile: dict | None = None) -> int:
+    budget = PROMPT_MAX_TOKENS
+    cfg = (profile or {}).get("ai_settings") or {}
+    try:
+        val = int(cfg.get("max_prompt_tokens") or 0)
+        if val > 0:
+            budget = val
+    except Exception:
+        pass
+    return max(500, budget)
+
+
+def resolve_handoff_contact(profile: dict | None = None) -> str:
+    """Contato de atendimento humano (ai_settings.handoff_contact); "" = nao configurado."""
+    cfg = (profile or {}).get("ai_settings") or {}
+    return str(cfg.get("handoff_contact") or "").strip()
+
+
+def assemble_prompt(
+    system_prompt: str,
+    history: list[dict],
+    user_text: str,
+    products_context: str = "",
+    max_tokens: int | None = None,
+    summary: str = "",
+) -> tuple[str, dict]:
+    """Monta o prompt respeitando o orcamento de tokens.
+
+    O system prompt nunca e cortado; o catalogo e o texto do cliente tem teto
+    proprio e o historico ocupa o que sobrar, descartando os turnos mais antigos.
+    O resumo da conversa antiga (se houver) entra antes dos turnos recentes.
+    Retorna (prompt, uso) com a estimativa de tokens por secao.
+    """
+    budget = max_tokens or PROMPT_MAX_TOKENS
+    system_tokens = estimate_tokens(system_prompt)
+
+    head = [system_prompt]
     if products_context:
-        lines.extend(
+        catalog_cap = min(PROMPT_CATALOG_MAX_TOKENS, max(0, (budget - system_tokens) // 2))
+        products_context = _cap_products_context(products_context, catalog_cap)
+        head.extend(
             [
                 "",
                 "CATALOGO CONSULTADO AGORA:",
@@ -112,39 +169,152 @@ def build_prompt(system_prompt: str, history: list[dict], user_text: str, produc
                 "- Nunca invente produto/preco/estoque.",
             ]
         )
+    summary = _truncate_to_tokens((summary or "").strip(), PROMPT_SUMMARY_MAX_TOKENS)
+    if summary:
+        head.extend(["", "RESUMO DA CONVERSA ANTERIOR:", summary])
+    head.extend(["", "CONVERSA:"])
+
+    head_tokens = estimate_tokens("\n".join(head))
+    user_cap = min(PROMPT_USER_MAX_TOKENS, max(50, budget - head_tokens - 20))
+    user_text = _truncate_to_tokens(user_text or "", user_cap)
+    tail = [f"CLIENTE: {user_text}", "ATENDENTE:"]
 
-    lines.extend(["", "CONVERSA:"])
-    for h in history:
+    catalog_tokens = estimate_tokens(products_context)
+    fixed_tokens = head_tokens + estimate_tokens("\n".join(tail)) + 1
+    remaining = budget - fixed_tokens
+
+    # Percorre do mais recente para o mais antigo ate estourar o orcamento.
+    history_lines = []
+    history_tokens = 0
+    for h in reversed(history or []):
         role = "CLIENTE" if h.get("role") == "user" else "ATENDENTE"
-        lines.append(f"{role}: {h.get('content', '')}")
-    lines.append(f"CLIENTE: {user_text}")
-    lines.append("ATENDENTE:")
-    return "\n".join(lines)
+        content = _truncate_to_tokens(str(h.get("content", "")), PROMPT_HISTORY_ITEM_MAX_TOKENS)
+        line = f"{role}: {content}"
+        cost = estimate_tokens(line) + 1
+        if history_tokens + cost > remaining:
+            break
+        history_lines.append(line)
+        history_tokens += cost
+    history_lines.reverse()
 
+    dropped = len(history or []) - len(history_lines)
+    if dropped:
+        history_lines.insert(0, f"({dropped} mensagens anteriores omitidas)")
 
-def generate_reply(history: list[dict], user_text: str) -> str:
+    # Com o system prompt em cache de contexto, o texto comeca direto nas secoes.
+    prompt = "\n".join([*head, *history_lines, *tail]).lstrip("\n")
+    usage = {
+        "budget": budget,
+        "system": system_tokens,
+        "catalog": catalog_tokens,
+        "summary": estimate_tokens(summary),
+        "history": history_tokens,
+        "user": estimate_tokens(user_text),
+        "total": estimate_tokens(prompt),
+        "history_kept": len(history_lines) - (1 if dropped else 0),
+        "history_dropped": dropped,
+    }
+    return prompt, usage
+
+
+def build_prompt(
+    system_prompt: str,
+    history: list[dict],
+    user_text: str,
+    products_context: str = "",
+    max_tokens: int | None = None,
+    summary: str = "",
+) -> str:
+    prompt, _ = assemble_prompt(
+        system_prompt, history, user_text, products_context, max_tokens=max_tokens, summary=summary
+    )
+    return prompt
+
+
+def summarize_conversation(previous_summary: str, items: list[dict]) -> str:
+    """Incorpora turnos antigos ao resumo existente (chamado fora do caminho da resposta)."""
+    if not items:
+        return previous_summary or ""
     profile = load_profile()
 
-    api_key = os.getenv("GEMINI_API_KEY")
-    if not api_key:
-        return "GEMINI_API_KEY nao configurada no sistema."
+    lines = [
+        "Atualize o resumo de um atendimento por WhatsApp.",
+        "Mantenha nome do cliente, produtos de interesse, pedidos, combinados e pendencias.",
+        f"Responda somente com o resumo, em no maximo {PROMPT_SUMMARY_MAX_TOKENS * 3} caracteres.",
+        "",
+        "RESUMO ATUAL:",
+        previous_summary or "(vazio)",
+        "",
+        "NOVOS TURNOS:",
+    ]
+    for h in items:
+        role = "CLIENTE" if h.get("role") == "user" else "ATENDENTE"
+        content = _truncate_to_tokens(str(h.get("content", "")), PROMPT_HISTORY_ITEM_MAX_TOKENS)
+        lines.append(f"{role}: {content}")
+
+    try:
+        summary = get_provider(profile).generate("", "\n".join(lines))
+    except ProviderConfigError:
+        summary = ""
+    return summary or (previous_summary or "")
+
+
+def warmup() -> None:
+    """Pre-carrega o que a primeira resposta usaria (SDK do provedor, vocabulario do catalogo)."""
+    provider = get_provider(load_profile())
+    if "gemini" in provider.name:
+        import google.genai  # noqa: F401
+    from intent import get_matcher
 
-    model_name = (profile.get("model", {}) or {}).get("name") or os.getenv("GEMINI_MODEL")
-    if not model_name:
-        return "Modelo do Gemini nao definido (defina em store_profile.json -> model.name)."
+    get_matcher()
+
+
+def generate_reply(history: list[dict], user_text: str, summary: str = "", system_prompt: str | None = None) -> str:
+    """`system_prompt` substitui o do store_profile.json (prompt da loja no multi-loja);
+    so None usa o do store_profile.json."""
+    profile = load_profile()
 
     products_context = ""
-    if _has_product_intent(user_text):
-        try:
-            matches = search_products_for_ai(user_text, limit=5)
-            products_context = _format_products_context(matches)
-        except Exception:
-            products_context = "Falha ao consultar catalogo de produtos no banco."
-
-    system_prompt = build_system_prompt(profile)
-    prompt = build_prompt(system_prompt, history, user_text, products_context=products_context)
-
-    client = genai.Client(api_key=api_key)
-    resp = client.models.generate_content(model=model_name, contents=prompt)
-    answer = (getattr(resp, "text", None) or "").strip()
+    with REPLY_STAGE_SECONDS.time(stage="product_search"), span("product_search"):
+        if _has_product_intent(user_text):
+            try:
+                from db import search_products_for_ai
+
+                matches = search_products_for_ai(user_text, limit=5)
+                products_context = _format_products_context(matches)
+            except Exception:
+                products_context = "Falha ao consultar catalogo de produtos no banco."
+
+    with REPLY_STAGE_SECONDS.time(stage="prompt_build"), span("prompt_build") as s:
+        if system_prompt is None:
+            system_prompt = build_system_prompt(profile)
+        budget = resolve_prompt_budget(profile)
+        # O system prompt vai separado: o provedor decide se usa cache de contexto
+        # (Gemini) ou campo "system" (Ollama).
+        prompt, usage = assemble_prompt(
+            "",
+            history,
+            user_text,
+            products_context=products_context,
+            max_tokens=max(500, budget - estimate_tokens(system_prompt)),
+            summary=summary,
+        )
+        usage["system"] = estimate_tokens(system_prompt)
+        usage["total"] += usage["system"]
+        usage["budget"] = budget
+        s.set(tokens=usage["total"], budget=budget)
+
+    try:
+        provider = get_provider(profile)
+        with REPLY_STAGE_SECONDS.time(stage="llm", provider=provider.name), span("llm", provider=provider.name):
+            answer = provider.generate(system_prompt, prompt)
+    except ProviderConfigError as e:
+        return str(e)
+
+    print(
+        f"[ai][{provider.name}] tokens estimados={usage['total']}/{usage['budget']} "
+        f"(sistema={usage['system']}, catalogo={usage['catalog']}, resumo={usage['summary']}, "
+        f"historico={usage['history']}, cliente={usage['user']}, turnos={usage['history_kept']}, "
+        f"descartados={usage['history_dropped']})"
+    )
     return answer or "Sem resposta do modelo."
@@ -0,0 +1,199 @@
+"""Estatisticas de conversa mantidas de forma incremental no Redis.
+
+Atualizadas junto das escritas que ja acontecem (sem varrer chaves de chat):
+
+- {prefix}:stats:msgs:{AAAAMMDDHH}  hash por hora com a contagem por origem
+  (user, llm, human, assistant = sem origem informada);
+- {prefix}:stats:phones:{AAAAMMDD}  HyperLogLog dos telefones que escreveram
+  no dia;
+- {prefix}:stats:latency:{AAAAMMDD} hash com o histograma do tempo entre a
+  primeira mensagem do cliente no buffer e o envio da resposta (campos le:<s>,
+  sum e count);
+- {prefix}:stats:queue:{AAAAMMDD}   hash com o histograma da espera na fila do
+  worker (do vencimento no pending_zset ate o despacho) por classe de
+  prioridade (campos <classe>:le:<s>, <classe>:sum e <classe>:count).
+
+Horas e dias em UTC. read_stats le tudo num pipeline com O(dias + horas)
+comandos, independente do numero de chats.
+"""
+import os
+import time
+
+STATS_ENABLED = os.getenv("STATS_ENABLED", "true").lower() == "true"
+STATS_TTL_DAYS = int(os.getenv("STATS_TTL_DAYS", "35"))
+
+# Segundos; o debounce sozinho ja soma BUFFER_DELAY_SECONDS a cada resposta.
+LATENCY_BUCKETS = (5, 10, 30, 60, 90, 120, 150, 180, 240, 300, 600)
+# Espera na fila, sem o debounce: normalmente abaixo de WORKER_POLL_SECONDS.
+QUEUE_WAIT_BUCKETS = (1, 2, 5, 10, 30, 60, 120, 300)
+
+
+def _hour(ts: float) -> str:
+    return time.strftime("%Y%m%d%H", time.gmtime(ts))
+
+
+def _day(ts: float) -> str:
+    return time.strftime("%Y%m%d", time.gmtime(ts))
+
+
+def _msgs_key(prefix: str, hour: str) -> str:
+    return f"{prefix}:stats:msgs:{hour}"
+
+
+def _phones_key(prefix: str, day: str) -> str:
+    return f"{prefix}:stats:phones:{day}"
+
+
+def _latency_key(prefix: str, day: str) -> str:
+    return f"{prefix}:stats:latency:{day}"
+
+
+def _queue_key(prefix: str, day: str) -> str:
+    return f"{prefix}:stats:queue:{day}"
+
+
+def _bucket_field(seconds: float, buckets=LATENCY_BUCKETS) -> str:
+    for b in buckets:
+        if seconds <= b:
+            return f"le:{b}"
+    return "le:inf"
+
+
+def queue_message_stats(pipe, entries, prefix: str, source: str | None = None):
+    """Enfileira os contadores de [(phone, role, content)] no pipeline do chamador."""
+    if not STATS_ENABLED or not entries:
+        return
+    now = time.time()
+    ttl = STATS_TTL_DAYS * 86400
+    counts = {}
+    user_phones = set()
+    for phone, role, _ in entries:
+        field = "user" if role == "user" else (source or role)
+        counts[field] = counts.get(field, 0) + 1
+        if role == "user":
+            user_phones.add(phone)
+    msgs_key = _msgs_key(prefix, _hour(now))
+    for field, n in counts.items():
+        pipe.hincrby(msgs_key, field, n)
+    pipe.expire(msgs_key, ttl)
+    if user_phones:
+        phones_key = _phones_key(prefix, _day(now))
+        pipe.pfadd(phones_key, *sorted(user_phones))
+        pipe.expire(phones_key, ttl)
+
+
+def record_reply_latency(r, seconds: float, prefix: str):
+    if not STATS_ENABLED or r is None:
+        return
+    key = _latency_key(prefix, _day(time.time()))
+    try:
+        pipe = r.pipeline(transaction=False)
+        pipe.hincrby(key, _bucket_field(seconds), 1)
+        pipe.hincrby(key, "count", 1)
+        pipe.hincrbyfloat(key, "sum", round(float(seconds), 3))
+        pipe.expire(key, STATS_TTL_DAYS * 86400)
+        pipe.execute()
+    except Exception as e:
+        print("[stats] falha ao registrar latencia:", e)
+
+
+def record_queue_waits(r, waits, prefix: str):
+    """Soma [(classe, segundos)] de um tick do worker numa ida ao Redis."""
+    if not STATS_ENABLED or r is None or not waits:
+        return
+    key = _queue_key(prefix, _day(time.time()))
+    try:
+        pipe = r.pipeline(transaction=False)
+        for klass, seconds in waits:
+            pipe.hincrby(key, f"{klass}:{_bucket_field(seconds, QUEUE_WAIT_BUCKETS)}", 1)
+            pipe.hincrby(key, f"{klass}:count", 1)
+            pipe.hincrbyfloat(key, f"{klass}:sum", round(float(seconds), 3))
+        pipe.expire(key, STATS_TTL_DAYS * 86400)
+        pipe.execute()
+    except Exception as e:
+        print("[stats] falha ao registrar espera na fila:", e)
+
+
+def _quantile(hist: dict, count: int, q: float, buckets=LATENCY_BUCKETS):
+    # Limite superior do bucket que contem o quantil (mesma precisao do histograma).
+    if not count:
+        return None
+    target = q * count
+    seen = 0
+    for b in buckets:
+        seen += int(hist.get(f"le:{b}", 0))
+        if seen >= target:
+            return b
+    return None
+
+
+def _queue_summary(raw: dict) -> dict:
+    by_class = {}
+    for field, value in raw.items():
+        klass, _, rest = field.partition(":")
+        by_class.setdefault(klass, {})[rest] = value
+    out = {}
+    for klass, hist in sorted(by_class.items()):
+        count = int(hist.get("count", 0))
+        total = float(hist.get("sum", 0) or 0)
+        out[klass] = {
+            "count": count,
+            "avg_s": round(total / count, 2) if count else None,
+            "p50_s": _quantile(hist, count, 0.5, QUEUE_WAIT_BUCKETS),
+            "p95_s": _quantile(hist, count, 0.95, QUEUE_WAIT_BUCKETS),
+            "buckets": {str(b): int(hist.get(f"le:{b}", 0)) for b in (*QUEUE_WAIT_BUCKETS, "inf")},
+        }
+    return out
+
+
+def read_stats(r, prefix: str, days: int = 7, hours: int = 24) -> dict:
+    """Series por hora (mensagens) e por dia (clientes unicos e latencia)."""
+    now = time.time()
+    hour_ids = [_hour(now - i * 3600) for i in range(hours)][::-1]
+    day_ids = [_day(now - i * 86400) for i in range(days)][::-1]
+    if r is None:
+        return {"enabled": False, "hours": [], "days": [], "totals": {}}
+
+    pipe = r.pipeline(transaction=False)
+    for h in hour_ids:
+        pipe.hgetall(_msgs_key(prefix, h))
+    for d in day_ids:
+        pipe.pfcount(_phones_key(prefix, d))
+        pipe.hgetall(_latency_key(prefix, d))
+        pipe.hgetall(_queue_key(prefix, d))
+    pipe.pfcount(*[_phones_key(prefix, d) for d in day_ids])
+    results = pipe.execute()
+
+    hour_rows = []
+    totals = {}
+    for h, raw in zip(hour_ids, results[: len(hour_ids)]):
+        counts = {str(k): int(v) for k, v in (raw or {}).items()}
+        for k, v in counts.items():
+            totals[k] = totals.get(k, 0) + v
+        hour_rows.append({"hour": f"{h[:4]}-{h[4:6]}-{h[6:8]}T{h[8:]}:00Z", "messages": counts})
+
+    day_rows = []
+    rest = results[len(hour_ids) : -1]
+    for i, d in enumerate(day_ids):
+        unique, hist = rest[3 * i], {str(k): v for k, v in (rest[3 * i + 1] or {}).items()}
+        queue = {str(k): v for k, v in (rest[3 * i + 2] or {}).items()}
+        count = int(hist.get("count", 0))
+        total = float(hist.get("sum", 0) or 0)
+        day_rows.append(
+            {
+                "day": f"{d[:4]}-{d[4:6]}-{d[6:]}",
+                "unique_phones": int(unique or 0),
+                "replies": count,
+                "latency_avg_s": round(total / count, 2) if count else None,
+                "latency_p50_s": _quantile(hist, count, 0.5),
+                "latency_p95_s": _quantile(hist, count, 0.95),
+                "latency_buckets": {str(b): int(hist.get(f"le:{b}", 0)) for b in (*LATENCY_BUCKETS, "inf")},
+                "queue_wait": _queue_summary(queue),
+            }
+        )
+    return {
+        "enabled": STATS_ENABLED,
+        "hours": hour_rows,
+        "days": day_rows,
+        "totals": {"messages_last_hours": totals, "unique_phones_days": int(results[-1] or 0)},
+    }
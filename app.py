@@ -1,8 +1,8 @@
 import json
 import os
+import threading
 from pathlib import Path
 
-import redis
 from dotenv import load_dotenv
 from flask import Flask
 from jinja2 import Template
@@ -19,13 +19,24 @@ from db import (
     list_contacts,
     delete_contact_by_phone,
     get_contact_map_for_phones,
+    list_archived_messages,
 )
-from memory import mem_add, mem_get
+from memory import mem_add, mem_clear, mem_get, mem_since, mem_version
+from redis_conn import REDIS_ENABLED, REDIS_PREFIX, REDIS_URI, get_redis
+from prompt_cache import request_invalidation as request_prompt_cache_invalidation
+from metrics import PENDING_DEPTH, register_metrics_route
+from profiling import register_profiling_route
+from health import READINESS, register_health_routes, run_startup
+from buffer import PENDING_ZSET
+from archive import start_archiver
 from sender import send_text
 from backend_tabs.pages_routes import register_pages_routes
 from backend_tabs.chats_routes import register_chat_tab_routes
 from backend_tabs.config_routes import register_config_tab_routes
 from backend_tabs.products_routes import register_products_tab_routes
+from backend_tabs.stats_routes import register_stats_tab_routes
+from analytics import read_stats
+from dispatch import ai_flag_key
 
 app = Flask(__name__)
 PORT = int(os.getenv("WEB_PORT", "8000"))
@@ -35,14 +46,6 @@ STORE_FILE = Path(os.getenv("STORE_PROFILE_PATH", "store_profile.json"))
 if not STORE_FILE.is_absolute():
     STORE_FILE = BASE_DIR / STORE_FILE
 
-REDIS_ENABLED = os.getenv("CACHE_REDIS_ENABLED", "false").lower() == "true"
-REDIS_URI = os.getenv("CACHE_REDIS_URI", "redis://localhost:6379/0")
-REDIS_PREFIX = (
-    os.getenv("CACHE_REDIS_PREFIX_KEY")
-    or os.getenv("CACHE_REDIS_PREFIX")
-    or "evolution"
-)
-
 r = None
 
 
@@ -53,15 +56,45 @@ def _is_effective_process() -> bool:
 
 
 if REDIS_ENABLED:
-    try:
-        r = redis.Redis.from_url(REDIS_URI, decode_responses=True)
-        if _is_effective_process():
-            r.ping()
+    # So cria o pool; a conexao e testada em _startup_steps.
+    r = get_redis()
+
+
+def _startup_steps():
+    global r
+    if r is not None:
+        if READINESS.check("redis", r.ping, required=False):
             print("[backend] redis conectado:", REDIS_URI)
-    except Exception as e:
-        if _is_effective_process():
-            print("[backend] redis indisponivel:", e)
-        r = None
+        else:
+            print("[backend] redis indisponivel:", READINESS.snapshot()["checks"]["redis"]["detail"])
+            r = None
+    READINESS.check("db", ensure_products_table)
+    if r is not None:
+        # Mensagens enviadas pelo painel tambem entram no stream; quem segurar o
+        # lease (painel ou webhook) arquiva.
+        start_archiver(r, get_redis(binary=True))
+
+
+_started = False
+_started_lock = threading.Lock()
+
+
+def startup(background: bool = True):
+    """Fase de inicializacao do processo; roda uma vez por processo."""
+    global _started
+    with _started_lock:
+        if _started:
+            return None
+        _started = True
+    return run_startup(_startup_steps, background=background)
+
+
+@app.before_request
+def _startup_on_first_request():
+    # Sob um servidor WSGI (gunicorn app:app) o __main__ nao roda; o primeiro
+    # pedido do processo (ex.: a sonda do /readyz) dispara a inicializacao.
+    if not _started:
+        startup()
 
 
 DEFAULT_SYSTEM_PROMPT = """Voce e o atendente virtual da {{store.name}}.
@@ -103,7 +136,14 @@ def _default_store():
 
 def _default_config():
     return {
-        "model": {"name": os.getenv("GEMINI_MODEL", "gemini-3-flash-preview")},
+        "model": {
+            "name": os.getenv("GEMINI_MODEL", "gemini-3-flash-preview"),
+            "provider": os.getenv("LLM_PROVIDER", "gemini"),
+            "fallback_provider": os.getenv("LLM_FALLBACK_PROVIDER", ""),
+            "timeout_seconds": 60,
+            "ollama_model": os.getenv("OLLAMA_MODEL", ""),
+            "ollama_url": os.getenv("OLLAMA_URL", ""),
+        },
         "system_prompt": DEFAULT_SYSTEM_PROMPT,
         "rules": [
             "Responda em portugues do Brasil.",
@@ -113,6 +153,7 @@ def _default_config():
         "store": _default_store(),
         "ai_settings": {
             "response_delay_seconds": 0,
+            "max_prompt_tokens": 0,
             "timezone": "America/Porto_Velho",
             "business_hours_policy": "Responder normalmente no horario comercial.",
             "outside_hours_message": "",
@@ -147,8 +188,17 @@ def _normalize_config(raw):
     if not isinstance(raw, dict):
         return cfg
 
-    model_name = ((raw.get("model") or {}).get("name")) or cfg["model"]["name"]
+    model_src = raw.get("model") if isinstance(raw.get("model"), dict) else {}
+    model_name = model_src.get("name") or cfg["model"]["name"]
     cfg["model"]["name"] = _to_str(model_name) or cfg["model"]["name"]
+    provider = _to_str(model_src.get("provider")).lower()
+    if provider in {"gemini", "ollama", "fake"}:
+        cfg["model"]["provider"] = provider
+    fallback = _to_str(model_src.get("fallback_provider")).lower()
+    cfg["model"]["fallback_provider"] = fallback if fallback in {"gemini", "ollama", "fake"} else ""
+    cfg["model"]["timeout_seconds"] = _to_int(model_src.get("timeout_seconds"), default=60, min_value=1, max_value=600)
+    cfg["model"]["ollama_model"] = _to_str(model_src.get("ollama_model")) or cfg["model"]["ollama_model"]
+    cfg["model"]["ollama_url"] = _to_str(model_src.get("ollama_url")) or cfg["model"]["ollama_url"]
 
     system_prompt = _to_str(raw.get("system_prompt"))
     if system_prompt:
@@ -164,6 +214,9 @@ def _normalize_config(raw):
 
     ai_src = raw.get("ai_settings") if isinstance(raw.get("ai_settings"), dict) else {}
     cfg["ai_settings"]["response_delay_seconds"] = _to_int(ai_src.get("response_delay_seconds"), default=0)
+    cfg["ai_settings"]["max_prompt_tokens"] = _to_int(
+        ai_src.get("max_prompt_tokens"), default=0, max_value=200000
+    )
     cfg["ai_settings"]["timezone"] = _to_str(ai_src.get("timezone")) or cfg["ai_settings"]["timezone"]
     cfg["ai_settings"]["business_hours_policy"] = _to_str(ai_src.get("business_hours_policy"))
     cfg["ai_settings"]["outside_hours_message"] = _to_str(ai_src.get("outside_hours_message"))
@@ -185,6 +238,9 @@ def save_store(data):
     normalized = _normalize_config(data)
     with STORE_FILE.open("w", encoding="utf-8") as f:
         json.dump(normalized, f, ensure_ascii=False, indent=2)
+    # Os handles ficam nos workers: a epoca no Redis faz cada um apagar os seus
+    # no Gemini (o prompt novo ja teria versao propria; isto libera os antigos).
+    request_prompt_cache_invalidation()
 
 
 def build_system_prompt(store_config):
@@ -199,7 +255,8 @@ def _chat_key(phone):
 
 
 def _ai_key(phone):
-    return f"{REDIS_PREFIX}:ai:{phone}"
+    # A mesma chave que o despacho e o worker consultam.
+    return ai_flag_key(phone)
 
 
 def _parse_phone_from_chat_key(key):
@@ -228,7 +285,8 @@ def _list_chat_numbers():
 
 
 def _chat_snapshot(phone, contact=None):
-    history = mem_get(phone, max_items=100)
+    # So o ultimo item e usado (horario e previa).
+    history = mem_get(phone, max_items=1)
     updated_at = 0
     last_preview = ""
     if history:
@@ -296,6 +354,11 @@ def _parse_product_payload(body):
 
 
 register_pages_routes(app)
+register_metrics_route(app)
+register_profiling_route(app)
+register_health_routes(app)
+if r is not None:
+    PENDING_DEPTH.set_function(lambda: r.zcard(PENDING_ZSET) if r is not None else 0)
 
 register_chat_tab_routes(
     app,
@@ -303,6 +366,10 @@ register_chat_tab_routes(
     chat_snapshot=_chat_snapshot,
     get_contact_map_for_phones=get_contact_map_for_phones,
     mem_get=mem_get,
+    mem_since=mem_since,
+    mem_version=mem_version,
+    mem_clear=mem_clear,
+    list_archived_messages=list_archived_messages,
     list_contacts=list_contacts,
     upsert_contact=upsert_contact,
     delete_contact_by_phone=delete_contact_by_phone,
@@ -333,9 +400,14 @@ register_products_tab_routes(
     to_non_negative_int=_to_non_negative_int,
 )
 
+register_stats_tab_routes(
+    app,
+    read_stats=lambda days, hours: read_stats(r, REDIS_PREFIX, days=days, hours=hours),
+)
+
 
 if __name__ == "__main__":
     if _is_effective_process():
-        ensure_products_table()
+        startup()
         print(f"Painel rodando em http://0.0.0.0:{PORT}")
     app.run(host="0.0.0.0", port=PORT, debug=APP_DEBUG)
@@ -0,0 +1,130 @@
+"""Arquivamento write-behind do historico no banco (tabela messages).
+
+No caminho quente o unico custo e um XADD dentro do script de append do
+memory.py: cada item gravado no historico vai para o stream
+{REDIS_PREFIX}:archive (campos ns, p, d = item codificado).
+
+O arquivador roda em um processo por vez (lease "archiver" do scheduler),
+le o stream em lotes de ARCHIVE_BATCH_SIZE, insere no banco com o id da
+entrada do stream como archive_id (UNIQUE, entao reprocessar um lote depois de
+uma queda nao duplica nada) e so entao apaga as entradas do stream. Se o banco
+falhar, o lote fica no stream e a tentativa seguinte espera em backoff
+exponencial ate ARCHIVE_RETRY_MAX_SECONDS. Com o arquivador parado o stream
+fica limitado a ARCHIVE_STREAM_MAXLEN (as entradas mais antigas se perdem).
+"""
+import os
+import threading
+import time
+
+from codec import decode
+from memory import ARCHIVE_ENABLED, archive_stream_key
+from metrics import ARCHIVE_BACKLOG, ARCHIVE_FAILURES, ARCHIVED_MESSAGES
+from scheduler import run_elected
+
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "500"))
+ARCHIVE_INTERVAL_SECONDS = float(os.getenv("ARCHIVE_INTERVAL_SECONDS", "2"))
+ARCHIVE_RETRY_MAX_SECONDS = float(os.getenv("ARCHIVE_RETRY_MAX_SECONDS", "60"))
+# Lotes por tick; o lease e renovado entre ticks.
+ARCHIVE_MAX_BATCHES_PER_TICK = int(os.getenv("ARCHIVE_MAX_BATCHES_PER_TICK", "10"))
+
+
+def _s(v) -> str:
+    return v.decode("utf-8", "replace") if isinstance(v, bytes) else str(v or "")
+
+
+def _field(fields: dict, name: str):
+    return fields.get(name, fields.get(name.encode()))
+
+
+def _to_row(entry_id, fields: dict) -> dict | None:
+    try:
+        item = decode(_field(fields, "d"))
+    except Exception:
+        return None
+    if not isinstance(item, dict):
+        return None
+    return {
+        "archive_id": _s(entry_id),
+        "namespace": _s(_field(fields, "ns")),
+        "phone": _s(_field(fields, "p")),
+        "role": str(item.get("role") or ""),
+        "content": str(item.get("content") or ""),
+        "sent_at": int(item.get("t") or 0),
+    }
+
+
+class Archiver:
+    def __init__(self, rb, insert=None, batch_size: int = ARCHIVE_BATCH_SIZE):
+        self.rb = rb
+        self.batch_size = max(1, batch_size)
+        self._insert = insert
+        self._retry_at = 0.0
+        self._backoff = 0.0
+
+    def insert(self, rows: list[dict]) -> int:
+        if self._insert is None:
+            from db import archive_messages
+
+            self._insert = archive_messages
+        return self._insert(rows)
+
+    def drain_once(self) -> int:
+        """Arquiva um lote; retorna quantas entradas sairam do stream."""
+        stream = archive_stream_key()
+        entries = self.rb.xrange(stream, min="-", max="+", count=self.batch_size)
+        if not entries:
+            return 0
+        rows = [row for row in (_to_row(entry_id, fields) for entry_id, fields in entries) if row]
+        if rows:
+            self.insert(rows)
+            ARCHIVED_MESSAGES.inc(len(rows))
+        self.rb.xdel(stream, *[entry_id for entry_id, _ in entries])
+        return len(entries)
+
+    def tick(self):
+        now = time.monotonic()
+        if now < self._retry_at:
+            return
+        try:
+            for _ in range(ARCHIVE_MAX_BATCHES_PER_TICK):
+                if self.drain_once() < self.batch_size:
+                    break
+            self._backoff = 0.0
+        except Exception as e:
+            ARCHIVE_FAILURES.inc()
+            self._backoff = min(ARCHIVE_RETRY_MAX_SECONDS, max(1.0, self._backoff * 2))
+            self._retry_at = now + self._backoff
+            print(f"[archive] falha ao arquivar, nova tentativa em {self._backoff:.0f}s:", e)
+
+
+_thread = None
+_start_lock = threading.Lock()
+_stop = threading.Event()
+
+
+def start_archiver(r, rb) -> bool:
+    """Sobe a thread do arquivador uma vez por processo (so o lider do lease trabalha)."""
+    global _thread
+    if not ARCHIVE_ENABLED or r is None or rb is None:
+        return False
+    with _start_lock:
+        if _thread is not None:
+            return False
+        archiver = Archiver(rb)
+        ARCHIVE_BACKLOG.set_function(lambda: rb.xlen(archive_stream_key()))
+        _thread = threading.Thread(
+            target=run_elected,
+            args=(r, archiver.tick),
+            kwargs={"interval_sec": ARCHIVE_INTERVAL_SECONDS, "stop_event": _stop, "name": "archiver"},
+            daemon=True,
+            name="archiver",
+        )
+        _thread.start()
+    return True
+
+
+def stop_archiver(timeout_sec: float = 5.0):
+    # Solta o lease ao sair (o lote em andamento termina antes).
+    _stop.set()
+    if _thread is not None:
+        _thread.join(timeout_sec)
@@ -1,10 +1,14 @@
 import os
+import re
 import base64
 import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
 from flask import Flask, request, jsonify
 from dotenv import load_dotenv
 from google import genai
+from google.genai import types
 
 load_dotenv(dotenv_path=".env", override=True)
 
@@ -14,6 +18,23 @@ EVOLUTION_SERVER = (os.getenv("EVOLUTION_SERVER_URL") or "http://localhost:8080"
 INSTANCE = (os.getenv("INSTACE") or os.getenv("INSTANCE") or "").strip().strip('"').strip("'")
 API_KEY = (os.getenv("AUTHENTICATION_API_KEY") or "").strip()
 GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-3-flash-preview")
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL", "").strip()
+
+# Audios do buffer sao transcritos juntos na hora do flush (transcribe_batch).
+# Notas com menos que isto (audioMessage.seconds) sao puladas sem download.
+AUDIO_MIN_SECONDS = float(os.getenv("AUDIO_MIN_SECONDS", "1"))
+AUDIO_DOWNLOAD_CONCURRENCY = int(os.getenv("AUDIO_DOWNLOAD_CONCURRENCY", "4"))
+# Soma dos audios acima disso vai pelo upload de arquivos em vez de inline
+# (o pedido inteiro do Gemini tem limite de 20 MB).
+AUDIO_INLINE_MAX_BYTES = int(os.getenv("AUDIO_INLINE_MAX_BYTES", str(14 * 1024 * 1024)))
+
+_BATCH_PROMPT = (
+    "Voce vai receber {n} audios de um cliente, na ordem em que foram enviados. "
+    "Transcreva cada um em portugues do Brasil. Responda somente com uma linha por "
+    "audio no formato '<numero>: <transcricao>' (deixe vazio depois dos dois pontos "
+    "se o audio nao tiver fala)."
+)
+_NUMBERED = re.compile(r"^\s*(?:audio\s*)?(\d+)\s*[:.)-]\s*(.*)$", re.IGNORECASE)
 
 
 def _get_phone(item: dict) -> str | None:
@@ -41,16 +62,17 @@ def _get_audio_info(item: dict):
     return msg_id, mime, secs
 
 
-def evolution_get_media_base64(message_id: str) -> str:
+def evolution_get_media_base64(message_id: str, instance: str | None = None) -> str:
     """
     Evolution: POST /chat/getBase64FromMediaMessage/{instance}
     """
-    if not INSTANCE:
+    instance = instance or INSTANCE
+    if not instance:
         raise RuntimeError("INSTACE/INSTANCE não definido no .env")
     if not API_KEY:
         raise RuntimeError("AUTHENTICATION_API_KEY não definido no .env")
 
-    url = f"{EVOLUTION_SERVER}/chat/getBase64FromMediaMessage/{INSTANCE}"
+    url = f"{EVOLUTION_SERVER}/chat/getBase64FromMediaMessage/{instance}"
     payload = {"message": {"key": {"id": message_id}}, "convertToMp4": False}
 
     resp = requests.post(
@@ -81,36 +103,37 @@ def base64_to_bytes(b64: str) -> bytes:
     return base64.b64decode(b64)
 
 
-def transcribe_with_gemini(audio_bytes: bytes, mime_type: str) -> str:
+_client = None
+
+
+def gemini_client():
+    """Cliente do Gemini compartilhado pelas chamadas multimodais (audio, imagem)."""
+    global _client
     if not os.getenv("GEMINI_API_KEY"):
         raise RuntimeError("GEMINI_API_KEY não configurada no sistema/ambiente.")
+    if _client is None:
+        _client = genai.Client(http_options=types.HttpOptions(base_url=GEMINI_BASE_URL) if GEMINI_BASE_URL else None)
+    return _client
 
-    client = genai.Client()
 
+def _suffix_for(mime_type: str) -> str:
     # escolhe extensão por mime (whatsapp ptt geralmente é ogg/opus)
-    suffix = ".ogg"
     mt = (mime_type or "").lower()
     if "wav" in mt:
-        suffix = ".wav"
-    elif "mpeg" in mt or "mp3" in mt:
-        suffix = ".mp3"
-    elif "webm" in mt:
-        suffix = ".webm"
+        return ".wav"
+    if "mpeg" in mt or "mp3" in mt:
+        return ".mp3"
+    if "webm" in mt:
+        return ".webm"
+    return ".ogg"
+
 
-    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as f:
+def _upload(client, audio_bytes: bytes, mime_type: str):
+    with tempfile.NamedTemporaryFile(delete=False, suffix=_suffix_for(mime_type)) as f:
         f.write(audio_bytes)
         tmp_path = f.name
-
     try:
-        up = client.files.upload(file=tmp_path)
-        resp = client.models.generate_content(
-            model=GEMINI_MODEL,
-            contents=[
-                "Transcreva este áudio em português do Brasil e retorne somente o texto.",
-                up
-            ],
-        )
-        return (resp.text or "").strip()
+        return client.files.upload(file=tmp_path)
     finally:
         try:
             os.remove(tmp_path)
@@ -118,6 +141,98 @@ def transcribe_with_gemini(audio_bytes: bytes, mime_type: str) -> str:
             pass
 
 
+def transcribe_with_gemini(audio_bytes: bytes, mime_type: str) -> str:
+    client = gemini_client()
+    up = _upload(client, audio_bytes, mime_type)
+    resp = client.models.generate_content(
+        model=GEMINI_MODEL,
+        contents=[
+            "Transcreva este áudio em português do Brasil e retorne somente o texto.",
+            up
+        ],
+    )
+    return (resp.text or "").strip()
+
+
+def download_media(message_ids: list, instance: str | None = None) -> list:
+    """Baixa varias midias em paralelo; bytes ou a excecao de cada id, na ordem."""
+
+    def fetch(message_id):
+        try:
+            return base64_to_bytes(evolution_get_media_base64(message_id, instance=instance))
+        except Exception as e:
+            return e
+
+    if len(message_ids) <= 1:
+        return [fetch(m) for m in message_ids]
+    with ThreadPoolExecutor(max_workers=max(1, min(AUDIO_DOWNLOAD_CONCURRENCY, len(message_ids)))) as pool:
+        return list(pool.map(fetch, message_ids))
+
+
+def split_numbered(text: str, n: int) -> list[str]:
+    """Separa a resposta '<numero>: <texto>' de um pedido com n midias."""
+    text = (text or "").strip()
+    if n == 1:
+        return [re.sub(r"^\s*1\s*[:.)-]\s*", "", text)]
+    out = [""] * n
+    current = None
+    for line in text.splitlines():
+        m = _NUMBERED.match(line)
+        if m and 1 <= int(m.group(1)) <= n:
+            current = int(m.group(1)) - 1
+            out[current] = m.group(2).strip()
+        elif current is not None and line.strip():
+            # Transcricao longa quebrada em varias linhas.
+            out[current] = f"{out[current]} {line.strip()}".strip()
+    if current is None:
+        # Modelo ignorou o formato: fica tudo no primeiro audio.
+        out[0] = text
+    return out
+
+
+def transcribe_batch(items: list[dict], instance: str | None = None) -> list:
+    """Transcreve os audios do buffer ({"id", "mime", "seconds"}) num unico pedido.
+
+    Um valor por item, na ordem: texto, "" (sem fala ou download falhou) ou None
+    (nota curta demais, pulada sem baixar).
+    """
+    out = [None] * len(items)
+    wanted = []
+    for i, item in enumerate(items):
+        seconds = item.get("seconds")
+        if seconds is not None and float(seconds) < AUDIO_MIN_SECONDS:
+            continue
+        if not item.get("id"):
+            out[i] = ""
+            continue
+        wanted.append(i)
+    if not wanted:
+        return out
+
+    media = download_media([items[i]["id"] for i in wanted], instance=instance)
+    ready = []
+    for i, data in zip(wanted, media):
+        if isinstance(data, Exception) or not data:
+            print(f"[AUDIO][ERRO] download de {items[i].get('id')}: {data}")
+            out[i] = ""
+        else:
+            ready.append((i, data))
+    if not ready:
+        return out
+
+    client = gemini_client()
+    inline = sum(len(data) for _, data in ready) <= AUDIO_INLINE_MAX_BYTES
+    contents = [_BATCH_PROMPT.format(n=len(ready))]
+    for n, (i, data) in enumerate(ready, start=1):
+        mime = (items[i].get("mime") or "audio/ogg").split(";", 1)[0].strip()
+        contents.append(f"Audio {n}:")
+        contents.append(types.Part.from_bytes(data=data, mime_type=mime) if inline else _upload(client, data, mime))
+    resp = client.models.generate_content(model=GEMINI_MODEL, contents=contents)
+    for (i, _), text in zip(ready, split_numbered(resp.text or "", len(ready))):
+        out[i] = text
+    return out
+
+
 @app.post("/webhook")
 def webhook():
     payload = request.get_json(silent=True) or {}
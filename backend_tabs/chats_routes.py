@@ -8,6 +8,10 @@ def register_chat_tab_routes(
     chat_snapshot,
     get_contact_map_for_phones,
     mem_get,
+    mem_since,
+    mem_version,
+    mem_clear,
+    list_archived_messages,
     list_contacts,
     upsert_contact,
     delete_contact_by_phone,
@@ -19,6 +23,13 @@ def register_chat_tab_routes(
     chat_key,
     redis_prefix,
 ):
+    # Muda quando um contato e salvo/apagado por este painel; entra no ETag
+    # porque o nome do contato vai junto na resposta do chat.
+    contacts_rev = {"n": 0}
+
+    def _chat_etag(version, ai_enabled):
+        return f"{version}-{int(bool(ai_enabled))}-{contacts_rev['n']}"
+
     @app.get("/api/chats")
     def api_chats():
         numbers = list_chat_numbers()
@@ -29,18 +40,67 @@ def register_chat_tab_routes(
 
     @app.get("/api/chat/<numero>")
     def api_chat(numero):
-        raw = mem_get(numero, max_items=200)
+        """Historico do chat; ?since=<seq> devolve so o que veio depois.
+
+        Com If-None-Match igual ao ETag atual responde 304 sem ler a lista
+        nem consultar o contato.
+        """
+        since = request.args.get("since", type=int)
+        ai_enabled = is_ai_enabled(numero)
+        etag = _chat_etag(mem_version(numero), ai_enabled)
+        if request.if_none_match.contains_weak(etag):
+            resp = app.response_class(status=304)
+            resp.set_etag(etag, weak=True)
+            resp.headers["Cache-Control"] = "no-cache"
+            return resp
+
+        version, items, reset = mem_since(numero, since, max_items=200)
         history = [
             {
                 "role": it.get("role", "assistant"),
                 "text": it.get("content", ""),
                 "ts": int(it.get("t") or 0),
+                "seq": seq,
             }
-            for it in raw
+            for seq, it in items
         ]
         contact_map = get_contact_map_for_phones([numero])
         snap = chat_snapshot(numero, contact_map.get(numero))
-        return jsonify({**snap, "history": history})
+        resp = jsonify(
+            {
+                **snap,
+                "version": version,
+                "reset": reset,
+                "history": history,
+            }
+        )
+        resp.set_etag(_chat_etag(version, snap.get("ai_enabled", ai_enabled)), weak=True)
+        resp.headers["Cache-Control"] = "no-cache"
+        return resp
+
+    @app.get("/api/chat/<numero>/archive")
+    def api_chat_archive(numero):
+        """Historico completo do banco, paginado do mais novo ao mais antigo.
+
+        ?before=<id> continua de onde a pagina anterior parou (next_before).
+        """
+        before = request.args.get("before", type=int)
+        limit = request.args.get("limit", default=50, type=int)
+        try:
+            rows = list_archived_messages(numero, redis_prefix, before_id=before, limit=limit)
+        except Exception as e:
+            return jsonify({"ok": False, "error": str(e)}), 500
+        messages = [
+            {
+                "id": row["id"],
+                "role": row.get("role") or "assistant",
+                "text": row.get("content") or "",
+                "ts": int(row.get("sent_at") or 0),
+            }
+            for row in rows
+        ]
+        next_before = messages[-1]["id"] if len(messages) >= max(1, min(limit or 50, 200)) else None
+        return jsonify({"numero": numero, "messages": messages, "next_before": next_before})
 
     @app.get("/api/contacts")
     def api_contacts_list():
@@ -62,6 +122,7 @@ def register_chat_tab_routes(
             return jsonify({"ok": False, "error": "PHONE_REQUIRED"}), 400
         try:
             contact = upsert_contact(name=name, phone=phone, notes=notes)
+            contacts_rev["n"] += 1
             return jsonify({"ok": True, "contact": contact})
         except ValueError as e:
             return jsonify({"ok": False, "error": str(e)}), 400
@@ -75,6 +136,7 @@ def register_chat_tab_routes(
             return jsonify({"ok": False, "error": "PHONE_REQUIRED"}), 400
         try:
             ok = delete_contact_by_phone(numero)
+            contacts_rev["n"] += 1
             return jsonify({"ok": True, "deleted": bool(ok)})
         except Exception as e:
             return jsonify({"ok": False, "error": str(e)}), 500
@@ -88,7 +150,7 @@ def register_chat_tab_routes(
 
         try:
             send_text(numero, text)
-            mem_add(numero, "assistant", text)
+            mem_add(numero, "assistant", text, source="human")
             return jsonify({"ok": True})
         except Exception as e:
             return jsonify({"ok": False, "error": str(e)}), 500
@@ -104,7 +166,7 @@ def register_chat_tab_routes(
     @app.post("/api/chat/<numero>/clear")
     def api_chat_clear(numero):
         if redis_client:
-            redis_client.delete(chat_key(numero))
+            mem_clear(numero)
             redis_client.delete(f"{redis_prefix}:buffer:{numero}")
             redis_client.zrem("pending_zset", numero)
         return jsonify({"ok": True, "numero": numero})
@@ -0,0 +1,12 @@
+from flask import jsonify, request
+
+
+def register_stats_tab_routes(app, *, read_stats):
+    @app.get("/api/stats")
+    def api_stats():
+        days = max(1, min(request.args.get("days", default=7, type=int) or 7, 31))
+        hours = max(1, min(request.args.get("hours", default=24, type=int) or 24, 168))
+        try:
+            return jsonify(read_stats(days=days, hours=hours))
+        except Exception as e:
+            return jsonify({"ok": False, "error": str(e)}), 500
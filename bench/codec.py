@@ -0,0 +1,98 @@
+"""Tamanho e vazao do codec compacto x JSON legado para itens de historico.
+
+Reporta bytes de payload por 1M mensagens e encode/decode por segundo. Com
+--redis, mede tambem MEMORY USAGE de uma lista real no Redis de CACHE_REDIS_URI.
+
+Uso:
+    python bench/codec.py [--messages 20000] [--redis]
+"""
+import argparse
+import json
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import codec  # noqa: E402
+
+SHORT = ["Oi", "Bom dia!", "Tem essencia de lavanda?", "Quanto fica?", "Ok, obrigado", "Aceita pix?"]
+LONG = (
+    "Ola! Temos sim a essencia de lavanda 100ml por R$ 24,90, com estoque disponivel. "
+    "Entregamos no Centro e na Zona Sul em 30 a 90 minutos; a taxa depende do bairro. "
+    "Se preferir, pode retirar no balcao informando o nome. Posso separar para voce?"
+)
+
+
+def _messages(n: int) -> list[dict]:
+    rnd = random.Random(42)
+    out = []
+    t = 1_700_000_000
+    for i in range(n):
+        t += rnd.randint(1, 90)
+        if i % 2 == 0:
+            content = rnd.choice(SHORT)
+            role = "user"
+        else:
+            content = LONG if rnd.random() < 0.7 else LONG * rnd.randint(3, 8)
+            role = "assistant"
+        out.append({"t": t, "role": role, "content": content})
+    return out
+
+
+def _legacy_encode(m):
+    return json.dumps(m, ensure_ascii=False).encode("utf-8")
+
+
+def _legacy_decode(raw):
+    return json.loads(raw)
+
+
+def _measure(name, enc, dec, msgs):
+    t0 = time.perf_counter()
+    encoded = [enc(m) for m in msgs]
+    t_enc = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    for raw in encoded:
+        dec(raw)
+    t_dec = time.perf_counter() - t0
+    total = sum(len(x) for x in encoded)
+    per_million = total / len(msgs) * 1_000_000
+    print(
+        f"{name:<10} {total / len(msgs):8.1f} B/msg  {per_million / 1024 / 1024:9.1f} MiB/1M msgs  "
+        f"encode={len(msgs) / t_enc:10.0f}/s  decode={len(msgs) / t_dec:10.0f}/s"
+    )
+    return encoded
+
+
+def _redis_usage(encoded_sets):
+    import redis
+    from redis_conn import REDIS_URI
+
+    client = redis.Redis.from_url(REDIS_URI)
+    for name, encoded in encoded_sets:
+        key = f"bench:codec:{name}"
+        client.delete(key)
+        # Listas de 12 itens, como no historico real.
+        total = 0
+        for i in range(0, len(encoded), 12):
+            client.rpush(key, *encoded[i : i + 12])
+            total += client.memory_usage(key) or 0
+            client.delete(key)
+        per_msg = total / max(1, len(encoded))
+        print(f"{name:<10} redis MEMORY USAGE ~{per_msg:8.1f} B/msg  {per_msg * 1_000_000 / 1024 / 1024:9.1f} MiB/1M msgs")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--messages", type=int, default=20000)
+    ap.add_argument("--redis", action="store_true")
+    args = ap.parse_args()
+
+    msgs = _messages(args.messages)
+    print(f"backend do codec: {'msgpack' if codec.msgpack else 'json compacto'}")
+    legacy = _measure("legado", _legacy_encode, _legacy_decode, msgs)
+    compact = _measure("codec", codec.encode, codec.decode, msgs)
+    if args.redis:
+        _redis_usage([("legado", legacy), ("codec", compact)])
@@ -0,0 +1,179 @@
+"""Simulacao do debounce: janela fixa x adaptativa sobre tempos de mensagens.
+
+Le um arquivo gravado pelo recorder.py (WEBHOOK_RECORD_FILE: mensagens e
+eventos presence.update com o horario de chegada) ou gera clientes
+sinteticos (--synthetic N). Cada politica roda sobre o backend em memoria com
+relogio simulado, usando as mesmas funcoes do buffer.py que o webhook usa.
+
+Reporta por politica: respostas, mensagens por resposta (consolidacao),
+espera apos a ultima mensagem do cliente (p50/p90) e respostas "cortadas"
+(o cliente mandou outra mensagem ate --split-window s depois do flush).
+
+Uso:
+    python bench/debounce_sim.py data/webhook_record.jsonl [--max-delay 120]
+    python bench/debounce_sim.py --synthetic 300 [--seed 1]
+"""
+import argparse
+import json
+import math
+import random
+import statistics
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import buffer  # noqa: E402
+from local_store import LocalRedis  # noqa: E402
+from parser import extract_presences  # noqa: E402
+
+PREFIX = "sim"
+
+
+def _text_of(item: dict) -> str | None:
+    m = item.get("message") or {}
+    if "conversation" in m:
+        return m.get("conversation")
+    if "extendedTextMessage" in m:
+        return (m.get("extendedTextMessage") or {}).get("text")
+    if "audioMessage" in m:
+        return ""
+    return None
+
+
+def load_recorded(path: str) -> list[tuple]:
+    """[(t, phone, "msg"|"presence", texto|estado)] de um JSONL do recorder."""
+    events = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                row = json.loads(line)
+            except ValueError:
+                continue
+            t, payload = float(row.get("t") or 0), row.get("payload") or {}
+            if str(payload.get("event") or "").lower().replace("_", ".") == "presence.update":
+                events.extend((t, phone, "presence", state) for phone, state in extract_presences(payload))
+                continue
+            data = payload.get("data")
+            for item in data if isinstance(data, list) else [data] if isinstance(data, dict) else []:
+                key = item.get("key") or {}
+                jid = key.get("remoteJidAlt") or key.get("remoteJid") or ""
+                text = _text_of(item)
+                if key.get("fromMe") or "@s.whatsapp.net" not in jid or text is None:
+                    continue
+                events.append((t, jid.split("@")[0], "msg", text))
+    events.sort(key=lambda e: e[0])
+    return events
+
+
+def synthetic(customers: int, seed: int) -> list[tuple]:
+    """Rajadas de 1 a 5 mensagens com digitacao antes de cada uma."""
+    rnd = random.Random(seed)
+    events = []
+    for c in range(customers):
+        phone = f"5569{c:08d}"
+        typical_gap = rnd.uniform(3, 15)
+        t = rnd.uniform(0, 3600)
+        for _ in range(rnd.randint(1, 4)):
+            size = rnd.choices([1, 2, 3, 4, 5], weights=[50, 25, 12, 8, 5])[0]
+            for i in range(size):
+                last = i == size - 1
+                if i:
+                    gap = rnd.lognormvariate(math.log(typical_gap), 0.5)
+                    # Pausa longa no meio da rajada (pensando, procurando algo).
+                    if rnd.random() < 0.1:
+                        gap += rnd.uniform(15, 40)
+                    t += gap
+                typing = min(rnd.uniform(2, 10), max(0.5, t - (events[-1][0] if events else 0)))
+                events.append((t - typing, phone, "presence", "composing"))
+                question = rnd.random() < (0.6 if last else 0.1)
+                events.append((t, phone, "msg", "quanto custa?" if question else "oi"))
+                events.append((t + 0.3, phone, "presence", "paused"))
+            t += rnd.uniform(300, 1200)
+    events.sort(key=lambda e: e[0])
+    return events
+
+
+def simulate(events, adaptive: bool, max_delay: float, poll: float, split_window: float) -> dict:
+    store = LocalRedis(max_bytes=1 << 34, max_keys=1 << 30)
+    orig_script = buffer._script
+    buffer._script = store.register_script
+    pending = {}
+    flushes = []  # (flush_t, phone, [t das mensagens])
+
+    def flush_due(now):
+        due = sorted((store.zscore(buffer.PENDING_ZSET, m), m) for m in store.zrangebyscore(buffer.PENDING_ZSET, 0, now))
+        for score, phone in due:
+            # O worker so olha o zset a cada `poll` segundos.
+            flush_t = math.ceil(score / poll) * poll if poll > 0 else score
+            if flush_t > now:
+                continue
+            store.zrem(buffer.PENDING_ZSET, phone)
+            flushes.append((flush_t, phone, pending.pop(phone, [])))
+
+    try:
+        for t, phone, kind, value in events:
+            flush_due(t)
+            if kind == "presence":
+                if adaptive:
+                    buffer.presence_update(store, PREFIX, phone, value, max_delay=max_delay, now=t)
+                continue
+            pending.setdefault(phone, []).append(t)
+            if adaptive:
+                buffer.schedule_flush(store, PREFIX, phone, max_delay=max_delay, terminal=buffer.is_terminal_text(value), now=t)
+            else:
+                store.zadd(buffer.PENDING_ZSET, {phone: t + max_delay})
+        flush_due(float("inf"))
+    finally:
+        buffer._script = orig_script
+
+    msg_times = {}
+    for t, phone, kind, _ in events:
+        if kind == "msg":
+            msg_times.setdefault(phone, []).append(t)
+    waits = [f_t - msgs[-1] for f_t, _, msgs in flushes if msgs]
+    splits = 0
+    for f_t, phone, msgs in flushes:
+        if any(f_t < t <= f_t + split_window for t in msg_times.get(phone, ())):
+            splits += 1
+    n = max(1, len(flushes))
+    waits.sort()
+    return {
+        "replies": len(flushes),
+        "per_reply": sum(len(m) for _, _, m in flushes) / n,
+        "p50": statistics.median(waits) if waits else 0.0,
+        "p90": waits[min(len(waits) - 1, int(0.9 * len(waits)))] if waits else 0.0,
+        "splits": splits,
+        "split_rate": splits / n,
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("record", nargs="?", help="JSONL do recorder.py")
+    ap.add_argument("--synthetic", type=int, default=0, help="numero de clientes sinteticos")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--max-delay", type=float, default=120, help="response_delay_seconds (teto)")
+    ap.add_argument("--poll", type=float, default=2, help="WORKER_POLL_SECONDS")
+    ap.add_argument("--split-window", type=float, default=30)
+    args = ap.parse_args()
+
+    if args.record:
+        events = load_recorded(args.record)
+    else:
+        events = synthetic(args.synthetic or 300, args.seed)
+    msgs = sum(1 for e in events if e[2] == "msg")
+    presences = len(events) - msgs
+    print(f"eventos: {msgs} mensagens, {presences} presencas, {len({e[1] for e in events})} telefones")
+
+    print(f"{'politica':<10} {'respostas':>9} {'msgs/resp':>9} {'espera p50':>11} {'espera p90':>11} {'cortadas':>9}")
+    for name, adaptive in (("fixa", False), ("adaptativa", True)):
+        res = simulate(events, adaptive, args.max_delay, args.poll, args.split_window)
+        print(
+            f"{name:<10} {res['replies']:>9} {res['per_reply']:>9.2f} {res['p50']:>10.1f}s {res['p90']:>10.1f}s "
+            f"{res['splits']:>4} ({res['split_rate']:.1%})"
+        )
+
+
+if __name__ == "__main__":
+    main()
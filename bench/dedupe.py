@@ -0,0 +1,146 @@
+"""Dedupe do webhook: uma chave por id (keys) x filtro de Bloom em bitmaps (bloom).
+
+Insere --ids ids novos em lotes de --batch (como o webhook), mede a latencia
+de cada verificacao, a memoria ocupada e a taxa de falso positivo observada
+com ids nunca vistos (consultados so para leitura, sem marcar: marcando, as
+sondas enchiam o bucket e inflavam a propria taxa). Com --store redis usa CACHE_REDIS_URI (memoria por
+INFO used_memory, banco --db e esvaziado); com --store local usa o backend em
+memoria (memoria estimada pelo proprio store).
+
+Uso:
+    python bench/dedupe.py [--store local|redis] [--ids 200000] [--batch 10]
+        [--capacity 50000] [--fp-rate 1e-6]
+"""
+import argparse
+import statistics
+import sys
+import time
+import uuid
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from dedupe import BloomParams, filter_processed  # noqa: E402
+from local_store import LocalRedis  # noqa: E402
+
+PREFIX = "bench"
+
+
+def _client(store: str, db: int):
+    if store == "local":
+        return LocalRedis(max_bytes=1 << 34, max_keys=1 << 30)
+    import redis
+
+    from redis_conn import REDIS_URI
+
+    client = redis.Redis.from_url(REDIS_URI, db=db, decode_responses=True)
+    client.flushdb()
+    return client
+
+
+def _memory(client) -> int:
+    if getattr(client, "is_local", False):
+        return client.memory_bytes()
+    return int(client.info("memory")["used_memory"])
+
+
+def _pct(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+
+def _probe(client, mode, ids, params) -> int:
+    """Quantos ids seriam dados como repetidos, sem marcar nenhum."""
+    pipe = client.pipeline(transaction=False)
+    if mode == "keys":
+        for msg_id in ids:
+            pipe.exists(f"{PREFIX}:processed:{msg_id}")
+        return sum(1 for hit in pipe.execute() if int(hit))
+    keys = params.bucket_keys(PREFIX)
+    positions = [params.positions(msg_id) for msg_id in ids]
+    for pos in positions:
+        for key in keys:
+            for p in pos:
+                pipe.getbit(key, p)
+    bits = iter(pipe.execute())
+    seen = 0
+    for pos in positions:
+        # Mesmo criterio do _BLOOM_LUA: todos os k bits em algum bucket.
+        hits = [all([int(next(bits)) for _ in pos]) for _ in keys]
+        seen += any(hits)
+    return seen
+
+
+def _run(mode, client, ids, batch, params, probes):
+    base = _memory(client)
+    lat = []
+    dups = 0
+    for i in range(0, len(ids), batch):
+        chunk = ids[i : i + batch]
+        t0 = time.perf_counter()
+        out = filter_processed(client, PREFIX, chunk, mode=mode, params=params)
+        lat.append((time.perf_counter() - t0) * 1000)
+        dups += sum(out)
+    used = _memory(client) - base
+
+    # Reenvio: todos precisam ser reconhecidos.
+    sample = ids[: min(len(ids), 10000)]
+    missed = 0
+    for i in range(0, len(sample), batch):
+        missed += sum(1 for d in filter_processed(client, PREFIX, sample[i : i + batch], mode=mode, params=params) if not d)
+
+    # Ids nunca vistos: quantos seriam descartados por engano.
+    false_pos = 0
+    for i in range(0, len(probes), 1000):
+        false_pos += _probe(client, mode, probes[i : i + 1000], params)
+    return {
+        "mode": mode,
+        "mem": used,
+        "p50": statistics.median(lat),
+        "p99": _pct(lat, 0.99),
+        "first_dups": dups,
+        "missed": missed,
+        "fp": false_pos / max(1, len(probes)),
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--store", choices=("local", "redis"), default="local")
+    ap.add_argument("--db", type=int, default=15)
+    ap.add_argument("--ids", type=int, default=200000)
+    ap.add_argument("--batch", type=int, default=10)
+    ap.add_argument("--probes", type=int, default=100000)
+    ap.add_argument("--capacity", type=int, default=50000, help="ids esperados por bucket")
+    ap.add_argument("--fp-rate", type=float, default=1e-6)
+    ap.add_argument("--window", type=int, default=21600)
+    ap.add_argument("--bucket", type=int, default=3600)
+    args = ap.parse_args()
+
+    params = BloomParams(args.capacity, args.fp_rate, args.window, args.bucket)
+    print(
+        f"bloom: {params.bits} bits/bucket ({params.bytes_per_bucket / 1024:.0f} KiB), k={params.hashes}, "
+        f"{params.buckets} buckets -> teto {params.buckets * params.bytes_per_bucket / 1024 / 1024:.1f} MiB por loja"
+    )
+    ids = [f"3EB0{uuid.uuid4().hex[:16].upper()}" for _ in range(args.ids)]
+    probes = [f"3EB0{uuid.uuid4().hex[:16].upper()}" for _ in range(args.probes)]
+
+    print(f"{'modo':<6} {'memoria':>10} {'B/id':>7} {'p50 ms':>8} {'p99 ms':>8} {'reenvio perdido':>16} {'falso +':>9}")
+    for mode in ("keys", "bloom"):
+        client = _client(args.store, args.db)
+        res = _run(mode, client, ids, args.batch, params, probes)
+        print(
+            f"{mode:<6} {res['mem'] / 1024 / 1024:>8.1f}Mi {res['mem'] / len(ids):>7.1f} {res['p50']:>8.3f} "
+            f"{res['p99']:>8.3f} {res['missed']:>16} {res['fp']:>9.2e}"
+        )
+        if args.store == "redis":
+            client.flushdb()
+    if args.ids > args.capacity:
+        print(
+            f"obs.: todos os {args.ids} ids cairam no bucket atual (> capacidade {args.capacity}); "
+            "a taxa de falso positivo acima e o pior caso de um pico."
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""Servidores locais que imitam a Evolution API e a API do Gemini.
+
+Usados pelo bench/loadtest.py; tambem rodam sozinhos para apontar um
+webhook.py de verdade para eles:
+
+    python bench/fakes.py [--llm-ms 800] [--send-ms 50]
+
+e exportar as variaveis impressas (EVOLUTION_API, EVOLUTION_SERVER_URL,
+GEMINI_BASE_URL, GEMINI_API_KEY) antes de subir o webhook.
+"""
+import argparse
+import base64
+import hashlib
+import itertools
+import logging
+import threading
+import time
+
+from flask import Flask, jsonify, request
+from werkzeug.serving import make_server
+
+# ~1 s de "audio"; o conteudo nao importa para o fake do Gemini.
+FAKE_AUDIO = base64.b64encode(b"OggS" + bytes(4000)).decode()
+
+# Uma linha de log por requisicao distorce a medicao.
+logging.getLogger("werkzeug").setLevel(logging.ERROR)
+
+
+class _Server:
+    def __init__(self, app: Flask, host: str = "127.0.0.1", port: int = 0):
+        self._server = make_server(host, port, app, threaded=True)
+        self.url = f"http://{host}:{self._server.server_port}"
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+
+
+class FakeEvolution(_Server):
+    """sendText registra (telefone, texto, instante); getBase64 devolve um audio fixo."""
+
+    def __init__(self, send_ms: float = 50, media_ms: float = 100, on_send=None, **kwargs):
+        self.send_ms = send_ms
+        self.media_ms = media_ms
+        self.on_send = on_send
+        self.sent = []
+        self.media_requests = 0
+        self._lock = threading.Lock()
+
+        app = Flask("fake_evolution")
+
+        @app.post("/message/sendText/<instance>")
+        def send_text(instance):
+            body = request.get_json(silent=True) or {}
+            time.sleep(self.send_ms / 1000.0)
+            item = (str(body.get("number") or ""), str(body.get("text") or ""), time.time())
+            with self._lock:
+                self.sent.append(item)
+            if self.on_send:
+                self.on_send(*item)
+            return jsonify({"key": {"id": hashlib.md5(repr(item).encode()).hexdigest()}, "status": "PENDING"})
+
+        @app.post("/chat/getBase64FromMediaMessage/<instance>")
+        def get_media(instance):
+            time.sleep(self.media_ms / 1000.0)
+            with self._lock:
+                self.media_requests += 1
+            return jsonify({"mimetype": "audio/ogg; codecs=opus", "base64": FAKE_AUDIO})
+
+        super().__init__(app, **kwargs)
+
+
+class FakeGemini(_Server):
+    """generateContent, cachedContents e upload de arquivos (protocolo resumable)."""
+
+    def __init__(self, llm_ms: float = 800, transcribe_ms: float = 600, **kwargs):
+        self.llm_ms = llm_ms
+        self.transcribe_ms = transcribe_ms
+        self.calls = {"generate": 0, "transcribe": 0, "describe": 0, "cache_create": 0, "upload": 0}
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+        app = Flask("fake_gemini")
+
+        def _count(name):
+            with self._lock:
+                self.calls[name] += 1
+
+        @app.post("/v1beta/models/<path:model_action>")
+        def generate(model_action):
+            body = request.get_json(silent=True) or {}
+            parts = [p for c in body.get("contents") or [] for p in c.get("parts") or []]
+            inline = [p.get("inlineData") or p.get("inline_data") or {} for p in parts]
+            media = [
+                p
+                for p, blob in zip(parts, inline)
+                if "fileData" in p or str(blob.get("mimeType") or blob.get("mime_type") or "").startswith("audio/")
+            ]
+            photos = [blob for blob in inline if str(blob.get("mimeType") or blob.get("mime_type") or "").startswith("image/")]
+            if media:
+                _count("transcribe")
+                time.sleep(self.transcribe_ms / 1000.0)
+                text = "\n".join(f"{i}: quero saber o preco da essencia de lavanda" for i in range(1, len(media) + 1))
+            elif photos:
+                _count("describe")
+                time.sleep(self.transcribe_ms / 1000.0)
+                text = "\n".join(f"{i}: frasco de essencia de lavanda 100 ml" for i in range(1, len(photos) + 1))
+            else:
+                _count("generate")
+                time.sleep(self.llm_ms / 1000.0)
+                prompt = "".join(p.get("text") or "" for p in parts)
+                text = f"[fake-gemini] {hashlib.sha1(prompt.encode()).hexdigest()[:8]} Temos sim, posso ajudar?"
+            return jsonify(
+                {
+                    "candidates": [{"content": {"role": "model", "parts": [{"text": text}]}, "finishReason": "STOP"}],
+                    "usageMetadata": {"promptTokenCount": len(str(body)) // 4, "candidatesTokenCount": 12},
+                }
+            )
+
+        @app.post("/v1beta/cachedContents")
+        def cache_create():
+            _count("cache_create")
+            body = request.get_json(silent=True) or {}
+            return jsonify({"name": f"cachedContents/bench{next(self._ids)}", "model": body.get("model", "")})
+
+        @app.delete("/v1beta/cachedContents/<name>")
+        def cache_delete(name):
+            return jsonify({})
+
+        @app.post("/upload/v1beta/files")
+        def upload_start():
+            upload_id = next(self._ids)
+            resp = jsonify({})
+            resp.headers["X-Goog-Upload-URL"] = f"{self.url}/upload/v1beta/files/session/{upload_id}"
+            resp.headers["X-Goog-Upload-Status"] = "active"
+            return resp
+
+        @app.post("/upload/v1beta/files/session/<int:upload_id>")
+        def upload_finish(upload_id):
+            _count("upload")
+            request.get_data()
+            name = f"files/bench{upload_id}"
+            resp = jsonify(
+                {
+                    "file": {
+                        "name": name,
+                        "mimeType": "audio/ogg",
+                        "uri": f"{self.url}/v1beta/{name}",
+                        "state": "ACTIVE",
+                    }
+                }
+            )
+            resp.headers["X-Goog-Upload-Status"] = "final"
+            return resp
+
+        super().__init__(app, **kwargs)
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--llm-ms", type=float, default=800)
+    ap.add_argument("--send-ms", type=float, default=50)
+    ap.add_argument("--evolution-port", type=int, default=8081)
+    ap.add_argument("--gemini-port", type=int, default=8082)
+    args = ap.parse_args()
+
+    evo = FakeEvolution(send_ms=args.send_ms, port=args.evolution_port).start()
+    gem = FakeGemini(llm_ms=args.llm_ms, port=args.gemini_port).start()
+    print(f"EVOLUTION_API={evo.url}/message/sendText/bench")
+    print(f"EVOLUTION_SERVER_URL={evo.url}")
+    print("INSTANCE=bench")
+    print(f"GEMINI_BASE_URL={gem.url}")
+    print("GEMINI_API_KEY=bench")
+    try:
+        while True:
+            time.sleep(5)
+            print(f"[fakes] enviados={len(evo.sent)} midias={evo.media_requests} gemini={gem.calls}")
+    except KeyboardInterrupt:
+        pass
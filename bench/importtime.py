@@ -0,0 +1,91 @@
+"""Tempo de import das entradas (python -X importtime) e guarda contra regressoes.
+
+Cada medicao roda num interpretador novo. Sai com codigo 1 se alguma entrada
+passar do orcamento ou importar no carregamento um modulo que deveria ser
+adiado (SDK do Gemini, SQLAlchemy no webhook).
+
+Uso:
+    python bench/importtime.py [--runs 5] [--top 10] [--budget-ms webhook=400,app=600]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Modulos que so podem ser carregados depois do startup/primeira resposta.
+DEFERRED = {
+    "webhook": ("google.genai", "sqlalchemy", "psycopg", "PIL"),
+    "app": ("google.genai", "psycopg", "PIL"),
+}
+DEFAULT_BUDGET_MS = {"webhook": 400, "app": 600}
+
+
+def _measure(module: str) -> tuple[float, dict]:
+    """(ms cumulativos do modulo, {modulo: ms cumulativos}) de um import a frio."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT,
+        env={**os.environ, "PYTHONDONTWRITEBYTECODE": "1"},
+        capture_output=True,
+        text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} falhou:\n{proc.stderr[-2000:]}")
+    modules = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        parts = line[len("import time:") :].split("|")
+        try:
+            cumulative = int(parts[1].strip())
+        except ValueError:
+            continue
+        name = parts[2].strip()
+        modules[name] = max(modules.get(name, 0), cumulative / 1000.0)
+    return modules.get(module, 0.0), modules
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--runs", type=int, default=5)
+    ap.add_argument("--top", type=int, default=10)
+    ap.add_argument("--budget-ms", default="", help="ex.: webhook=400,app=600")
+    ap.add_argument("--modules", default="webhook,app")
+    args = ap.parse_args()
+
+    budget = dict(DEFAULT_BUDGET_MS)
+    for part in filter(None, args.budget_ms.split(",")):
+        name, _, ms = part.partition("=")
+        budget[name.strip()] = float(ms)
+
+    failed = False
+    for module in [m.strip() for m in args.modules.split(",") if m.strip()]:
+        totals = []
+        modules = {}
+        for _ in range(args.runs):
+            total, modules = _measure(module)
+            totals.append(total)
+        median = statistics.median(totals)
+        limit = budget.get(module)
+        status = "ok" if limit is None or median <= limit else "ACIMA DO ORCAMENTO"
+        print(f"{module}: mediana={median:.0f}ms min={min(totals):.0f}ms orcamento={limit or '-'}ms [{status}]")
+        if status != "ok":
+            failed = True
+
+        heavy = sorted(((ms, name) for name, ms in modules.items() if name != module), reverse=True)
+        for ms, name in heavy[: args.top]:
+            print(f"    {ms:8.1f}ms  {name}")
+
+        loaded = [m for m in DEFERRED.get(module, ()) if any(n == m or n.startswith(m + ".") for n in modules)]
+        if loaded:
+            failed = True
+            print(f"    importados no carregamento (deveriam ser adiados): {', '.join(loaded)}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""Precisao/recall da deteccao de intencao de produto num conjunto fixo.
+
+Compara a lista de palavras-chave antiga (busca de substring) com o matcher
+compilado a partir do vocabulario do catalogo de exemplo.
+
+Uso:
+    python bench/intent_eval.py
+"""
+import json
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from intent import ProductIntentMatcher  # noqa: E402
+
+FIXTURES = Path(__file__).resolve().parent / "fixtures"
+
+LEGACY_KEYWORDS = [
+    "produto", "produtos", "preco", "preço", "valor", "custa", "tem ", "vocês tem", "voce tem",
+    "estoque", "disponivel", "disponível", "marca", "ml", "litro", "essencia", "essência", "base",
+    "sabonete", "sabao", "sabão", "fragrancia", "fragrância",
+]
+
+
+def legacy_has_intent(text: str) -> bool:
+    text = (text or "").lower()
+    return any(k in text for k in LEGACY_KEYWORDS)
+
+
+def evaluate(name, predict, cases, repeat=2000):
+    tp = fp = fn = tn = 0
+    for c in cases:
+        got = predict(c["text"])
+        if got and c["product"]:
+            tp += 1
+        elif got and not c["product"]:
+            fp += 1
+        elif not got and c["product"]:
+            fn += 1
+        else:
+            tn += 1
+    precision = tp / (tp + fp) if tp + fp else 0.0
+    recall = tp / (tp + fn) if tp + fn else 0.0
+
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        for c in cases:
+            predict(c["text"])
+    per_call_us = (time.perf_counter() - t0) / (repeat * len(cases)) * 1e6
+
+    print(
+        f"{name:<10} precisao={precision:.2f} recall={recall:.2f} "
+        f"buscas_desperdicadas={fp} perdidas={fn} tempo={per_call_us:.1f}us/msg"
+    )
+
+
+if __name__ == "__main__":
+    catalog = json.loads((FIXTURES / "intent_catalog.json").read_text(encoding="utf-8"))
+    cases = [json.loads(line) for line in (FIXTURES / "intent_cases.jsonl").read_text(encoding="utf-8").splitlines() if line.strip()]
+    matcher = ProductIntentMatcher.from_products(catalog)
+    evaluate("legado", legacy_has_intent, cases)
+    evaluate("catalogo", matcher.matches, cases)
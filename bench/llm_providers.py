@@ -0,0 +1,73 @@
+"""Compara latencia dos provedores de IA com prompts concorrentes.
+
+Uso:
+    python bench/llm_providers.py --providers fake,ollama --requests 20 --concurrency 4
+"""
+import argparse
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from ai_service import assemble_prompt, build_system_prompt, load_profile  # noqa: E402
+from llm_providers import get_provider  # noqa: E402
+
+SAMPLE_MESSAGES = [
+    "Oi, tudo bem?",
+    "Quanto custa a essencia de lavanda 100ml?",
+    "Voces entregam na zona sul?",
+    "Qual o horario de sabado?",
+    "Tem sabonete de erva doce?",
+]
+
+
+def _percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, int(round(p / 100.0 * (len(ordered) - 1))))
+    return ordered[idx]
+
+
+def run(provider_name: str, total: int, concurrency: int):
+    profile = load_profile()
+    profile = {**profile, "model": {**(profile.get("model") or {}), "provider": provider_name, "fallback_provider": ""}}
+    provider = get_provider(profile)
+    system_prompt = build_system_prompt(profile)
+
+    def one(i):
+        prompt, _ = assemble_prompt("", [], SAMPLE_MESSAGES[i % len(SAMPLE_MESSAGES)])
+        t0 = time.perf_counter()
+        try:
+            provider.generate(system_prompt, prompt)
+            ok = True
+        except Exception as e:
+            print(f"[{provider_name}] erro: {e}")
+            ok = False
+        return time.perf_counter() - t0, ok
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, range(total)))
+    elapsed = time.perf_counter() - t0
+
+    lat = [d for d, ok in results if ok]
+    errors = sum(1 for _, ok in results if not ok)
+    print(
+        f"{provider.name:<16} ok={len(lat):<4} erros={errors:<3} "
+        f"p50={_percentile(lat, 50) * 1000:8.1f}ms p99={_percentile(lat, 99) * 1000:8.1f}ms "
+        f"media={(statistics.mean(lat) if lat else 0) * 1000:8.1f}ms vazao={len(lat) / elapsed:6.2f}/s"
+    )
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--providers", default="fake")
+    ap.add_argument("--requests", type=int, default=20)
+    ap.add_argument("--concurrency", type=int, default=4)
+    args = ap.parse_args()
+    for name in [p.strip() for p in args.providers.split(",") if p.strip()]:
+        run(name, args.requests, args.concurrency)
@@ -0,0 +1,292 @@
+"""Teste de carga ponta a ponta do webhook.py, offline.
+
+Sobe no mesmo processo: Evolution e Gemini falsos (bench/fakes.py), o app do
+webhook num servidor HTTP real e o debounce worker. Depois dispara trafego
+sintetico (rajadas de texto, audios e reenvios duplicados) e reporta:
+
+- latencia do POST /webhook (p50/p95/p99);
+- latencia ponta a ponta (ultima mensagem do cliente -> sendText), que inclui
+  o debounce configurado;
+- respostas/s e comandos Redis por resposta.
+
+O catalogo vem de bench/fixtures/intent_catalog.json num SQLite temporario.
+--store fake usa fakeredis (precisa de lupa), redis usa CACHE_REDIS_URI
+(use um db vazio: pending_zset nao tem prefixo) e local usa o LocalRedis.
+
+Uso:
+    python bench/loadtest.py [--duration 30] [--rate 5] [--phones 50]
+                             [--voice 0.1] [--dup 0.05] [--debounce 2]
+                             [--llm-ms 800] [--store fake|redis|local]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from bench.fakes import FakeEvolution, FakeGemini  # noqa: E402
+
+_ops = 0
+_ops_lock = threading.Lock()
+
+
+def _count_redis_commands():
+    import redis
+    from redis.client import Pipeline
+
+    orig_exec = redis.Redis.execute_command
+    orig_pipe = Pipeline.execute
+
+    def execute_command(self, *args, **kwargs):
+        global _ops
+        with _ops_lock:
+            _ops += 1
+        return orig_exec(self, *args, **kwargs)
+
+    def execute(self, *args, **kwargs):
+        global _ops
+        with _ops_lock:
+            _ops += len(self.command_stack)
+        return orig_pipe(self, *args, **kwargs)
+
+    redis.Redis.execute_command = execute_command
+    Pipeline.execute = execute
+
+
+def _setup_store(store: str):
+    """Ajusta redis_conn antes de memory/webhook importarem os clientes."""
+    import redis_conn
+
+    if store == "local":
+        redis_conn.REDIS_ENABLED = False
+        redis_conn.LOCAL_STORE_ENABLED = True
+        return False
+    redis_conn.REDIS_ENABLED = True
+    redis_conn.REDIS_PREFIX = "bench-load"
+    if store == "fake":
+        import fakeredis
+
+        server = fakeredis.FakeServer()
+        clients = {b: fakeredis.FakeRedis(server=server, decode_responses=not b) for b in (False, True)}
+        redis_conn.get_redis = lambda binary=False: clients[binary]
+    _count_redis_commands()
+    return True
+
+
+def _setup_db(tmpdir: str):
+    from sqlalchemy import create_engine
+
+    import db
+
+    db._engine = create_engine(f"sqlite:///{tmpdir}/bench.db")
+    db.IS_SQLITE = True
+    db._SCHEMA_READY = False
+    catalog = json.loads((ROOT / "bench" / "fixtures" / "intent_catalog.json").read_text(encoding="utf-8"))
+    for i, p in enumerate(catalog):
+        db.create_product(
+            {
+                "name": p["name"],
+                "sku": f"B{i:04d}",
+                "category": p.get("category", ""),
+                "description": "",
+                "price": 9.9 + i,
+                "stock": 10,
+                "active": True,
+                "aliases": p.get("aliases", []),
+            }
+        )
+
+
+TEXTS = [
+    "Oi",
+    "Bom dia",
+    "tem essencia de lavanda?",
+    "quanto custa a base glicerinada?",
+    "voces entregam no centro?",
+    "qual o horario de funcionamento?",
+    "ok obrigado",
+    "aceita pix?",
+]
+
+
+def _events(args) -> list[tuple]:
+    """(instante, telefone, payload, duplicado) ordenados pelo instante."""
+    rnd = random.Random(args.seed)
+    total = int(args.rate * args.duration)
+    events = []
+    n = 0
+    while n < total:
+        phone = f"5569{rnd.randint(0, args.phones - 1):08d}"
+        t = rnd.uniform(0, args.duration)
+        for _ in range(rnd.randint(1, args.max_burst)):
+            if n >= total:
+                break
+            msg_id = f"LOAD{n:08d}"
+            if rnd.random() < args.voice:
+                message = {"audioMessage": {"mimetype": "audio/ogg; codecs=opus", "seconds": rnd.randint(2, 20)}}
+            else:
+                message = {"conversation": rnd.choice(TEXTS)}
+            item = {"key": {"id": msg_id, "remoteJid": f"{phone}@s.whatsapp.net", "fromMe": False}, "message": message}
+            payload = {"event": "messages.upsert", "data": item}
+            events.append((t, phone, payload, False))
+            if rnd.random() < args.dup:
+                # Evolution reentrega o mesmo id (retry do webhook).
+                events.append((t + rnd.uniform(0.05, 0.5), phone, payload, True))
+            n += 1
+            t += rnd.uniform(0.3, 1.5)
+    events.sort(key=lambda e: e[0])
+    return events
+
+
+def _pct(values: list, p: float) -> float:
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))]
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--duration", type=float, default=30)
+    ap.add_argument("--rate", type=float, default=5, help="mensagens novas por segundo")
+    ap.add_argument("--phones", type=int, default=50)
+    ap.add_argument("--max-burst", type=int, default=4)
+    ap.add_argument("--voice", type=float, default=0.1)
+    ap.add_argument("--dup", type=float, default=0.05)
+    ap.add_argument("--debounce", type=int, default=2)
+    ap.add_argument("--llm-ms", type=float, default=800)
+    ap.add_argument("--transcribe-ms", type=float, default=600)
+    ap.add_argument("--send-ms", type=float, default=50)
+    ap.add_argument("--clients", type=int, default=32, help="conexoes HTTP simultaneas no webhook")
+    ap.add_argument("--store", choices=("fake", "redis", "local"), default="fake")
+    ap.add_argument("--seed", type=int, default=7)
+    args = ap.parse_args()
+
+    last_msg = {}
+    e2e = []
+    reply_times = []
+    state_lock = threading.Lock()
+
+    def on_send(phone, text, t):
+        with state_lock:
+            reply_times.append(t)
+            if phone in last_msg:
+                e2e.append(t - last_msg[phone])
+
+    evo = FakeEvolution(send_ms=args.send_ms, on_send=on_send).start()
+    gem = FakeGemini(llm_ms=args.llm_ms, transcribe_ms=args.transcribe_ms).start()
+
+    os.environ.update(
+        {
+            "WEBHOOK_ENABLED": "true",
+            "WORKER_POLL_SECONDS": "0.2",
+            "GEMINI_API_KEY": "bench",
+            "GEMINI_BASE_URL": gem.url,
+            "EVOLUTION_API": f"{evo.url}/message/sendText/bench",
+            "EVOLUTION_SERVER_URL": evo.url,
+        }
+    )
+    counting = _setup_store(args.store)
+    tmpdir = tempfile.mkdtemp(prefix="iawhatsapp-load-")
+    _setup_db(tmpdir)
+
+    # .env e carregado com override em alguns modulos; fixa os alvos depois do import.
+    import requests
+    from werkzeug.serving import make_server
+
+    import audio
+    import sender
+    import webhook
+
+    sender.EVOLUTION_SEND_URL = f"{evo.url}/message/sendText/bench"
+    audio.EVOLUTION_SERVER = evo.url
+    audio.INSTANCE = "bench"
+    audio.API_KEY = "bench"
+    webhook.WEBHOOK_ENABLED = True
+    webhook._resolve_buffer_delay_seconds = lambda: args.debounce
+    if webhook.r is not None and not getattr(webhook.r, "is_local", False):
+        webhook.r.flushdb()
+
+    server = make_server("127.0.0.1", 0, webhook.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/webhook"
+    webhook.startup(background=False)
+
+    events = _events(args)
+    http = requests.Session()
+    http.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=args.clients))
+    webhook_ms = []
+    statuses = {}
+
+    def post(phone, payload, dup):
+        t0 = time.time()
+        if not dup:
+            with state_lock:
+                last_msg[phone] = t0
+        try:
+            status = http.post(url, json=payload, timeout=60).status_code
+        except Exception:
+            status = "erro"
+        with state_lock:
+            webhook_ms.append((time.time() - t0) * 1000)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    print(
+        f"[load] {len(events)} eventos em {args.duration:.0f}s, {args.phones} telefones, "
+        f"debounce={args.debounce}s, llm={args.llm_ms:.0f}ms, store={args.store}"
+    )
+    global _ops
+    _ops = 0
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=args.clients) as pool:
+        for t, phone, payload, dup in events:
+            delay = start + t - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(post, phone, payload, dup)
+
+    # Espera o debounce esvaziar e as ultimas respostas sairem.
+    deadline = time.time() + args.debounce + 60
+    while time.time() < deadline:
+        idle = webhook.r is None or webhook.r.zcard(webhook.PENDING_ZSET) == 0
+        if idle and webhook.WORKER_ACTIVE.value() <= 0:
+            time.sleep(1.0)
+            if webhook.r is None or webhook.r.zcard(webhook.PENDING_ZSET) == 0:
+                break
+        time.sleep(0.2)
+    ops = _ops
+
+    replies = len(reply_times)
+    span = (max(reply_times) - start) if reply_times else float("nan")
+    print()
+    print(f"webhook   n={len(webhook_ms)} status={statuses}")
+    print(
+        f"webhook   p50={_pct(webhook_ms, 50):.1f}ms p95={_pct(webhook_ms, 95):.1f}ms "
+        f"p99={_pct(webhook_ms, 99):.1f}ms max={max(webhook_ms or [0]):.1f}ms"
+    )
+    print(
+        f"resposta  n={replies} p50={_pct(e2e, 50):.2f}s p95={_pct(e2e, 95):.2f}s p99={_pct(e2e, 99):.2f}s "
+        f"(inclui debounce de {args.debounce}s)"
+    )
+    print(f"vazao     {replies / span if replies else 0:.2f} respostas/s")
+    if counting:
+        print(f"redis     {ops} comandos, {ops / max(1, replies):.1f} por resposta")
+    else:
+        print("redis     n/d com --store local")
+    print(f"fakes     gemini={gem.calls} midias={evo.media_requests}")
+
+    server.shutdown()
+    evo.stop()
+    gem.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""Reenvia payloads gravados (WEBHOOK_RECORD_FILE) para um webhook em execucao.
+
+Atencao: a instancia alvo responde de verdade. Aponte-a para os servidores de
+bench/fakes.py (EVOLUTION_API, GEMINI_BASE_URL) antes de reproduzir trafego.
+
+Velocidade:
+    --speed 1     ritmo original
+    --speed 10    10x mais rapido
+    --speed 0     o mais rapido possivel (limitado por --clients)
+
+Por padrao os ids das mensagens recebem um sufixo por execucao, para o dedupe
+nao descartar um replay repetido; --keep-ids mede o dedupe com os ids reais.
+Ao final, compara as metricas do /metrics do alvo antes e depois.
+
+Uso:
+    python bench/replay.py data/webhook_record.jsonl \
+        [--target http://localhost:5000/webhook] [--speed 1] [--limit 1000]
+"""
+import argparse
+import copy
+import json
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+WATCHED = (
+    "webhook_requests_total",
+    "webhook_messages_total",
+    "dedupe_hits_total",
+    "replies_total",
+    "reply_duration_seconds_count",
+    "reply_duration_seconds_sum",
+    "debounce_wait_seconds_count",
+    "debounce_wait_seconds_sum",
+)
+_METRIC_RE = re.compile(r"^([a-zA-Z_:][\w:]*)(\{[^}]*\})?\s+(\S+)$")
+
+
+def _load(path: str, limit: int) -> list[tuple[float, dict]]:
+    out = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            rec = json.loads(line)
+            out.append((float(rec["t"]), rec["payload"]))
+            if limit and len(out) >= limit:
+                break
+    out.sort(key=lambda x: x[0])
+    return out
+
+
+def _rewrite_ids(payload: dict, suffix: str) -> dict:
+    payload = copy.deepcopy(payload)
+    data = payload.get("data")
+    for item in data if isinstance(data, list) else [data]:
+        key = (item or {}).get("key") if isinstance(item, dict) else None
+        if isinstance(key, dict) and key.get("id"):
+            key["id"] = f"{key['id']}-{suffix}"
+    return payload
+
+
+def _scrape(metrics_url: str) -> dict:
+    try:
+        text = requests.get(metrics_url, timeout=5).text
+    except Exception:
+        return {}
+    out = {}
+    for line in text.splitlines():
+        m = _METRIC_RE.match(line)
+        if m and m.group(1) in WATCHED:
+            out[m.group(1) + (m.group(2) or "")] = float(m.group(3))
+    return out
+
+
+def _pct(values: list, p: float) -> float:
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))]
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("file")
+    ap.add_argument("--target", default="http://localhost:5000/webhook")
+    ap.add_argument("--speed", type=float, default=1.0)
+    ap.add_argument("--limit", type=int, default=0)
+    ap.add_argument("--clients", type=int, default=32)
+    ap.add_argument("--keep-ids", action="store_true")
+    args = ap.parse_args()
+
+    records = _load(args.file, args.limit)
+    if not records:
+        print("[replay] arquivo vazio")
+        return
+    metrics_url = args.target.rsplit("/", 1)[0] + "/metrics"
+    suffix = uuid.uuid4().hex[:6]
+    span_orig = records[-1][0] - records[0][0]
+    print(
+        f"[replay] {len(records)} payloads, {span_orig:.1f}s originais, speed={args.speed or 'max'}, "
+        f"ids={'originais' if args.keep_ids else 'sufixo ' + suffix}"
+    )
+
+    before = _scrape(metrics_url)
+    http = requests.Session()
+    http.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=args.clients))
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+
+    def post(payload):
+        t0 = time.perf_counter()
+        try:
+            status = http.post(args.target, json=payload, timeout=60).status_code
+        except Exception:
+            status = "erro"
+        with lock:
+            latencies.append((time.perf_counter() - t0) * 1000)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    base_t = records[0][0]
+    start = time.time()
+    lag = []
+    with ThreadPoolExecutor(max_workers=args.clients) as pool:
+        for t, payload in records:
+            if args.speed > 0:
+                due = start + (t - base_t) / args.speed
+                delay = due - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+                elif delay < -0.005:
+                    lag.append(-delay)
+            pool.submit(post, payload if args.keep_ids else _rewrite_ids(payload, suffix))
+    elapsed = time.time() - start
+
+    print(f"[replay] status={statuses} em {elapsed:.1f}s ({len(records) / elapsed:.1f} payloads/s)")
+    print(
+        f"[replay] webhook p50={_pct(latencies, 50):.1f}ms p95={_pct(latencies, 95):.1f}ms "
+        f"p99={_pct(latencies, 99):.1f}ms"
+    )
+    if lag:
+        print(f"[replay] atraso sobre o ritmo pedido: max={max(lag) * 1000:.0f}ms ({len(lag)} envios atrasados)")
+
+    after = _scrape(metrics_url)
+    if after:
+        print("[replay] delta das metricas do alvo (processo que respondeu o scrape):")
+        for name in sorted(after):
+            delta = after[name] - before.get(name, 0.0)
+            if delta:
+                print(f"  {name} +{delta:g}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""Idas ao Redis por payload do /webhook: fluxo legado (item a item) x pipeline.
+
+Usa o Redis de CACHE_REDIS_URI ou, com --fake, o fakeredis (precisa de lupa
+para os scripts Lua).
+
+Conta tambem os comandos imediatos do pipeline: um pipeline com scripts manda
+SCRIPT EXISTS (e SCRIPT LOAD na primeira vez) antes do lote, entao o caminho
+do webhook fica em 3 idas por payload, nao 2.
+
+Uso:
+    python bench/webhook_pipeline.py [--fake] [--sizes 1,10,100]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ["WEBHOOK_ENABLED"] = "true"
+# Resumo roda em threads de fundo e poluiria a contagem do caminho do webhook.
+os.environ["SUMMARY_ENABLED"] = "false"
+
+import redis  # noqa: E402
+from redis.client import Pipeline  # noqa: E402
+
+import memory  # noqa: E402
+import webhook  # noqa: E402
+from buffer import PENDING_ZSET, _resolve_buffer_delay_seconds  # noqa: E402
+from redis_conn import REDIS_URI  # noqa: E402
+
+PREFIX = "bench"
+_round_trips = 0
+
+
+def _count_round_trips():
+    orig_exec = redis.Redis.execute_command
+    orig_pipe = Pipeline.execute
+    orig_immediate = Pipeline.immediate_execute_command
+
+    def execute_command(self, *args, **kwargs):
+        global _round_trips
+        _round_trips += 1
+        return orig_exec(self, *args, **kwargs)
+
+    def execute(self, *args, **kwargs):
+        global _round_trips
+        if self.command_stack:
+            _round_trips += 1
+        return orig_pipe(self, *args, **kwargs)
+
+    def immediate_execute_command(self, *args, **kwargs):
+        # SCRIPT EXISTS / SCRIPT LOAD de Pipeline.load_scripts.
+        global _round_trips
+        _round_trips += 1
+        return orig_immediate(self, *args, **kwargs)
+
+    redis.Redis.execute_command = execute_command
+    Pipeline.execute = execute
+    Pipeline.immediate_execute_command = immediate_execute_command
+
+
+def _use_client(client):
+    memory.r = client
+    memory.REDIS_PREFIX = PREFIX
+    memory._append_script = client.register_script(memory._APPEND_LUA)
+    webhook.r = client
+    webhook.REDIS_PREFIX = PREFIX
+
+
+def _payload(n: int, run: int) -> dict:
+    data = []
+    for i in range(n):
+        data.append(
+            {
+                "key": {"id": f"bench-{run}-{i}", "remoteJid": f"55690000{i % 20:04d}@s.whatsapp.net", "fromMe": False},
+                "message": {"conversation": f"mensagem {i} do lote {run}"},
+            }
+        )
+    return {"event": "messages.upsert", "data": data}
+
+
+def _legacy_ingest(client, payload: dict):
+    # Reproduz o fluxo antigo: SET NX, RPUSH/LTRIM/EXPIRE, RPUSH/ZADD por item.
+    for item in payload["data"]:
+        msg_id = item["key"]["id"]
+        if not client.set(f"{PREFIX}:processed:{msg_id}", "1", ex=21600, nx=True):
+            continue
+        phone = item["key"]["remoteJid"].split("@")[0]
+        text = item["message"]["conversation"]
+        entry = json.dumps({"t": int(time.time()), "role": "user", "content": text}, ensure_ascii=False)
+        key = f"{PREFIX}:chat:{phone}"
+        client.rpush(key, entry)
+        client.ltrim(key, -12, -1)
+        client.expire(key, 6 * 60 * 60)
+        client.rpush(f"{PREFIX}:buffer:{phone}", json.dumps({"type": "text", "content": text}))
+        client.zadd(PENDING_ZSET, {phone: int(time.time()) + _resolve_buffer_delay_seconds()})
+
+
+def main():
+    global _round_trips
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--fake", action="store_true")
+    ap.add_argument("--sizes", default="1,10,100")
+    ap.add_argument("--runs", type=int, default=20)
+    args = ap.parse_args()
+
+    if args.fake:
+        import fakeredis
+
+        client = fakeredis.FakeRedis(decode_responses=True)
+    else:
+        client = redis.Redis.from_url(REDIS_URI, decode_responses=True)
+    _use_client(client)
+    _count_round_trips()
+    http = webhook.app.test_client()
+
+    print(f"{'itens':>5} {'modo':<8} {'idas/payload':>13} {'idas/msg':>9} {'ms/payload':>11}")
+    for n in [int(x) for x in args.sizes.split(",") if x.strip()]:
+        for mode in ("legado", "pipeline"):
+            client.flushdb()
+            _round_trips = 0
+            t0 = time.perf_counter()
+            for run in range(args.runs):
+                payload = _payload(n, run)
+                if mode == "legado":
+                    _legacy_ingest(client, payload)
+                else:
+                    http.post("/webhook", json=payload)
+            elapsed = (time.perf_counter() - t0) / args.runs
+            per_payload = _round_trips / args.runs
+            print(f"{n:>5} {mode:<8} {per_payload:>13.1f} {per_payload / n:>9.2f} {elapsed * 1000:>11.2f}")
+    client.flushdb()
+
+
+if __name__ == "__main__":
+    main()
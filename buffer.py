@@ -1,57 +1,304 @@
 import json
 import os
+import re
 import time
 from pathlib import Path
 
+from codec import decode, encode
+from local_store import register_script_impl
+
 PENDING_ZSET = "pending_zset"
 BUFFER_DELAY_SECONDS = int(os.getenv("BUFFER_DELAY_SECONDS", "120"))
 
+# Debounce adaptativo: o response_delay_seconds vira o teto da espera. O prazo
+# de cada telefone sai do intervalo tipico entre as mensagens de uma mesma
+# rajada (EWMA por telefone), encurta em mensagens "terminais" (pergunta) e
+# acompanha a presenca da Evolution (digitando estende, pausado encurta).
+DEBOUNCE_ADAPTIVE = os.getenv("DEBOUNCE_ADAPTIVE", "true").lower() == "true"
+# Espera de quem ainda nao tem intervalo aprendido.
+DEBOUNCE_DEFAULT_SECONDS = float(os.getenv("DEBOUNCE_DEFAULT_SECONDS", "30"))
+DEBOUNCE_MIN_SECONDS = float(os.getenv("DEBOUNCE_MIN_SECONDS", "3"))
+# Espera = fator * intervalo tipico entre mensagens da rajada.
+DEBOUNCE_GAP_FACTOR = float(os.getenv("DEBOUNCE_GAP_FACTOR", "3.0"))
+DEBOUNCE_GAP_ALPHA = float(os.getenv("DEBOUNCE_GAP_ALPHA", "0.3"))
+# Mensagem terminal: responde se ninguem voltar a digitar neste prazo.
+DEBOUNCE_TERMINAL_SECONDS = float(os.getenv("DEBOUNCE_TERMINAL_SECONDS", "8"))
+DEBOUNCE_TERMINAL_PATTERN = re.compile(os.getenv("DEBOUNCE_TERMINAL_PATTERN", r"\?\s*$"))
+# "composing"/"recording" empurra o prazo para agora + isto (limitado ao teto).
+DEBOUNCE_TYPING_EXTEND_SECONDS = float(os.getenv("DEBOUNCE_TYPING_EXTEND_SECONDS", "15"))
+# "paused"/"available" desfaz a extensao: prazo volta para agora + isto, mas
+# nunca antes do prazo calculado na ultima mensagem.
+DEBOUNCE_PAUSED_GRACE_SECONDS = float(os.getenv("DEBOUNCE_PAUSED_GRACE_SECONDS", "5"))
+DEBOUNCE_CADENCE_TTL_SECONDS = int(os.getenv("DEBOUNCE_CADENCE_TTL_SECONDS", str(30 * 24 * 60 * 60)))
+
+_TYPING_STATES = {"composing", "recording"}
+_IDLE_STATES = {"paused", "available", "unavailable"}
+
 _BASE_DIR = Path(__file__).resolve().parent
 _STORE_FILE = Path(os.getenv("STORE_PROFILE_PATH", "store_profile.json"))
 if not _STORE_FILE.is_absolute():
     _STORE_FILE = _BASE_DIR / _STORE_FILE
 
 
+# (mtime do store_profile.json, delay) para nao reler o arquivo a cada mensagem.
+_delay_cache = (None, BUFFER_DELAY_SECONDS)
+
+
 def _resolve_buffer_delay_seconds() -> int:
+    global _delay_cache
     delay = BUFFER_DELAY_SECONDS
     try:
         if _STORE_FILE.exists():
+            mtime = _STORE_FILE.stat().st_mtime_ns
+            if _delay_cache[0] == mtime:
+                return _delay_cache[1]
             profile = json.loads(_STORE_FILE.read_text(encoding="utf-8"))
             cfg = profile.get("ai_settings") or {}
             val = cfg.get("response_delay_seconds")
             if val is not None:
                 delay = int(val)
+            delay = max(0, min(600, delay))
+            _delay_cache = (mtime, delay)
+            return delay
     except Exception:
         # Em caso de erro de leitura do arquivo, mantem fallback padrao.
         pass
     return max(0, min(600, delay))
 
 
-def buffer_add(r, prefix, phone, data, msg_id=None):
+def is_terminal_text(text) -> bool:
+    """Mensagem que costuma fechar a rajada (padrao: termina com "?")."""
+    return isinstance(text, str) and bool(DEBOUNCE_TERMINAL_PATTERN.search(text))
+
+
+def _cadence_key(prefix, phone) -> str:
+    return f"{prefix}:cadence:{phone}"
+
+
+# KEYS[1] = pending_zset, KEYS[2] = cadencia do telefone (hash: g = intervalo
+# tipico, n = amostras, l = ultima mensagem, d = prazo dado pela ultima mensagem).
+# ARGV = member, now, teto, terminal, alpha, fator, minimo, padrao, terminal_s, ttl.
+# So aprende o intervalo quando o telefone ja esta no zset (mesma rajada).
+# Retorna a espera escolhida (string, para nao truncar no retorno do Lua).
+_SCHEDULE_LUA = """
+local now = tonumber(ARGV[2])
+local ceiling = tonumber(ARGV[3])
+local prev = redis.call('ZSCORE', KEYS[1], ARGV[1])
+local c = redis.call('HMGET', KEYS[2], 'g', 'n', 'l')
+local ewma = tonumber(c[1])
+local n = tonumber(c[2]) or 0
+local last = tonumber(c[3])
+if prev and last and now >= last then
+  local gap = now - last
+  if ewma then
+    ewma = tonumber(ARGV[5]) * gap + (1 - tonumber(ARGV[5])) * ewma
+  else
+    ewma = gap
+  end
+  n = n + 1
+  redis.call('HSET', KEYS[2], 'g', tostring(ewma), 'n', n)
+end
+redis.call('HSET', KEYS[2], 'l', ARGV[2])
+redis.call('EXPIRE', KEYS[2], tonumber(ARGV[10]))
+local delay = tonumber(ARGV[8])
+if ewma then
+  delay = tonumber(ARGV[6]) * ewma
+end
+if delay < tonumber(ARGV[7]) then delay = tonumber(ARGV[7]) end
+if ARGV[4] == '1' and delay > tonumber(ARGV[9]) then delay = tonumber(ARGV[9]) end
+if delay > ceiling then delay = ceiling end
+redis.call('HSET', KEYS[2], 'd', tostring(now + delay))
+redis.call('ZADD', KEYS[1], now + delay, ARGV[1])
+return tostring(delay)
+"""
+
+
+def _schedule_local(store, keys, args):
+    # Mesmo comportamento do _SCHEDULE_LUA para o backend em memoria.
+    zset_key, cadence_key = keys
+    member = args[0]
+    now, ceiling = float(args[1]), float(args[2])
+    alpha, factor, minimum, default, terminal_s = (float(a) for a in args[4:9])
+    prev = store.zscore(zset_key, member)
+    cadence = store.hgetall(cadence_key)
+    ewma = float(cadence["g"]) if "g" in cadence else None
+    n = int(cadence.get("n", 0))
+    last = float(cadence["l"]) if "l" in cadence else None
+    if prev is not None and last is not None and now >= last:
+        gap = now - last
+        ewma = gap if ewma is None else alpha * gap + (1 - alpha) * ewma
+        n += 1
+        store.hset(cadence_key, mapping={"g": repr(ewma), "n": str(n)})
+    store.hset(cadence_key, mapping={"l": str(args[1])})
+    store.expire(cadence_key, int(args[9]))
+    delay = default if ewma is None else factor * ewma
+    delay = max(delay, minimum)
+    if str(args[3]) == "1":
+        delay = min(delay, terminal_s)
+    delay = min(delay, ceiling)
+    store.hset(cadence_key, "d", repr(now + delay))
+    store.zadd(zset_key, {member: now + delay})
+    return repr(delay)
+
+
+register_script_impl(_SCHEDULE_LUA, _schedule_local)
+
+_scripts = {}
+
+
+def _script(lua_source):
+    from redis_conn import get_redis
+
+    client = get_redis()
+    script = _scripts.get((id(client), lua_source))
+    if script is None:
+        script = _scripts[(id(client), lua_source)] = client.register_script(lua_source)
+    return script
+
+
+def schedule_flush(r, prefix, phone, member=None, max_delay=None, terminal=False, now=None):
+    """Reagenda o flush do telefone com o prazo adaptativo; `r` pode ser um pipeline."""
+    if max_delay is None:
+        max_delay = _resolve_buffer_delay_seconds()
+    now = time.time() if now is None else now
+    return _script(_SCHEDULE_LUA)(
+        keys=[PENDING_ZSET, _cadence_key(prefix, phone)],
+        args=[
+            member or phone,
+            repr(float(now)),
+            max_delay,
+            "1" if terminal else "0",
+            DEBOUNCE_GAP_ALPHA,
+            DEBOUNCE_GAP_FACTOR,
+            DEBOUNCE_MIN_SECONDS,
+            DEBOUNCE_DEFAULT_SECONDS,
+            DEBOUNCE_TERMINAL_SECONDS,
+            DEBOUNCE_CADENCE_TTL_SECONDS,
+        ],
+        client=r,
+    )
+
+
+# KEYS como no _SCHEDULE_LUA; ARGV = member, now, typing(1/0), extensao, carencia.
+# Digitando: prazo = max(prazo, now + extensao). Parado: desfaz extensoes,
+# prazo = min(prazo, max(now + carencia, d)); "paused" chega logo depois de
+# cada mensagem enviada, entao nunca antecipa o prazo da propria mensagem.
+_PRESENCE_LUA = """
+local prev = tonumber(redis.call('ZSCORE', KEYS[1], ARGV[1]))
+if not prev then return 0 end
+local now = tonumber(ARGV[2])
+local target
+if ARGV[3] == '1' then
+  target = now + tonumber(ARGV[4])
+  if target <= prev then return 0 end
+else
+  target = now + tonumber(ARGV[5])
+  local d = tonumber(redis.call('HGET', KEYS[2], 'd'))
+  if d and d > target then target = d end
+  if target >= prev then return 0 end
+end
+redis.call('ZADD', KEYS[1], target, ARGV[1])
+return 1
+"""
+
+
+def _presence_local(store, keys, args):
+    # Mesmo comportamento do _PRESENCE_LUA para o backend em memoria.
+    zset_key, cadence_key = keys
+    member = args[0]
+    prev = store.zscore(zset_key, member)
+    if prev is None:
+        return 0
+    now = float(args[1])
+    if str(args[2]) == "1":
+        target = now + float(args[3])
+        if target <= prev:
+            return 0
+    else:
+        target = now + float(args[4])
+        d = store.hgetall(cadence_key).get("d")
+        if d is not None and float(d) > target:
+            target = float(d)
+        if target >= prev:
+            return 0
+    store.zadd(zset_key, {member: target})
+    return 1
+
+
+register_script_impl(_PRESENCE_LUA, _presence_local)
+
+
+def presence_update(r, prefix, phone, state, member=None, max_delay=None, now=None):
+    """Ajusta o prazo de quem ja tem mensagem no buffer conforme a presenca.
+
+    Sem mensagem pendente nao faz nada; `r` pode ser um pipeline.
+    """
+    state = str(state or "").lower()
+    if state not in _TYPING_STATES and state not in _IDLE_STATES:
+        return None
+    if max_delay is None:
+        max_delay = _resolve_buffer_delay_seconds()
+    if max_delay <= 0:
+        return None
+    now = time.time() if now is None else now
+    return _script(_PRESENCE_LUA)(
+        keys=[PENDING_ZSET, _cadence_key(prefix, phone)],
+        args=[
+            member or phone,
+            repr(float(now)),
+            "1" if state in _TYPING_STATES else "0",
+            min(DEBOUNCE_TYPING_EXTEND_SECONDS, max_delay),
+            min(DEBOUNCE_PAUSED_GRACE_SECONDS, max_delay),
+        ],
+        client=r,
+    )
+
+
+def buffer_add(r, prefix, phone, data, msg_id=None, delay=None, member=None):
+    """Enfileira a mensagem e reagenda o telefone; `r` pode ser um pipeline.
+
+    `member` e o item no PENDING_ZSET (tenants.Tenant.member); padrao = phone.
+    `delay` e a espera maxima (response_delay_seconds); com DEBOUNCE_ADAPTIVE
+    o prazo real e calculado por schedule_flush.
+    """
     key = f"{prefix}:buffer:{phone}"
-    # Armazena como JSON string para suportar texto ou dict
-    r.rpush(key, json.dumps(data))
-    delay = _resolve_buffer_delay_seconds()
-    r.zadd(PENDING_ZSET, {phone: int(time.time()) + delay})
+    if isinstance(data, dict) and "t" not in data:
+        # Momento da chegada, usado para medir a espera do debounce.
+        data = {**data, "t": time.time()}
+    # Codec compacto; aceita texto ou dict
+    r.rpush(key, encode(data))
+    if delay is None:
+        delay = _resolve_buffer_delay_seconds()
+    if DEBOUNCE_ADAPTIVE and delay > 0:
+        is_dict = isinstance(data, dict)
+        terminal = is_dict and data.get("type") == "text" and is_terminal_text(data.get("content"))
+        now = data.get("t") if is_dict else None
+        schedule_flush(r, prefix, phone, member=member, max_delay=delay, terminal=terminal, now=now)
+        return True
+    r.zadd(PENDING_ZSET, {member or phone: int(time.time()) + delay})
     return True
 
 
 def buffer_pop_all(r, prefix, phone):
+    """Le e apaga o buffer atomicamente; `r` deve ser o cliente binario (memory.rb)."""
     key = f"{prefix}:buffer:{phone}"
-    msgs = r.lrange(key, 0, -1)
-    r.delete(key)
+    pipe = r.pipeline()
+    pipe.lrange(key, 0, -1)
+    pipe.delete(key)
+    msgs, _ = pipe.execute()
     # Decodifica cada item do buffer
-    return [json.loads(m) for m in msgs]
+    return [decode(m) for m in msgs]
 
 
-def try_lock(r, prefix, phone, ttl_sec=60):
-    key = f"{prefix}:lock:{phone}"
-    if r.setnx(key, 1):
-        r.expire(key, ttl_sec)
-        return True
-    return False
-
+def buffer_requeue(r, prefix, phone, items, member=None):
+    """Devolve itens ja retirados para a frente do buffer e agenda o flush agora.
 
-def unlock(r, prefix, phone):
-    key = f"{prefix}:lock:{phone}"
-    r.delete(key)
+    Usado quando o worker perde o lease no meio da resposta: quem assumiu o
+    telefone responde estes itens (antes dos que chegaram depois).
+    """
+    if not items:
+        return
+    pipe = r.pipeline(transaction=False)
+    pipe.lpush(f"{prefix}:buffer:{phone}", *[encode(item) for item in reversed(items)])
+    pipe.zadd(PENDING_ZSET, {member or phone: time.time()})
+    pipe.execute()
@@ -0,0 +1,100 @@
+"""Codificacao compacta dos itens de historico e buffer guardados no Redis.
+
+Formato: 1 byte de versao + corpo. Campos conhecidos viram inteiros curtos e
+textos longos sao comprimidos com zlib. Itens antigos em JSON (comecam com
+'{' ou '"') continuam sendo lidos normalmente.
+"""
+import json
+import os
+import zlib
+
+try:
+    import msgpack
+except ImportError:  # dependencia opcional; sem ela usa JSON compacto
+    msgpack = None
+
+CODEC_ZLIB_MIN_BYTES = int(os.getenv("CODEC_ZLIB_MIN_BYTES", "512"))
+
+V_MSGPACK = 0x01
+V_MSGPACK_ZLIB = 0x02
+V_JSON = 0x11
+V_JSON_ZLIB = 0x12
+
+# Nunca reutilize nem renumere tags: itens antigos continuam no Redis.
+FIELD_TAGS = {
+    "t": 0,
+    "role": 1,
+    "content": 2,
+    "type": 3,
+    "id": 4,
+    "mime": 5,
+    "seconds": 6,
+    "caption": 7,
+    "sha": 8,
+}
+_TAG_FIELDS = {v: k for k, v in FIELD_TAGS.items()}
+ROLE_CODES = {"user": 0, "assistant": 1}
+_CODE_ROLES = {v: k for k, v in ROLE_CODES.items()}
+
+
+def _compact(obj: dict) -> dict:
+    out = {}
+    for k, v in obj.items():
+        if k == "role" and v in ROLE_CODES:
+            v = ROLE_CODES[v]
+        out[FIELD_TAGS.get(k, k)] = v
+    return out
+
+
+def _expand(obj: dict) -> dict:
+    out = {}
+    for k, v in obj.items():
+        if isinstance(k, str) and k.isdigit():
+            k = int(k)
+        name = _TAG_FIELDS.get(k, k)
+        if name == "role" and isinstance(v, int):
+            v = _CODE_ROLES.get(v, "assistant")
+        out[name] = v
+    return out
+
+
+def encode(obj) -> bytes:
+    if not isinstance(obj, dict):
+        obj = {"type": "text", "content": str(obj)}
+    compact = _compact(obj)
+    if msgpack is not None:
+        body = msgpack.packb(compact, use_bin_type=True)
+        version, zversion = V_MSGPACK, V_MSGPACK_ZLIB
+    else:
+        body = json.dumps({str(k): v for k, v in compact.items()}, ensure_ascii=False, separators=(",", ":")).encode(
+            "utf-8"
+        )
+        version, zversion = V_JSON, V_JSON_ZLIB
+
+    if len(body) >= CODEC_ZLIB_MIN_BYTES:
+        packed = zlib.compress(body, 6)
+        if len(packed) < len(body):
+            return bytes([zversion]) + packed
+    return bytes([version]) + body
+
+
+def decode(raw):
+    if raw is None:
+        return None
+    if isinstance(raw, str):
+        raw = raw.encode("utf-8")
+    if not raw:
+        return None
+
+    version = raw[0]
+    if version in (V_MSGPACK, V_MSGPACK_ZLIB):
+        if msgpack is None:
+            raise RuntimeError("item em msgpack no Redis, mas o pacote msgpack nao esta instalado")
+        body = raw[1:] if version == V_MSGPACK else zlib.decompress(raw[1:])
+        return _expand(msgpack.unpackb(body, raw=False, strict_map_key=False))
+    if version in (V_JSON, V_JSON_ZLIB):
+        body = raw[1:] if version == V_JSON else zlib.decompress(raw[1:])
+        return _expand(json.loads(body.decode("utf-8")))
+
+    # Legado: JSON puro gravado antes do codec.
+    return json.loads(raw.decode("utf-8"))
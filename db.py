@@ -1,4 +1,5 @@
 import os
+import threading
 import unicodedata
 from difflib import SequenceMatcher
 from pathlib import Path
@@ -9,14 +10,34 @@ from sqlalchemy import bindparam, create_engine, text
 load_dotenv(dotenv_path=".env", override=True)
 
 _db_url = os.getenv("DATABASE_URL") or os.getenv("DATABASE_CONNECTION_URI")
-if not _db_url:
-    Path("data").mkdir(parents=True, exist_ok=True)
+_DEFAULT_SQLITE = not _db_url
+if _DEFAULT_SQLITE:
     _db_url = "sqlite:///data/local.db"
-    print("[db] DATABASE_URL nao definido. Usando fallback SQLite em data/local.db")
+IS_SQLITE = _db_url.split(":", 1)[0].split("+", 1)[0] == "sqlite"
 
-engine = create_engine(_db_url, pool_pre_ping=True)
-IS_SQLITE = engine.dialect.name == "sqlite"
+# Engine (e o driver, ex.: psycopg) so sao criados no primeiro uso.
+_engine = None
+_engine_lock = threading.Lock()
 _SCHEMA_READY = False
+# Incrementado a cada escrita no catalogo feita por este processo.
+_CATALOG_WRITES = 0
+
+
+def get_engine():
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                if _DEFAULT_SQLITE:
+                    Path("data").mkdir(parents=True, exist_ok=True)
+                    print("[db] DATABASE_URL nao definido. Usando fallback SQLite em data/local.db")
+                _engine = create_engine(_db_url, pool_pre_ping=True)
+    return _engine
+
+
+def warmup() -> None:
+    """Cria o engine, abre a primeira conexao e garante o schema."""
+    _ensure_schema_once()
 
 
 def _normalize_text(v: str) -> str:
@@ -73,18 +94,40 @@ def _ensure_schema_once():
     _SCHEMA_READY = True
 
 
+def _bump_catalog():
+    global _CATALOG_WRITES
+    _CATALOG_WRITES += 1
+
+
+def catalog_signature() -> tuple:
+    """Assinatura barata do catalogo para detectar mudancas (inclusive de outros processos)."""
+    _ensure_schema_once()
+    q = text(
+        """
+        SELECT
+          (SELECT COUNT(*) FROM products),
+          (SELECT MAX(updated_at) FROM products),
+          (SELECT COUNT(*) FROM product_aliases),
+          (SELECT MAX(id) FROM product_aliases)
+        """
+    )
+    with get_engine().begin() as conn:
+        row = conn.execute(q).first()
+    return (_CATALOG_WRITES, *[str(v) for v in (row or ())])
+
+
 def _phone_digits(v: str) -> str:
     return "".join(ch for ch in str(v or "") if ch.isdigit())
 
 
 def get_client_id_by_instance(instance: str) -> str | None:
     q = text("SELECT id FROM clients WHERE evolution_instance = :i")
-    with engine.begin() as conn:
+    with get_engine().begin() as conn:
         row = conn.execute(q, {"i": instance}).first()
         return str(row[0]) if row else None
 
 
-def get_prompt_for_client(client_id: str) -> str:
+def get_prompt_for_client(client_id: str, default: str = "Voce e um atendente virtual.") -> str:
     q = text(
         """
       SELECT system_prompt
@@ -94,9 +137,9 @@ def get_prompt_for_client(client_id: str) -> str:
       LIMIT 1
     """
     )
-    with engine.begin() as conn:
+    with get_engine().begin() as conn:
         row = conn.execute(q, {"cid": client_id}).first()
-        return row[0] if row else "Voce e um atendente virtual."
+        return row[0] if row else default
 
 
 def ensure_products_table() -> None:
@@ -143,6 +186,20 @@ def ensure_products_table() -> None:
             )
             """
         )
+        ddl_messages = text(
+            """
+            CREATE TABLE IF NOT EXISTS messages (
+              id INTEGER PRIMARY KEY AUTOINCREMENT,
+              archive_id TEXT NOT NULL UNIQUE,
+              namespace TEXT NOT NULL DEFAULT '',
+              phone TEXT NOT NULL,
+              role TEXT NOT NULL,
+              content TEXT NOT NULL DEFAULT '',
+              sent_at INTEGER NOT NULL DEFAULT 0,
+              created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+            )
+            """
+        )
     else:
         ddl_products = text(
             """
@@ -184,10 +241,27 @@ def ensure_products_table() -> None:
             )
             """
         )
-    with engine.begin() as conn:
+        ddl_messages = text(
+            """
+            CREATE TABLE IF NOT EXISTS messages (
+              id BIGSERIAL PRIMARY KEY,
+              archive_id VARCHAR(64) NOT NULL UNIQUE,
+              namespace VARCHAR(160) NOT NULL DEFAULT '',
+              phone VARCHAR(80) NOT NULL,
+              role VARCHAR(20) NOT NULL,
+              content TEXT NOT NULL DEFAULT '',
+              sent_at BIGINT NOT NULL DEFAULT 0,
+              created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+            )
+            """
+        )
+    ddl_messages_idx = text("CREATE INDEX IF NOT EXISTS idx_messages_chat ON messages (namespace, phone, id)")
+    with get_engine().begin() as conn:
         conn.execute(ddl_products)
         conn.execute(ddl_aliases)
         conn.execute(ddl_contacts)
+        conn.execute(ddl_messages)
+        conn.execute(ddl_messages_idx)
 
 
 def _normalize_product_row(row: dict) -> dict:
@@ -227,7 +301,7 @@ def _get_alias_map(conn, product_ids: list[int]) -> dict[int, list[str]]:
 def get_product_aliases(product_id: int) -> list[str]:
     _ensure_schema_once()
     q = text("SELECT alias FROM product_aliases WHERE product_id = :id ORDER BY alias ASC")
-    with engine.begin() as conn:
+    with get_engine().begin() as conn:
         rows = conn.execute(q, {"id": int(product_id)}).mappings().all()
         return [str(r["alias"]) for r in rows]
 
@@ -246,12 +320,13 @@ def set_product_aliases(product_id: int, aliases: list[str]) -> list[str]:
         seen.add(key)
         clean.append(alias)
 
-    with engine.begin() as conn:
+    with get_engine().begin() as conn:
         conn.execute(text("DELETE FROM product_aliases WHERE product_id = :id"), {"id": int(product_id)})
         if clean:
             ins = text("INSERT INTO product_aliases (product_id, alias) VALUES (:product_id, :alias)")
             for alias in clean:
                 conn.execute(ins, {"product_id": int(product_id), "alias": alias})
+    _bump_catalog()
     return clean
 
 
@@ -271,7 +346,7 @@ def list_products(search: str = "", only_active: bool = False) -> list[dict]:
         LIMIT 500
         """
     )
-    with engine.begin() as conn:
+    with get_engine().begin() as conn:
         rows = [_normalize_product_row(dict(r)) for r in conn.execute(q).mappings().all()]
         ids = [int(r["id"]) for r in rows]
         alias_map = _get_alias_map(conn, ids)
@@ -310,9 +385,10 @@ def create_product(data: dict) -> dict:
             VALUES (:name, :sku, :category, :description, :price, :stock, :active)
             """
         )
-        with engine.begin() as conn:
+        with get_engine().begin() as conn:
             res = conn.execute(q, payload)
             created = _get_product_by_id(conn, int(res.lastrowid)) or {}
+        _bump_catalog()
         if created:
             created["aliases"] = set_product_aliases(int(created["id"]), aliases)
         return created
@@ -324,9 +400,10 @@ def create_product(data: dict) -> dict:
         RETURNING id, name, sku, category, description, price, stock, active, created_at, updated_at
         """
     )
-    with engine.begin() as conn:
+    with get_engine().begin() as conn:
         row = conn.execute(q, payload).mappings().first()
         created = _normalize_product_row(dict(row)) if row else {}
+    _bump_catalog()
     if created:
         created["aliases"] = set_product_aliases(int(created["id"]), aliases)
     return created
@@ -353,7 +430,7 @@ def update_product(product_id: int, data: dict) -> dict | None:
              WHERE id = :id
             """
         )
-        with engine.begin() as conn:
+        with get_engine().begin() as conn:
             res = conn.execute(q, payload)
             if (res.rowcount or 0) > 0:
                 updated = _get_product_by_id(conn, int(product_id))
@@ -373,10 +450,11 @@ def update_product(product_id: int, data: dict) -> dict | None:
              RETURNING id, name, sku, category, description, price, stock, active, created_at, updated_at
             """
         )
-        with engine.begin() as conn:
+        with get_engine().begin() as conn:
             row = conn.execute(q, payload).mappings().first()
             updated = _normalize_product_row(dict(row)) if row else None
     if updated:
+        _bump_catalog()
         updated["aliases"] = set_product_aliases(int(product_id), aliases)
     return updated
 
@@ -384,9 +462,12 @@ def update_product(product_id: int, data: dict) -> dict | None:
 def delete_product(product_id: int) -> bool:
     _ensure_schema_once()
     q = text("DELETE FROM products WHERE id = :id")
-    with engine.begin() as conn:
+    with get_engine().begin() as conn:
         res = conn.execute(q, {"id": int(product_id)})
-        return (res.rowcount or 0) > 0
+        deleted = (res.rowcount or 0) > 0
+    if deleted:
+        _bump_catalog()
+    return deleted
 
 
 def search_products_for_ai(query: str, limit: int = 5) -> list[dict]:
@@ -467,7 +548,7 @@ def upsert_contact(name: str, phone: str, notes: str = "") -> dict:
         raise ValueError("PHONE_REQUIRED")
 
     if IS_SQLITE:
-        with engine.begin() as conn:
+        with get_engine().begin() as conn:
             existing = conn.execute(
                 text("SELECT id FROM contacts WHERE phone_digits = :d"),
                 {"d": digits},
@@ -504,7 +585,7 @@ def upsert_contact(name: str, phone: str, notes: str = "") -> dict:
             ).mappings().first()
             return dict(row) if row else {}
 
-    with engine.begin() as conn:
+    with get_engine().begin() as conn:
         q = text(
             """
             INSERT INTO contacts (name, phone, phone_digits, notes)
@@ -542,7 +623,7 @@ def list_contacts(search: str = "") -> list[dict]:
         LIMIT 500
         """
     )
-    with engine.begin() as conn:
+    with get_engine().begin() as conn:
         return [dict(r) for r in conn.execute(q, params).mappings().all()]
 
 
@@ -552,7 +633,7 @@ def delete_contact_by_phone(phone: str) -> bool:
     if not digits:
         return False
     q = text("DELETE FROM contacts WHERE phone_digits = :d")
-    with engine.begin() as conn:
+    with get_engine().begin() as conn:
         res = conn.execute(q, {"d": digits})
         return (res.rowcount or 0) > 0
 
@@ -576,7 +657,7 @@ def get_contact_map_for_phones(phones: list[str]) -> dict[str, dict]:
             """
         ).bindparams(bindparam("digits", expanding=True))
     )
-    with engine.begin() as conn:
+    with get_engine().begin() as conn:
         rows = conn.execute(q, {"digits": list(digit_map.keys())}).mappings().all()
     out = {}
     for row in rows:
@@ -585,3 +666,52 @@ def get_contact_map_for_phones(phones: list[str]) -> dict[str, dict]:
         if original:
             out[original] = dict(row)
     return out
+
+
+def archive_messages(rows: list[dict]) -> int:
+    """Insere mensagens do arquivador em lote; archive_id repetido e ignorado.
+
+    rows: archive_id, namespace, phone, role, content, sent_at.
+    """
+    _ensure_schema_once()
+    if not rows:
+        return 0
+    if IS_SQLITE:
+        q = text(
+            """
+            INSERT OR IGNORE INTO messages (archive_id, namespace, phone, role, content, sent_at)
+            VALUES (:archive_id, :namespace, :phone, :role, :content, :sent_at)
+            """
+        )
+    else:
+        q = text(
+            """
+            INSERT INTO messages (archive_id, namespace, phone, role, content, sent_at)
+            VALUES (:archive_id, :namespace, :phone, :role, :content, :sent_at)
+            ON CONFLICT (archive_id) DO NOTHING
+            """
+        )
+    with get_engine().begin() as conn:
+        res = conn.execute(q, rows)
+        return res.rowcount if (res.rowcount or 0) >= 0 else len(rows)
+
+
+def list_archived_messages(phone: str, namespace: str, before_id: int | None = None, limit: int = 50) -> list[dict]:
+    """Pagina do arquivo de um chat, da mais nova para a mais antiga (cursor por id)."""
+    _ensure_schema_once()
+    params = {"p": str(phone or "").strip(), "ns": namespace, "n": max(1, min(int(limit or 50), 200))}
+    where_sql = "WHERE namespace = :ns AND phone = :p"
+    if before_id:
+        params["before"] = int(before_id)
+        where_sql += " AND id < :before"
+    q = text(
+        f"""
+        SELECT id, role, content, sent_at
+        FROM messages
+        {where_sql}
+        ORDER BY id DESC
+        LIMIT :n
+        """
+    )
+    with get_engine().begin() as conn:
+        return [dict(r) for r in conn.execute(q, params).mappings().all()]
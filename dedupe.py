@@ -0,0 +1,167 @@
+"""Dedupe dos ids de mensagem do webhook com memoria limitada.
+
+DEDUPE_MODE=keys e o formato antigo: uma chave {prefix}:processed:{id} com TTL
+por mensagem (milhoes de chaves vivas em volume alto).
+
+DEDUPE_MODE=bloom (padrao) usa um filtro de Bloom rotativo sobre bitmaps do
+Redis: um bitmap por janela de DEDUPE_BUCKET_SECONDS ({prefix}:dedupe:{n}),
+cada um com TTL do tamanho da janela de dedupe. O id e marcado so no bitmap
+atual e procurado nos anteriores que ainda cobrem PROCESSED_MSG_TTL_SECONDS.
+Memoria fixa por loja: buckets * m/8 bytes, com m calculado a partir de
+DEDUPE_BLOOM_CAPACITY (ids esperados por bucket) e DEDUPE_BLOOM_FP_RATE (taxa
+de falso positivo da janela inteira). Um falso positivo descarta uma mensagem
+nova como repetida, por isso o padrao e bem baixo (1e-6).
+"""
+import hashlib
+import math
+import os
+import time
+
+from local_store import register_script_impl
+
+DEDUPE_MODE = os.getenv("DEDUPE_MODE", "bloom").lower()
+PROCESSED_MSG_TTL_SECONDS = int(os.getenv("PROCESSED_MSG_TTL_SECONDS", "21600"))
+DEDUPE_BUCKET_SECONDS = int(os.getenv("DEDUPE_BUCKET_SECONDS", "3600"))
+DEDUPE_BLOOM_CAPACITY = int(os.getenv("DEDUPE_BLOOM_CAPACITY", "50000"))
+DEDUPE_BLOOM_FP_RATE = float(os.getenv("DEDUPE_BLOOM_FP_RATE", "1e-6"))
+
+
+class BloomParams:
+    """Tamanho (bits), numero de hashes e buckets consultados por verificacao."""
+
+    def __init__(
+        self,
+        capacity: int = DEDUPE_BLOOM_CAPACITY,
+        fp_rate: float = DEDUPE_BLOOM_FP_RATE,
+        window_sec: int = PROCESSED_MSG_TTL_SECONDS,
+        bucket_sec: int = DEDUPE_BUCKET_SECONDS,
+    ):
+        self.bucket_sec = max(1, bucket_sec)
+        # Bucket atual + os anteriores que ainda tocam a janela.
+        self.buckets = math.ceil(window_sec / self.bucket_sec) + 1
+        self.ttl_sec = window_sec + self.bucket_sec
+        # Cada bucket consultado soma sua taxa; divide o orcamento entre eles.
+        p = min(max(fp_rate / self.buckets, 1e-15), 0.5)
+        n = max(1, capacity)
+        self.bits = int(math.ceil(-n * math.log(p) / (math.log(2) ** 2)))
+        self.hashes = max(1, int(round(self.bits / n * math.log(2))))
+
+    @property
+    def bytes_per_bucket(self) -> int:
+        return (self.bits + 7) // 8
+
+    def positions(self, msg_id: str) -> list[int]:
+        # Hashing duplo (Kirsch-Mitzenmacher): k posicoes a partir de 2 hashes.
+        digest = hashlib.blake2b(str(msg_id).encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def bucket_keys(self, prefix: str, now: float | None = None) -> list[str]:
+        current = int((time.time() if now is None else now) // self.bucket_sec)
+        return [f"{prefix}:dedupe:{current - i}" for i in range(self.buckets)]
+
+
+BLOOM = BloomParams()
+
+# KEYS[1] = bucket atual, KEYS[2..] = anteriores; ARGV = k, ttl, k posicoes por id.
+# Retorna 1 por id ja visto. Verifica e marca atomicamente, entao dois webhooks
+# com o mesmo id ao mesmo tempo nao passam os dois.
+_BLOOM_LUA = """
+local k = tonumber(ARGV[1])
+local out = {}
+local n = (#ARGV - 2) / k
+local wrote = false
+for i = 0, n - 1 do
+  local base = 2 + i * k
+  local seen = 0
+  for b = 2, #KEYS do
+    local all = 1
+    for j = 1, k do
+      if redis.call('GETBIT', KEYS[b], ARGV[base + j]) == 0 then all = 0 break end
+    end
+    if all == 1 then seen = 1 break end
+  end
+  if seen == 0 then
+    local fresh = 0
+    for j = 1, k do
+      if redis.call('SETBIT', KEYS[1], ARGV[base + j], 1) == 0 then fresh = 1 end
+    end
+    if fresh == 0 then seen = 1 else wrote = true end
+  end
+  out[#out + 1] = seen
+end
+if wrote then redis.call('EXPIRE', KEYS[1], tonumber(ARGV[2])) end
+return out
+"""
+
+
+def _bloom_local(store, keys, args):
+    # Mesmo comportamento do _BLOOM_LUA para o backend em memoria.
+    k = int(args[0])
+    ttl = int(args[1])
+    positions = [int(p) for p in args[2:]]
+    out = []
+    wrote = False
+    for i in range(0, len(positions), k):
+        pos = positions[i : i + k]
+        seen = any(all(store.getbit(key, p) for p in pos) for key in keys[1:])
+        if not seen:
+            fresh = False
+            for p in pos:
+                if store.setbit(keys[0], p, 1) == 0:
+                    fresh = True
+            seen = not fresh
+            wrote = wrote or fresh
+        out.append(1 if seen else 0)
+    if wrote:
+        store.expire(keys[0], ttl)
+    return out
+
+
+register_script_impl(_BLOOM_LUA, _bloom_local)
+
+_scripts = {}
+
+
+def _bloom_script(r):
+    script = _scripts.get(id(r))
+    if script is None:
+        script = _scripts[id(r)] = r.register_script(_BLOOM_LUA)
+    return script
+
+
+def filter_processed(r, prefix: str, msg_ids: list, mode: str | None = None, params: BloomParams | None = None) -> list[bool]:
+    """Marca os ids como vistos numa unica ida ao Redis; True = ja processada.
+
+    Ids vazios nunca sao considerados repetidos.
+    """
+    if r is None:
+        return [False] * len(msg_ids)
+    mode = mode or DEDUPE_MODE
+    if mode == "keys":
+        return _filter_keys(r, prefix, msg_ids)
+
+    params = params or BLOOM
+    present = [m for m in msg_ids if m]
+    if not present:
+        return [False] * len(msg_ids)
+    args = [params.hashes, params.ttl_sec]
+    for msg_id in present:
+        args.extend(params.positions(msg_id))
+    results = iter(_bloom_script(r)(keys=params.bucket_keys(prefix), args=args))
+    return [bool(int(next(results))) if m else False for m in msg_ids]
+
+
+def _filter_keys(r, prefix: str, msg_ids: list) -> list[bool]:
+    pipe = r.pipeline(transaction=False)
+    queued = []
+    for msg_id in msg_ids:
+        if msg_id:
+            # set nx = primeira vez; se falhar, já foi processada.
+            pipe.set(f"{prefix}:processed:{msg_id}", "1", ex=PROCESSED_MSG_TTL_SECONDS, nx=True)
+            queued.append(True)
+        else:
+            queued.append(False)
+    results = iter(pipe.execute() if any(queued) else [])
+    return [not bool(next(results)) if q else False for q in queued]
@@ -0,0 +1,247 @@
+"""Ordem de despacho dos telefones vencidos no pending_zset.
+
+Cada telefone vencido cai numa classe de prioridade:
+
+- handoff: cliente esperando um humano, ou seja, a ultima resposta da IA
+  passou o contato de atendimento (ai_settings.handoff_contact) ha menos de
+  DISPATCH_HANDOFF_TTL_SECONDS ({prefix}:handoff:{telefone}, gravado pelo
+  worker com mark_handoff) e ele voltou a escrever;
+- contact: telefone cadastrado na tabela contacts (cache de
+  DISPATCH_CONTACT_TTL_SECONDS por telefone);
+- regular: o resto.
+
+Conversas com a IA pausada no painel ({REDIS_PREFIX}:ai:{telefone}, a mesma
+chave que o painel grava) nao concorrem: saem no fim do tick, depois de todas
+as classes, e o worker so registra as midias no historico, sem responder.
+
+Dentro da classe a fila segue a prioridade
+
+    espera desde o vencimento (s)
+    + DISPATCH_RETRY_BOOST_SECONDS * vezes que ficou para o proximo tick
+    - DISPATCH_PHONE_PENALTY_SECONDS * uso recente do telefone
+
+onde o uso recente conta os despachos do telefone com decaimento exponencial
+(meia-vida DISPATCH_PHONE_HALF_LIFE_SECONDS): quem manda rajadas seguidas cede a
+vez para quem esta esperando, sem ser bloqueado.
+
+Entre classes vale um round-robin ponderado suave (DISPATCH_CLASS_WEIGHTS,
+padrao handoff:4,contact:2,regular:1) com os creditos mantidos entre ticks:
+com vagas escassas cada classe recebe sua fracao e nenhuma fica parada
+enquanto outra tem fila. Sem disputa (vagas sobrando) todos sao despachados
+no mesmo tick, como antes.
+"""
+import math
+import os
+import time
+from collections import deque
+
+from analytics import record_queue_waits
+from metrics import DISPATCH_DEFERRED, DISPATCH_WAIT_SECONDS
+from redis_conn import key
+
+# Respostas simultaneas no worker somando todas as lojas (0 = sem limite).
+DISPATCH_MAX_CONCURRENT = int(os.getenv("DISPATCH_MAX_CONCURRENT", "16"))
+DISPATCH_RETRY_BOOST_SECONDS = float(os.getenv("DISPATCH_RETRY_BOOST_SECONDS", "10"))
+DISPATCH_PHONE_PENALTY_SECONDS = float(os.getenv("DISPATCH_PHONE_PENALTY_SECONDS", "15"))
+DISPATCH_PHONE_HALF_LIFE_SECONDS = float(os.getenv("DISPATCH_PHONE_HALF_LIFE_SECONDS", "300"))
+DISPATCH_CONTACT_TTL_SECONDS = float(os.getenv("DISPATCH_CONTACT_TTL_SECONDS", "300"))
+DISPATCH_HANDOFF_TTL_SECONDS = int(os.getenv("DISPATCH_HANDOFF_TTL_SECONDS", "3600"))
+
+PRIORITY_CLASSES = ("handoff", "contact", "regular")
+
+
+def _parse_weights(raw: str) -> dict:
+    weights = {c: 1.0 for c in PRIORITY_CLASSES}
+    for part in (raw or "").split(","):
+        name, _, value = part.partition(":")
+        name = name.strip()
+        if name in weights:
+            try:
+                weights[name] = max(0.01, float(value))
+            except ValueError:
+                pass
+    return weights
+
+
+DISPATCH_CLASS_WEIGHTS = _parse_weights(os.getenv("DISPATCH_CLASS_WEIGHTS", "handoff:4,contact:2,regular:1"))
+
+
+class Candidate:
+    __slots__ = ("member", "phone", "tenant", "due_at", "wait", "klass", "priority")
+
+    def __init__(self, member: str, phone: str, tenant, due_at: float):
+        self.member = member
+        self.phone = phone
+        self.tenant = tenant
+        self.due_at = float(due_at)
+        self.wait = 0.0
+        self.klass = "regular"
+        self.priority = 0.0
+
+
+def ai_flag_key(phone: str) -> str:
+    """Chave do liga/desliga da IA no painel (app._ai_key)."""
+    return key("ai", phone)
+
+
+def ai_paused(value) -> bool:
+    return value is not None and str(value).strip().lower() not in {"1", "true", "on", "yes"}
+
+
+def _handoff_key(prefix: str, phone: str) -> str:
+    return f"{prefix}:handoff:{phone}"
+
+
+def mark_handoff(r, prefix: str, phone: str):
+    """A IA passou o contato humano: a proxima mensagem do cliente vai na frente."""
+    try:
+        r.set(_handoff_key(prefix, phone), "1", ex=DISPATCH_HANDOFF_TTL_SECONDS)
+    except Exception as e:
+        print(f"[dispatch][{phone}] falha ao marcar handoff:", e)
+
+
+class FairScheduler:
+    """Estado do despacho no processo lider (uso por telefone, adiamentos, creditos)."""
+
+    def __init__(self, weights: dict | None = None, contact_lookup=None):
+        self.weights = dict(weights or DISPATCH_CLASS_WEIGHTS)
+        self._credits = {c: 0.0 for c in self.weights}
+        self._lookup = contact_lookup
+        self._contacts = {}  # telefone -> (cadastrado, expira_em)
+        self._usage = {}  # membro -> (valor, ts)
+        self._deferrals = {}  # membro -> ticks adiado
+        self._open = {}  # membros do tick atual ainda sem decisao
+        self._waits = []  # (prefixo, classe, espera) despachados no tick
+
+    # ---- classificacao ----------------------------------------------------
+
+    def _lookup_contacts(self, phones: list[str]) -> set:
+        if self._lookup is None:
+            from db import get_contact_map_for_phones
+
+            self._lookup = get_contact_map_for_phones
+        return set(self._lookup(phones))
+
+    def _known_contacts(self, phones: set, now: float) -> set:
+        missing = [p for p in phones if self._contacts.get(p, (False, 0.0))[1] <= now]
+        if missing:
+            try:
+                found = self._lookup_contacts(missing)
+            except Exception as e:
+                print("[dispatch] falha ao consultar contatos:", e)
+                found = set()
+            for p in missing:
+                self._contacts[p] = (p in found, now + DISPATCH_CONTACT_TTL_SECONDS)
+            if len(self._contacts) > 4 * len(phones) + 4096:
+                self._contacts = {p: v for p, v in self._contacts.items() if v[1] > now}
+        return {p for p in phones if self._contacts[p][0]}
+
+    def classify(self, r, cands: list, now: float):
+        if not cands:
+            return
+        pipe = r.pipeline(transaction=False)
+        for c in cands:
+            pipe.get(ai_flag_key(c.phone))
+            pipe.exists(_handoff_key(c.tenant.prefix, c.phone))
+        flags = pipe.execute()
+        contacts = self._known_contacts({c.phone for c in cands}, now)
+        for i, c in enumerate(cands):
+            if ai_paused(flags[2 * i]):
+                c.klass = "paused"
+            elif int(flags[2 * i + 1] or 0):
+                c.klass = "handoff"
+            elif c.phone in contacts:
+                c.klass = "contact"
+            else:
+                c.klass = "regular"
+
+    # ---- prioridade -------------------------------------------------------
+
+    def _recent_usage(self, member: str, now: float) -> float:
+        value, ts = self._usage.get(member, (0.0, now))
+        if DISPATCH_PHONE_HALF_LIFE_SECONDS <= 0:
+            return 0.0
+        return value * math.pow(0.5, max(0.0, now - ts) / DISPATCH_PHONE_HALF_LIFE_SECONDS)
+
+    def plan(self, r, cands: list, now: float | None = None):
+        """Gera os candidatos na ordem de despacho (lazy: os creditos das
+        classes so andam para os que foram de fato considerados)."""
+        now = time.time() if now is None else now
+        self.classify(r, cands, now)
+        # Membros que sairam do zset (respondidos ou limpos) nao acumulam mais.
+        due = {c.member for c in cands}
+        self._deferrals = {m: n for m, n in self._deferrals.items() if m in due}
+        queues = {}
+        paused = []
+        for c in cands:
+            c.wait = max(0.0, now - c.due_at)
+            c.priority = (
+                c.wait
+                + DISPATCH_RETRY_BOOST_SECONDS * self._deferrals.get(c.member, 0)
+                - DISPATCH_PHONE_PENALTY_SECONDS * self._recent_usage(c.member, now)
+            )
+            if c.klass == "paused":
+                paused.append(c)
+            else:
+                queues.setdefault(c.klass, []).append(c)
+        for klass, items in queues.items():
+            items.sort(key=lambda c: (-c.priority, c.due_at))
+            queues[klass] = deque(items)
+        paused.sort(key=lambda c: c.due_at)
+        self._open = {c.member: c for c in cands}
+        self._waits = []
+        return self._ordered(queues, paused)
+
+    def _ordered(self, queues: dict, paused: list):
+        yield from self._interleave(queues)
+        # IA pausada: so com vaga sobrando, sem disputar com quem espera resposta.
+        yield from paused
+
+    def _interleave(self, queues: dict):
+        # Round-robin ponderado suave (o mesmo do nginx), creditos persistentes.
+        while True:
+            active = [k for k, q in queues.items() if q]
+            if not active:
+                return
+            for k in self._credits:
+                if k not in active:
+                    self._credits[k] = 0.0
+            total = 0.0
+            for k in active:
+                w = self.weights.get(k, 1.0)
+                self._credits[k] = self._credits.get(k, 0.0) + w
+                total += w
+            best = max(active, key=lambda k: self._credits[k])
+            self._credits[best] -= total
+            yield queues[best].popleft()
+
+    # ---- resultado do tick ------------------------------------------------
+
+    def served(self, cand: Candidate, now: float | None = None):
+        now = time.time() if now is None else now
+        self._open.pop(cand.member, None)
+        self._deferrals.pop(cand.member, None)
+        self._usage[cand.member] = (self._recent_usage(cand.member, now) + 1.0, now)
+        if cand.klass == "paused":
+            return
+        DISPATCH_WAIT_SECONDS.observe(cand.wait, priority=cand.klass)
+        self._waits.append((cand.tenant.prefix, cand.klass, cand.wait))
+
+    def deferred(self, cand: Candidate, reason: str):
+        self._open.pop(cand.member, None)
+        self._deferrals[cand.member] = self._deferrals.get(cand.member, 0) + 1
+        DISPATCH_DEFERRED.inc(reason=reason, priority=cand.klass)
+
+    def finish(self, r, now: float | None = None):
+        """Fecha o tick: o que nao foi considerado fica para o proximo (sem vaga)."""
+        now = time.time() if now is None else now
+        for cand in list(self._open.values()):
+            self.deferred(cand, "no_slot")
+        by_prefix = {}
+        for prefix, klass, wait in self._waits:
+            by_prefix.setdefault(prefix, []).append((klass, wait))
+        for prefix, waits in by_prefix.items():
+            record_queue_waits(r, waits, prefix)
+        self._waits = []
+        if len(self._usage) > 4096:
+            self._usage = {m: v for m, v in self._usage.items() if self._recent_usage(m, now) >= 0.01}
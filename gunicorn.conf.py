@@ -0,0 +1,30 @@
+# Producao: gunicorn -c gunicorn.conf.py webhook:app
+#
+# Todos os workers atendem /webhook; cada um entra na eleicao do scheduler e
+# so o(s) lider(es) (SCHEDULER_SLOTS) processam a fila de debounce.
+import multiprocessing
+import os
+
+bind = os.getenv("WEBHOOK_BIND", "0.0.0.0:5000")
+workers = int(os.getenv("WEBHOOK_WORKERS", str(multiprocessing.cpu_count())))
+threads = int(os.getenv("WEBHOOK_THREADS", "4"))
+timeout = int(os.getenv("WEBHOOK_TIMEOUT", "120"))
+# O app precisa ser importado depois do fork (conexoes Redis/DB por processo).
+preload_app = False
+
+
+def post_worker_init(worker):
+    # Conexoes, aquecimento e worker em segundo plano; /readyz informa quando terminou.
+    from webhook import startup
+
+    startup()
+
+
+def worker_exit(server, worker):
+    from archive import stop_archiver
+    from leases import release_all_leases
+    from scheduler import stop_elected
+
+    stop_elected()
+    stop_archiver()
+    release_all_leases()
@@ -0,0 +1,89 @@
+"""Fase de inicializacao explicita e rotas de saude.
+
+Os modulos nao conectam em nada no import; cada entrada (webhook.py, app.py)
+chama suas verificacoes em startup e o resultado fica em READINESS:
+
+- GET /healthz: processo vivo (sempre 200);
+- GET /readyz: 200 quando a inicializacao terminou e as verificacoes
+  obrigatorias passaram; 503 com o detalhe de cada verificacao caso contrario.
+"""
+import threading
+import time
+
+_STARTED_AT = time.time()
+
+
+class Readiness:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._checks = {}
+        self._done = False
+
+    def check(self, name: str, fn, required: bool = True) -> bool:
+        """Roda fn() e registra ok/erro/duracao; nao propaga a excecao."""
+        t0 = time.perf_counter()
+        try:
+            fn()
+            ok, detail = True, ""
+        except Exception as e:
+            ok, detail = False, f"{type(e).__name__}: {e}"
+        with self._lock:
+            self._checks[name] = {
+                "ok": ok,
+                "required": required,
+                "seconds": round(time.perf_counter() - t0, 3),
+                "detail": detail,
+            }
+        return ok
+
+    def mark_done(self):
+        with self._lock:
+            self._done = True
+        print(f"[startup] pronto em {time.time() - _STARTED_AT:.2f}s desde o import")
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            checks = {k: dict(v) for k, v in self._checks.items()}
+            done = self._done
+        ready = done and all(c["ok"] for c in checks.values() if c["required"])
+        return {
+            "ready": ready,
+            "started": done,
+            "uptime_seconds": round(time.time() - _STARTED_AT, 3),
+            "checks": checks,
+        }
+
+
+READINESS = Readiness()
+
+
+def run_startup(steps, background: bool = True):
+    """steps(): executa as verificacoes; chama mark_done ao final."""
+
+    def _run():
+        try:
+            steps()
+        except Exception as e:
+            print("[startup] erro:", e)
+        finally:
+            READINESS.mark_done()
+
+    if not background:
+        _run()
+        return None
+    t = threading.Thread(target=_run, daemon=True, name="startup")
+    t.start()
+    return t
+
+
+def register_health_routes(app):
+    from flask import jsonify
+
+    @app.get("/healthz")
+    def healthz():
+        return jsonify({"ok": True})
+
+    @app.get("/readyz")
+    def readyz():
+        snap = READINESS.snapshot()
+        return jsonify(snap), 200 if snap["ready"] else 503
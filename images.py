@@ -0,0 +1,159 @@
+"""Descricao de fotos enviadas pelo cliente, para casar com o catalogo.
+
+A imagem chega no buffer como {"type": "image", "id", "mime", "caption", "sha"}
+e e descrita no flush, junto com as outras do telefone:
+
+- o cache ({REDIS_PREFIX}:imgdesc:{sha256 do arquivo}) e consultado antes de
+  baixar quando a Evolution informa o imageMessage.fileSha256, e de novo
+  depois do download pelo hash do conteudo; a mesma foto de produto
+  encaminhada por varios clientes e descrita uma vez so;
+- as que faltam sao baixadas em paralelo (audio.download_media), reduzidas em
+  memoria para no maximo IMAGE_MAX_SIDE px e regravadas em JPEG (com Pillow;
+  sem ele vao no tamanho original) e descritas num unico pedido ao Gemini.
+
+A descricao entra no texto do cliente ("[Imagem: ...] legenda"), entao a busca
+do catalogo (db.search_products_for_ai) ja usa os termos dela.
+"""
+import base64
+import binascii
+import hashlib
+import io
+import os
+
+from google.genai import types
+
+from audio import GEMINI_MODEL, download_media, gemini_client, split_numbered
+from metrics import IMAGE_DESCRIPTIONS
+from redis_conn import key
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # dependencia opcional; sem ela a imagem vai no tamanho original
+    Image = None
+
+IMAGE_MAX_SIDE = int(os.getenv("IMAGE_MAX_SIDE", "768"))
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "80"))
+IMAGE_CACHE_TTL_SECONDS = int(os.getenv("IMAGE_CACHE_TTL_SECONDS", str(30 * 24 * 60 * 60)))
+
+_DESCRIBE_PROMPT = (
+    "Voce vai receber {n} fotos enviadas por um cliente de uma loja. Para cada uma, "
+    "descreva em portugues do Brasil, numa frase curta e objetiva, o produto ou objeto "
+    "principal: tipo, marca, cor, tamanho/volume e qualquer texto legivel no rotulo. "
+    "Responda somente com uma linha por foto no formato '<numero>: <descricao>'."
+)
+
+
+def _cache_key(sha_hex: str) -> str:
+    return key("imgdesc", sha_hex)
+
+
+def _hint_sha(item: dict) -> str | None:
+    # fileSha256 do WhatsApp = sha256 do arquivo decifrado, em base64.
+    raw = item.get("sha")
+    if not isinstance(raw, str) or not raw:
+        return None
+    try:
+        return base64.b64decode(raw).hex()
+    except (binascii.Error, ValueError):
+        return None
+
+
+def downscale(data: bytes, mime: str) -> tuple[bytes, str]:
+    """Reduz para IMAGE_MAX_SIDE no maior lado e regrava em JPEG; (bytes, mime)."""
+    if Image is None:
+        return data, mime
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            img = ImageOps.exif_transpose(img)
+            if max(img.size) <= IMAGE_MAX_SIDE and mime == "image/jpeg":
+                return data, mime
+            img.thumbnail((IMAGE_MAX_SIDE, IMAGE_MAX_SIDE))
+            if img.mode in ("RGBA", "LA", "P"):
+                # Fundo branco no lugar da transparencia (JPEG nao tem alfa).
+                img = img.convert("RGBA")
+                background = Image.new("RGB", img.size, (255, 255, 255))
+                background.paste(img, mask=img.getchannel("A"))
+                img = background
+            elif img.mode != "RGB":
+                img = img.convert("RGB")
+            out = io.BytesIO()
+            img.save(out, "JPEG", quality=IMAGE_JPEG_QUALITY, optimize=True)
+            return out.getvalue(), "image/jpeg"
+    except Exception as e:
+        print("[image] falha ao reduzir, enviando original:", e)
+        return data, mime
+
+
+def _cached(r, shas: list) -> list:
+    if r is None or not shas:
+        return [None] * len(shas)
+    try:
+        pipe = r.pipeline(transaction=False)
+        for sha in shas:
+            pipe.get(_cache_key(sha))
+        return pipe.execute()
+    except Exception as e:
+        print("[image] falha ao ler cache:", e)
+        return [None] * len(shas)
+
+
+def _store(r, described: dict):
+    if r is None or not described:
+        return
+    try:
+        pipe = r.pipeline(transaction=False)
+        for sha, text in described.items():
+            pipe.set(_cache_key(sha), text, ex=IMAGE_CACHE_TTL_SECONDS)
+        pipe.execute()
+    except Exception as e:
+        print("[image] falha ao gravar cache:", e)
+
+
+def describe_images(items: list[dict], instance: str | None = None, r=None) -> list[str]:
+    """Uma descricao por imagem do buffer, na ordem ("" = nao foi possivel)."""
+    out = [""] * len(items)
+    shas = [_hint_sha(item) for item in items]
+
+    hinted = [i for i, sha in enumerate(shas) if sha]
+    for i, text in zip(hinted, _cached(r, [shas[i] for i in hinted])):
+        if text:
+            out[i] = text
+            IMAGE_DESCRIPTIONS.inc(source="cache")
+
+    pending = [i for i, item in enumerate(items) if not out[i] and item.get("id")]
+    if not pending:
+        return out
+    media = download_media([items[i]["id"] for i in pending], instance=instance)
+    downloaded = []
+    for i, data in zip(pending, media):
+        if isinstance(data, Exception) or not data:
+            print(f"[image][ERRO] download de {items[i].get('id')}: {data}")
+            continue
+        shas[i] = hashlib.sha256(data).hexdigest()
+        downloaded.append((i, data))
+
+    # Sem fileSha256 no payload: o hash do conteudo ainda pode estar no cache.
+    misses = []
+    for (i, data), text in zip(downloaded, _cached(r, [shas[i] for i, _ in downloaded])):
+        if text:
+            out[i] = text
+            IMAGE_DESCRIPTIONS.inc(source="cache")
+        else:
+            misses.append((i, data))
+    if not misses:
+        return out
+
+    contents = [_DESCRIBE_PROMPT.format(n=len(misses))]
+    for n, (i, data) in enumerate(misses, start=1):
+        small, mime = downscale(data, (items[i].get("mime") or "image/jpeg").split(";", 1)[0].strip())
+        contents.append(f"Foto {n}:")
+        contents.append(types.Part.from_bytes(data=small, mime_type=mime))
+    resp = gemini_client().models.generate_content(model=GEMINI_MODEL, contents=contents)
+    described = {}
+    for (i, _), text in zip(misses, split_numbered(resp.text or "", len(misses))):
+        out[i] = text
+        if text:
+            described[shas[i]] = text
+            IMAGE_DESCRIPTIONS.inc(source="model")
+    _store(r, described)
+    return out
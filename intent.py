@@ -0,0 +1,114 @@
+import os
+import re
+import threading
+import time
+
+import db
+from db import _normalize_text, _tokenize, catalog_signature, list_products
+
+INTENT_REFRESH_SECONDS = int(os.getenv("INTENT_REFRESH_SECONDS", "30"))
+
+# Termos genericos de intencao de compra (ja normalizados, sem acento).
+BASE_TERMS = [
+    "produto",
+    "produtos",
+    "preco",
+    "precos",
+    "valor",
+    "valores",
+    "custa",
+    "custam",
+    "quanto e",
+    "quanto fica",
+    "voces tem",
+    "voce tem",
+    "vcs tem",
+    "tem disponivel",
+    "estoque",
+    "disponivel",
+    "disponiveis",
+    "marca",
+    "litro",
+    "litros",
+    "catalogo",
+    "fragrancia",
+    "fragrancias",
+]
+# Medidas tipo "100ml", "1 litro", "500 g".
+_MEASURE_PATTERN = r"\d+\s*(?:ml|l|g|kg|un)"
+_MIN_TOKEN_LEN = 4
+
+
+def build_vocabulary(products: list[dict]) -> set[str]:
+    """Nomes, sinonimos e categorias do catalogo (frases inteiras e tokens relevantes)."""
+    vocab = set()
+    for p in products or []:
+        phrases = [p.get("name", ""), p.get("category", ""), *(p.get("aliases") or [])]
+        for phrase in phrases:
+            norm = _normalize_text(phrase)
+            if not norm:
+                continue
+            vocab.add(norm)
+            for tok in _tokenize(norm):
+                if len(tok) >= _MIN_TOKEN_LEN and not tok.isdigit():
+                    vocab.add(tok)
+    return vocab
+
+
+class ProductIntentMatcher:
+    """Todos os termos compilados numa unica regex: uma passada sobre o texto."""
+
+    def __init__(self, terms):
+        self.terms = sorted({t for t in terms if t}, key=len, reverse=True)
+        alternatives = [re.escape(t).replace(r"\ ", r"\s+") for t in self.terms]
+        alternatives.append(_MEASURE_PATTERN)
+        self._pattern = re.compile(r"\b(?:" + "|".join(alternatives) + r")\b")
+
+    @classmethod
+    def from_products(cls, products: list[dict]):
+        return cls([*BASE_TERMS, *build_vocabulary(products)])
+
+    def matches(self, text: str) -> bool:
+        return self._pattern.search(_normalize_text(text)) is not None
+
+    def find(self, text: str) -> list[str]:
+        return [m.group(0) for m in self._pattern.finditer(_normalize_text(text))]
+
+
+_matcher = ProductIntentMatcher(BASE_TERMS)
+_signature = None
+_checked_at = 0.0
+_lock = threading.Lock()
+
+
+def _refresh_due(now: float) -> bool:
+    # Escritas no catalogo deste processo invalidam na hora; as de outros
+    # processos aparecem na proxima checagem da assinatura.
+    if _signature is not None and _signature[0] != db._CATALOG_WRITES:
+        return True
+    return not _checked_at or now - _checked_at >= INTENT_REFRESH_SECONDS
+
+
+def get_matcher() -> ProductIntentMatcher:
+    """Matcher atual; reconstruido quando a assinatura do catalogo muda."""
+    global _matcher, _signature, _checked_at
+    now = time.monotonic()
+    if not _refresh_due(now):
+        return _matcher
+    with _lock:
+        if not _refresh_due(now):
+            return _matcher
+        _checked_at = now
+        try:
+            sig = catalog_signature()
+            if sig != _signature:
+                _matcher = ProductIntentMatcher.from_products(list_products(only_active=True))
+                _signature = sig
+        except Exception as e:
+            # Sem banco: segue com o ultimo matcher (no minimo os termos base).
+            print("[intent] falha ao atualizar vocabulario do catalogo:", e)
+    return _matcher
+
+
+def has_product_intent(text: str) -> bool:
+    return get_matcher().matches(text or "")
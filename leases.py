@@ -0,0 +1,193 @@
+"""Lease por telefone no worker, com heartbeat e token de cerca (fencing).
+
+O lease ({prefix}:lock:{telefone}) vale PHONE_LEASE_SECONDS e guarda
+"<token>:<dono>". O token sai de um INCR em {prefix}:lock:{telefone}:seq no
+mesmo script que pega o lease, entao cresce a cada posse.
+
+Enquanto _process_phone roda, uma thread por processo renova todos os leases
+ativos a cada PHONE_LEASE_SECONDS / 3 (uma ida ao Redis por rodada). Antes de
+enviar a resposta (e so depois grava-la no historico), o worker confere se o
+lease ainda tem o seu token (e renova na mesma chamada); se outro worker
+assumiu, ou se a posse nao pode ser confirmada, desiste sem enviar nem gravar e
+devolve os itens ao buffer para o novo dono. Um worker que morre deixa de renovar e o
+telefone fica livre em ate PHONE_LEASE_SECONDS, em vez de esperar um lock
+fixo de 60 s.
+"""
+import os
+import socket
+import threading
+import time
+import uuid
+
+from local_store import register_script_impl
+from scheduler import _RELEASE_LUA, _RENEW_LUA
+
+PHONE_LEASE_SECONDS = float(os.getenv("PHONE_LEASE_SECONDS", "15"))
+# O contador do token sobrevive aos leases; so some depois de parado por isto.
+PHONE_LEASE_SEQ_TTL_SECONDS = int(os.getenv("PHONE_LEASE_SEQ_TTL_SECONDS", str(7 * 24 * 60 * 60)))
+
+_OWNER = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+# KEYS[1] = lease, KEYS[2] = contador; ARGV = dono, ttl ms, ttl do contador.
+# Retorna o token ou 0 se o lease ja tem dono.
+_ACQUIRE_LUA = """
+if redis.call('EXISTS', KEYS[1]) == 1 then return 0 end
+local token = redis.call('INCR', KEYS[2])
+redis.call('EXPIRE', KEYS[2], tonumber(ARGV[3]))
+redis.call('SET', KEYS[1], token .. ':' .. ARGV[1], 'PX', tonumber(ARGV[2]))
+return token
+"""
+
+
+def _acquire_local(store, keys, args):
+    if store.exists(keys[0]):
+        return 0
+    token = store.incr(keys[1])
+    store.expire(keys[1], int(args[2]))
+    store.set(keys[0], f"{token}:{args[0]}", px=int(args[1]))
+    return token
+
+
+register_script_impl(_ACQUIRE_LUA, _acquire_local)
+
+
+class LeaseLost(Exception):
+    """Outro worker assumiu o telefone; a resposta deste nao pode sair."""
+
+
+class PhoneLease:
+    def __init__(self, r, prefix: str, phone: str, token: int, ttl_sec: float = PHONE_LEASE_SECONDS):
+        self.r = r
+        self.key = f"{prefix}:lock:{phone}"
+        self.phone = phone
+        self.token = int(token)
+        self.value = f"{self.token}:{_OWNER}"
+        self.ttl_ms = int(ttl_sec * 1000)
+        self.lost = False
+
+    def renew(self, strict: bool = False) -> bool:
+        """Renova se o token ainda for deste worker.
+
+        Sem `strict`, uma falha de conexao conta como renovado (o proximo
+        heartbeat tenta de novo); com `strict`, posse nao confirmada = perdida.
+        """
+        if self.lost:
+            return False
+        try:
+            ok = bool(_script(self.r, _RENEW_LUA)(keys=[self.key], args=[self.value, self.ttl_ms]))
+        except Exception as e:
+            print(f"[lease][{self.phone}] falha ao renovar:", e)
+            return not strict
+        if not ok:
+            self.lost = True
+            _keeper.discard(self)
+        return ok
+
+    def check(self):
+        """Cerca antes de efeitos colaterais: levanta LeaseLost se o token mudou
+        ou se nao foi possivel confirmar a posse."""
+        if not self.renew(strict=True):
+            raise LeaseLost(f"lease de {self.phone} (token {self.token}) nao e mais deste worker")
+
+    def release(self):
+        _keeper.discard(self)
+        if self.lost:
+            return
+        # Depois de soltar, check() nao passa mais (nem se a thread seguir rodando).
+        self.lost = True
+        try:
+            _script(self.r, _RELEASE_LUA)(keys=[self.key], args=[self.value])
+        except Exception as e:
+            print(f"[lease][{self.phone}] falha ao soltar:", e)
+
+
+_scripts = {}
+
+
+def _script(r, lua_source):
+    script = _scripts.get((id(r), lua_source))
+    if script is None:
+        script = _scripts[(id(r), lua_source)] = r.register_script(lua_source)
+    return script
+
+
+def acquire_phone_lease(r, prefix: str, phone: str, ttl_sec: float = PHONE_LEASE_SECONDS) -> PhoneLease | None:
+    """Pega o lease do telefone e entrega ao heartbeat; None = outro worker tem."""
+    lease_key = f"{prefix}:lock:{phone}"
+    token = int(
+        _script(r, _ACQUIRE_LUA)(
+            keys=[lease_key, f"{lease_key}:seq"],
+            args=[_OWNER, int(ttl_sec * 1000), PHONE_LEASE_SEQ_TTL_SECONDS],
+        )
+        or 0
+    )
+    if not token:
+        return None
+    lease = PhoneLease(r, prefix, phone, token, ttl_sec)
+    _keeper.add(lease)
+    return lease
+
+
+class _Keeper:
+    """Thread unica por processo que renova os leases em andamento."""
+
+    def __init__(self):
+        self._leases = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def add(self, lease: PhoneLease):
+        with self._lock:
+            self._leases.add(lease)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True, name="lease-heartbeat")
+                self._thread.start()
+
+    def discard(self, lease: PhoneLease):
+        with self._lock:
+            self._leases.discard(lease)
+
+    def _run(self):
+        interval = max(0.5, PHONE_LEASE_SECONDS / 3)
+        while True:
+            time.sleep(interval)
+            with self._lock:
+                leases = list(self._leases)
+            if not leases:
+                continue
+            by_client = {}
+            for lease in leases:
+                by_client.setdefault(id(lease.r), []).append(lease)
+            for group in by_client.values():
+                self._renew_group(group)
+
+    def _renew_group(self, leases: list):
+        r = leases[0].r
+        try:
+            pipe = r.pipeline(transaction=False)
+            renew = _script(r, _RENEW_LUA)
+            for lease in leases:
+                renew(keys=[lease.key], args=[lease.value, lease.ttl_ms], client=pipe)
+            results = pipe.execute()
+        except Exception as e:
+            print("[lease] falha no heartbeat:", e)
+            return
+        for lease, ok in zip(leases, results):
+            if not ok and not lease.lost:
+                lease.lost = True
+                self.discard(lease)
+                print(f"[lease][{lease.phone}] perdido (token {lease.token})")
+
+    def release_all(self):
+        with self._lock:
+            leases = list(self._leases)
+        for lease in leases:
+            lease.release()
+
+
+_keeper = _Keeper()
+
+
+def release_all_leases():
+    """Solta os leases deste processo ao sair (os telefones voltam na hora)."""
+    _keeper.release_all()
@@ -0,0 +1,228 @@
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+import requests
+
+from prompt_cache import CONTEXT_CACHE_ENABLED, PROMPT_CACHE
+
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "gemini")
+LLM_FALLBACK_PROVIDER = os.getenv("LLM_FALLBACK_PROVIDER", "")
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "60"))
+# Endpoint alternativo da API do Gemini (ex.: servidor fake do bench/loadtest.py).
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL", "").strip()
+
+OLLAMA_URL = (os.getenv("OLLAMA_URL") or "http://localhost:11434/api/generate").strip().strip('"').strip("'")
+OLLAMA_MODEL = (os.getenv("OLLAMA_MODEL") or "qwen3:8b").strip().strip('"').strip("'")
+# Chamadas simultaneas ao Ollama por processo (0 = sem limite); igual ao
+# OLLAMA_NUM_PARALLEL do servidor. OLLAMA_BATCH_SIZE e o nome antigo.
+OLLAMA_MAX_PARALLEL = int(os.getenv("OLLAMA_MAX_PARALLEL") or os.getenv("OLLAMA_BATCH_SIZE") or "4")
+
+FAKE_LLM_LATENCY_MS = int(os.getenv("FAKE_LLM_LATENCY_MS", "0"))
+
+
+class ProviderConfigError(RuntimeError):
+    """Provedor sem configuracao minima (chave, modelo); a mensagem vai para o cliente."""
+
+
+class GeminiProvider:
+    name = "gemini"
+
+    def __init__(self, model: str):
+        self.model = model
+        self._client = None
+        self._lock = threading.Lock()
+
+    def _get_client(self):
+        api_key = os.getenv("GEMINI_API_KEY")
+        if not api_key:
+            raise ProviderConfigError("GEMINI_API_KEY nao configurada no sistema.")
+        with self._lock:
+            if self._client is None:
+                # google.genai leva ~0.5 s para importar; so carrega no primeiro uso.
+                from google import genai
+                from google.genai import types
+
+                http_options = types.HttpOptions(base_url=GEMINI_BASE_URL) if GEMINI_BASE_URL else None
+                self._client = genai.Client(api_key=api_key, http_options=http_options)
+            return self._client
+
+    def generate(self, system_prompt: str, prompt: str) -> str:
+        if not self.model:
+            raise ProviderConfigError("Modelo do Gemini nao definido (defina em store_profile.json -> model.name).")
+        client = self._get_client()
+
+        cache_name = None
+        if system_prompt and CONTEXT_CACHE_ENABLED:
+            cache_name = PROMPT_CACHE.get(client, self.model, system_prompt)
+
+        resp = None
+        if cache_name:
+            from google.genai import types
+
+            try:
+                resp = client.models.generate_content(
+                    model=self.model,
+                    contents=prompt,
+                    config=types.GenerateContentConfig(cached_content=cache_name),
+                )
+            except Exception as e:
+                # Cache expirado/removido no servidor: descarta e segue sem cache.
+                print("[ai] falha com cache de contexto, reenviando prompt completo:", e)
+                PROMPT_CACHE.invalidate(client, self.model, system_prompt)
+                resp = None
+
+        if resp is None:
+            contents = f"{system_prompt}\n\n{prompt}" if system_prompt else prompt
+            resp = client.models.generate_content(model=self.model, contents=contents)
+
+        meta = getattr(resp, "usage_metadata", None)
+        if meta is not None:
+            print(
+                f"[ai][gemini] tokens entrada={getattr(meta, 'prompt_token_count', None)} "
+                f"cache={getattr(meta, 'cached_content_token_count', None)} "
+                f"saida={getattr(meta, 'candidates_token_count', None)}"
+            )
+        return (getattr(resp, "text", None) or "").strip()
+
+
+class OllamaProvider:
+    name = "ollama"
+
+    def __init__(self, model: str = OLLAMA_MODEL, url: str = OLLAMA_URL, timeout_sec: float = LLM_TIMEOUT_SECONDS):
+        self.model = model
+        self.url = url
+        self.timeout_sec = timeout_sec
+        self._session = requests.Session()
+
+    def generate(self, system_prompt: str, prompt: str) -> str:
+        if not self.url or not self.model:
+            raise ProviderConfigError("Ollama nao configurado (OLLAMA_URL/OLLAMA_MODEL).")
+        payload = {"model": self.model, "prompt": prompt, "stream": False}
+        if system_prompt:
+            payload["system"] = system_prompt
+        resp = self._session.post(self.url, json=payload, timeout=self.timeout_sec)
+        resp.raise_for_status()
+        return str(resp.json().get("response") or "").strip()
+
+
+class FakeProvider:
+    """Resposta deterministica derivada do prompt; usada em testes e benchmarks."""
+
+    name = "fake"
+
+    def __init__(self, latency_ms: int = FAKE_LLM_LATENCY_MS):
+        self.latency_ms = latency_ms
+
+    def generate(self, system_prompt: str, prompt: str) -> str:
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000.0)
+        last = ""
+        for line in reversed(prompt.splitlines()):
+            if line.startswith("CLIENTE: "):
+                last = line[len("CLIENTE: ") :]
+                break
+        digest = hashlib.sha1(f"{system_prompt}\n{prompt}".encode("utf-8")).hexdigest()[:8]
+        return f"[fake:{digest}] {last[:120]}".strip()
+
+
+class ConcurrencyGate:
+    """Limita as chamadas simultaneas a um provedor local (semaforo).
+
+    O Ollama processa no maximo OLLAMA_NUM_PARALLEL prompts ao mesmo tempo e
+    enfileira o resto no servidor; com `max_parallel` igual a esse valor, o
+    excedente espera aqui, sem segurar conexoes nem estourar o timeout do
+    cliente HTTP durante picos. Nao agrupa nem atrasa pedidos.
+    """
+
+    def __init__(self, inner, max_parallel: int = OLLAMA_MAX_PARALLEL):
+        self.inner = inner
+        self.name = inner.name
+        self._slots = threading.BoundedSemaphore(max(1, max_parallel))
+
+    def generate(self, system_prompt: str, prompt: str) -> str:
+        with self._slots:
+            return self.inner.generate(system_prompt, prompt)
+
+
+class FallbackProvider:
+    """Tenta os provedores em ordem; passa ao proximo em timeout ou erro."""
+
+    def __init__(self, providers: list, timeout_sec: float = LLM_TIMEOUT_SECONDS):
+        self.providers = providers
+        self.timeout_sec = timeout_sec
+        self.name = ">".join(p.name for p in providers)
+        self._pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix="llm-fallback")
+
+    def generate(self, system_prompt: str, prompt: str) -> str:
+        last_error = None
+        for i, provider in enumerate(self.providers):
+            is_last = i == len(self.providers) - 1
+            try:
+                if is_last:
+                    return provider.generate(system_prompt, prompt)
+                fut = self._pool.submit(provider.generate, system_prompt, prompt)
+                answer = fut.result(timeout=self.timeout_sec)
+                if answer:
+                    return answer
+            except FutureTimeout:
+                last_error = TimeoutError(f"{provider.name} excedeu {self.timeout_sec}s")
+                print(f"[ai] {last_error}; tentando proximo provedor")
+            except Exception as e:
+                if is_last:
+                    raise
+                last_error = e
+                print(f"[ai] {provider.name} falhou ({e}); tentando proximo provedor")
+        if last_error:
+            raise last_error
+        return ""
+
+
+_PROVIDERS = {}
+_PROVIDERS_LOCK = threading.Lock()
+
+
+def _build_single(kind: str, cfg: dict, timeout: float = LLM_TIMEOUT_SECONDS):
+    kind = (kind or "").strip().lower()
+    if kind == "gemini":
+        return GeminiProvider(cfg.get("name") or os.getenv("GEMINI_MODEL") or "")
+    if kind == "ollama":
+        ollama = OllamaProvider(
+            model=cfg.get("ollama_model") or OLLAMA_MODEL,
+            url=cfg.get("ollama_url") or OLLAMA_URL,
+            timeout_sec=timeout,
+        )
+        return ConcurrencyGate(ollama) if OLLAMA_MAX_PARALLEL > 0 else ollama
+    if kind == "fake":
+        return FakeProvider()
+    raise ProviderConfigError(f"Provedor de IA desconhecido: {kind}")
+
+
+def get_provider(profile: dict):
+    """Provedor configurado em store_profile.json -> model (reutilizado entre chamadas)."""
+    cfg = (profile or {}).get("model") or {}
+    primary = cfg.get("provider") or LLM_PROVIDER
+    fallback = cfg.get("fallback_provider") or LLM_FALLBACK_PROVIDER
+    try:
+        timeout = float(cfg.get("timeout_seconds") or LLM_TIMEOUT_SECONDS)
+    except Exception:
+        timeout = LLM_TIMEOUT_SECONDS
+
+    key = (
+        primary,
+        fallback,
+        timeout,
+        cfg.get("name") or "",
+        cfg.get("ollama_model") or "",
+        cfg.get("ollama_url") or "",
+    )
+    with _PROVIDERS_LOCK:
+        provider = _PROVIDERS.get(key)
+        if provider is None:
+            provider = _build_single(primary, cfg, timeout)
+            if fallback and fallback != primary:
+                provider = FallbackProvider([provider, _build_single(fallback, cfg, timeout)], timeout_sec=timeout)
+            _PROVIDERS[key] = provider
+        return provider
@@ -0,0 +1,547 @@
+"""Backend em memoria com a mesma interface usada do Redis (subconjunto).
+
+Usado quando CACHE_REDIS_ENABLED=false, para que um unico processo tenha
+historico, dedupe, locks e debounce sem Redis. Os dados nao sao
+compartilhados entre processos e somem ao reiniciar.
+
+- chaves em LRU com TTL e teto de memoria (LOCAL_STORE_MAX_BYTES/MAX_KEYS);
+  as fixas (LOCAL_STORE_PINNED) ficam fora do LRU e sao contadas a parte;
+- zsets com heap de prazos (zrangebyscore dos vencidos em O(k log n));
+- scripts Lua registrados via register_script_impl com um equivalente Python.
+"""
+import fnmatch
+import heapq
+import os
+import threading
+import time
+from collections import OrderedDict
+
+LOCAL_STORE_MAX_BYTES = int(os.getenv("LOCAL_STORE_MAX_BYTES", str(64 * 1024 * 1024)))
+LOCAL_STORE_MAX_KEYS = int(os.getenv("LOCAL_STORE_MAX_KEYS", "200000"))
+# Chaves que nunca sao despejadas por falta de memoria (perderiam mensagens).
+LOCAL_STORE_PINNED = ("pending_zset", ":buffer:", ":lock:", ":archive")
+_PINNED_WARN_SECONDS = 60
+
+_SCRIPT_IMPLS = {}
+
+
+def register_script_impl(lua_source: str, func):
+    """Equivalente Python de um script Lua: func(store, keys, args)."""
+    _SCRIPT_IMPLS[lua_source] = func
+
+
+def _is_pinned(key) -> bool:
+    return any(p in key for p in LOCAL_STORE_PINNED)
+
+
+def _size_of(value) -> int:
+    if isinstance(value, (bytes, bytearray, str)):
+        return len(value) + 48
+    if isinstance(value, list):
+        return sum(_size_of(v) for v in value) + 64
+    if isinstance(value, _ZSet):
+        return len(value.scores) * 96 + 64
+    if isinstance(value, _Stream):
+        return value.bytes + 64
+    if isinstance(value, dict):
+        return sum(_size_of(k) + _size_of(v) for k, v in value.items()) + 64
+    if isinstance(value, set):
+        return sum(_size_of(v) for v in value) + 64
+    return 64
+
+
+class _ZSet:
+    def __init__(self):
+        self.scores = {}
+        self.heap = []
+
+    def add(self, member, score):
+        self.scores[member] = score
+        heapq.heappush(self.heap, (score, member))
+        # Entradas obsoletas ficam no heap; reconstroi quando acumulam demais.
+        if len(self.heap) > 2 * len(self.scores) + 64:
+            self.heap = [(s, m) for m, s in self.scores.items()]
+            heapq.heapify(self.heap)
+
+    def remove(self, member) -> bool:
+        return self.scores.pop(member, None) is not None
+
+    def due(self, max_score) -> list:
+        out = []
+        popped = []
+        while self.heap and self.heap[0][0] <= max_score:
+            score, member = heapq.heappop(self.heap)
+            if self.scores.get(member) == score:
+                out.append(member)
+                popped.append((score, member))
+        for item in popped:
+            heapq.heappush(self.heap, item)
+        return out
+
+
+class _Stream:
+    def __init__(self):
+        # [(id, campos)] em ordem crescente de id ("ms-seq").
+        self.entries = []
+        self.last = (0, 0)
+        # Mantido a cada insercao/remocao (recalcular seria O(n) por XADD).
+        self.bytes = 0
+
+    @staticmethod
+    def entry_size(entry) -> int:
+        return len(entry[0]) + _size_of(entry[1]) + 48
+
+    def append(self, entry):
+        self.entries.append(entry)
+        self.bytes += self.entry_size(entry)
+
+    def drop(self, keep):
+        kept = [e for e in self.entries if keep(e)]
+        removed = len(self.entries) - len(kept)
+        if removed:
+            self.entries = kept
+            self.bytes = sum(self.entry_size(e) for e in kept)
+        return removed
+
+    def next_id(self) -> str:
+        ms = int(time.time() * 1000)
+        last_ms, last_seq = self.last
+        self.last = (ms, 0) if ms > last_ms else (last_ms, last_seq + 1)
+        return f"{self.last[0]}-{self.last[1]}"
+
+
+def _stream_id(v, upper: bool = False) -> tuple:
+    v = v.decode() if isinstance(v, bytes) else str(v)
+    if v == "-":
+        return (0, 0)
+    if v == "+":
+        return (float("inf"), float("inf"))
+    ms, _, seq = v.partition("-")
+    return (int(ms), int(seq) if seq else (float("inf") if upper else 0))
+
+
+class LocalScript:
+    def __init__(self, store, lua_source):
+        self.store = store
+        self.lua_source = lua_source
+
+    def __call__(self, keys=None, args=None, client=None):
+        func = _SCRIPT_IMPLS.get(self.lua_source)
+        if func is None:
+            raise NotImplementedError("script sem equivalente Python no backend local")
+        target = client if client is not None else self.store
+        keys, args = list(keys or []), list(args or [])
+
+        def run():
+            # Atomico como o EVAL: o RLock do store cobre todas as chamadas do script.
+            with self.store._lock:
+                return func(self.store, keys, args)
+
+        if isinstance(target, LocalPipeline):
+            return target._queue(run)
+        return run()
+
+
+class LocalPipeline:
+    def __init__(self, store):
+        self._store = store
+        self._calls = []
+
+    def _queue(self, fn):
+        self._calls.append(fn)
+        return self
+
+    def __getattr__(self, name):
+        method = getattr(self._store, name)
+
+        def queued(*args, **kwargs):
+            return self._queue(lambda: method(*args, **kwargs))
+
+        return queued
+
+    def execute(self):
+        calls, self._calls = self._calls, []
+        with self._store._lock:
+            return [fn() for fn in calls]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._calls = []
+
+
+class LocalRedis:
+    is_local = True
+
+    def __init__(self, max_bytes: int = LOCAL_STORE_MAX_BYTES, max_keys: int = LOCAL_STORE_MAX_KEYS):
+        self.max_bytes = max_bytes
+        self.max_keys = max_keys
+        self._lock = threading.RLock()
+        self._data = {}
+        # So as chaves despejaveis, da menos para a mais usada: o despejo tira
+        # do inicio sem varrer as fixas.
+        self._lru = OrderedDict()
+        self._sizes = {}
+        self._expires = {}
+        self._bytes = 0
+        self._pinned_bytes = 0
+        self._pinned_warned_at = 0.0
+        self._writes = 0
+
+    # ---- infraestrutura -------------------------------------------------
+
+    def ping(self):
+        return True
+
+    def pipeline(self, transaction=True):
+        return LocalPipeline(self)
+
+    def register_script(self, lua_source):
+        return LocalScript(self, lua_source)
+
+    def memory_bytes(self) -> int:
+        return self._bytes
+
+    def pinned_bytes(self) -> int:
+        return self._pinned_bytes
+
+    def _alive(self, key) -> bool:
+        deadline = self._expires.get(key)
+        if deadline is not None and deadline <= time.time():
+            self._drop(key)
+            return False
+        return key in self._data
+
+    def _get(self, key, kind=None):
+        if not self._alive(key):
+            return None
+        value = self._data[key]
+        if kind is not None and not isinstance(value, kind):
+            raise TypeError(f"WRONGTYPE {key}")
+        if key in self._lru:
+            self._lru.move_to_end(key)
+        return value
+
+    def _drop(self, key):
+        if key in self._data:
+            del self._data[key]
+            size = self._sizes.pop(key, 0)
+            self._bytes -= size
+            if self._lru.pop(key, None) is None:
+                self._pinned_bytes -= size
+        self._expires.pop(key, None)
+
+    def _touch(self, key, value):
+        self._data[key] = value
+        new_size = _size_of(key) + _size_of(value)
+        delta = new_size - self._sizes.get(key, 0)
+        self._bytes += delta
+        self._sizes[key] = new_size
+        if _is_pinned(key):
+            self._pinned_bytes += delta
+        else:
+            self._lru[key] = True
+            self._lru.move_to_end(key)
+        self._writes += 1
+        if self._writes % 1000 == 0:
+            self._sweep_expired()
+        self._enforce_limits()
+
+    def _sweep_expired(self):
+        now = time.time()
+        for key, deadline in list(self._expires.items()):
+            if deadline <= now:
+                self._drop(key)
+
+    def _enforce_limits(self):
+        # Despeja do menos usado para o mais usado; as fixas nem entram na fila.
+        while (self._bytes > self.max_bytes or len(self._data) > self.max_keys) and self._lru:
+            self._drop(next(iter(self._lru)))
+        if self._pinned_bytes > self.max_bytes:
+            now = time.time()
+            if now - self._pinned_warned_at >= _PINNED_WARN_SECONDS:
+                self._pinned_warned_at = now
+                print(
+                    f"[local] chaves fixas (buffer, locks, archive) ocupam {self._pinned_bytes} bytes, "
+                    f"acima de LOCAL_STORE_MAX_BYTES={self.max_bytes}; o arquivamento esta parado?"
+                )
+
+    # ---- chaves ----------------------------------------------------------
+
+    def delete(self, *keys):
+        with self._lock:
+            n = 0
+            for key in keys:
+                if self._alive(key):
+                    n += 1
+                self._drop(key)
+            return n
+
+    def exists(self, *keys):
+        with self._lock:
+            return sum(1 for k in keys if self._alive(k))
+
+    def expire(self, key, seconds):
+        with self._lock:
+            if not self._alive(key):
+                return False
+            self._expires[key] = time.time() + int(seconds)
+            return True
+
+    def ttl(self, key):
+        with self._lock:
+            if not self._alive(key):
+                return -2
+            deadline = self._expires.get(key)
+            return -1 if deadline is None else max(0, int(deadline - time.time()))
+
+    def scan_iter(self, match=None, count=None):
+        with self._lock:
+            keys = [k for k in list(self._data.keys()) if self._alive(k)]
+        for k in keys:
+            if match is None or fnmatch.fnmatchcase(k, match):
+                yield k
+
+    # ---- strings ---------------------------------------------------------
+
+    def get(self, key):
+        with self._lock:
+            return self._get(key)
+
+    def set(self, key, value, ex=None, px=None, nx=False, xx=False):
+        with self._lock:
+            exists = self._alive(key)
+            if (nx and exists) or (xx and not exists):
+                return None
+            self._expires.pop(key, None)
+            self._touch(key, value if isinstance(value, (bytes, str)) else str(value))
+            if ex is not None:
+                self._expires[key] = time.time() + int(ex)
+            elif px is not None:
+                self._expires[key] = time.time() + int(px) / 1000.0
+            return True
+
+    def setnx(self, key, value):
+        return bool(self.set(key, value, nx=True))
+
+    def incr(self, key, amount=1):
+        with self._lock:
+            value = int(self._get(key) or 0) + int(amount)
+            self._touch(key, str(value))
+            return value
+
+    # ---- bitmaps ---------------------------------------------------------
+
+    def getbit(self, key, offset):
+        with self._lock:
+            value = self._get(key, bytearray)
+            offset = int(offset)
+            if value is None or offset // 8 >= len(value):
+                return 0
+            return (value[offset // 8] >> (7 - offset % 8)) & 1
+
+    def setbit(self, key, offset, bit):
+        with self._lock:
+            value = self._get(key, bytearray)
+            if value is None:
+                value = bytearray()
+            offset = int(offset)
+            # Como no Redis, o bitmap cresce ate o maior offset escrito.
+            if offset // 8 >= len(value):
+                value.extend(bytes(offset // 8 + 1 - len(value)))
+            mask = 1 << (7 - offset % 8)
+            old = 1 if value[offset // 8] & mask else 0
+            if bit:
+                value[offset // 8] |= mask
+            else:
+                value[offset // 8] &= ~mask & 0xFF
+            self._touch(key, value)
+            return old
+
+    # ---- hashes e HyperLogLog ---------------------------------------------
+
+    def hincrby(self, key, field, amount=1):
+        with self._lock:
+            h = dict(self._get(key, dict) or {})
+            value = int(h.get(field, 0)) + int(amount)
+            h[field] = str(value)
+            self._touch(key, h)
+            return value
+
+    def hincrbyfloat(self, key, field, amount=1.0):
+        with self._lock:
+            h = dict(self._get(key, dict) or {})
+            value = float(h.get(field, 0)) + float(amount)
+            h[field] = repr(value)
+            self._touch(key, h)
+            return value
+
+    def hset(self, key, field=None, value=None, mapping=None):
+        with self._lock:
+            h = dict(self._get(key, dict) or {})
+            items = dict(mapping or {})
+            if field is not None:
+                items[field] = value
+            added = sum(1 for f in items if f not in h)
+            h.update({f: str(v) for f, v in items.items()})
+            self._touch(key, h)
+            return added
+
+    def hgetall(self, key):
+        with self._lock:
+            return dict(self._get(key, dict) or {})
+
+    def pfadd(self, key, *values):
+        # Conjunto exato no lugar do HyperLogLog (um processo, volume pequeno).
+        with self._lock:
+            current = self._get(key, set)
+            before = len(current) if current is not None else -1
+            current = set(current or ()) | set(values)
+            self._touch(key, current)
+            return 1 if len(current) != before else 0
+
+    def pfcount(self, *keys):
+        with self._lock:
+            union = set()
+            for key in keys:
+                union |= self._get(key, set) or set()
+            return len(union)
+
+    # ---- streams ---------------------------------------------------------
+
+    def xadd(self, name, fields, id="*", maxlen=None, approximate=True):
+        with self._lock:
+            stream = self._get(name, _Stream) or _Stream()
+            entry_id = stream.next_id()
+            stream.append((entry_id, dict(fields)))
+            if maxlen is not None and len(stream.entries) > int(maxlen):
+                # Aproximado como o MAXLEN ~: corta em blocos de 10%.
+                cut = len(stream.entries) - int(maxlen) + int(maxlen) // 10
+                for entry in stream.entries[:cut]:
+                    stream.bytes -= stream.entry_size(entry)
+                del stream.entries[:cut]
+            self._touch(name, stream)
+            return entry_id
+
+    def xrange(self, name, min="-", max="+", count=None):
+        with self._lock:
+            stream = self._get(name, _Stream)
+            if stream is None:
+                return []
+            lo, hi = _stream_id(min), _stream_id(max, upper=True)
+            out = []
+            for entry_id, fields in stream.entries:
+                if lo <= _stream_id(entry_id) <= hi:
+                    out.append((entry_id, dict(fields)))
+                    if count is not None and len(out) >= int(count):
+                        break
+            return out
+
+    def xdel(self, name, *ids):
+        with self._lock:
+            stream = self._get(name, _Stream)
+            if stream is None:
+                return 0
+            drop = {i.decode() if isinstance(i, bytes) else str(i) for i in ids}
+            removed = stream.drop(lambda e: e[0] not in drop)
+            self._touch(name, stream)
+            return removed
+
+    def xlen(self, name):
+        with self._lock:
+            stream = self._get(name, _Stream)
+            return 0 if stream is None else len(stream.entries)
+
+    # ---- listas ----------------------------------------------------------
+
+    def rpush(self, key, *values):
+        with self._lock:
+            lst = self._get(key, list)
+            lst = list(lst) if lst is not None else []
+            lst.extend(values)
+            self._touch(key, lst)
+            return len(lst)
+
+    def lpush(self, key, *values):
+        with self._lock:
+            lst = self._get(key, list)
+            lst = list(lst) if lst is not None else []
+            # Como no Redis: cada valor vai para a cabeca, o ultimo fica primeiro.
+            lst[:0] = list(reversed(values))
+            self._touch(key, lst)
+            return len(lst)
+
+    def llen(self, key):
+        with self._lock:
+            return len(self._get(key, list) or [])
+
+    def lrange(self, key, start, end):
+        with self._lock:
+            lst = self._get(key, list) or []
+            n = len(lst)
+            start = max(0, n + start if start < 0 else start)
+            end = n + end if end < 0 else end
+            return list(lst[start : end + 1])
+
+    def ltrim(self, key, start, end):
+        with self._lock:
+            lst = self._get(key, list)
+            if lst is None:
+                return True
+            kept = self.lrange(key, start, end)
+            if kept:
+                self._touch(key, kept)
+            else:
+                self._drop(key)
+            return True
+
+    # ---- zsets -----------------------------------------------------------
+
+    def zadd(self, key, mapping, nx=False, xx=False, gt=False, lt=False):
+        with self._lock:
+            zset = self._get(key, _ZSet) or _ZSet()
+            added = 0
+            changed = False
+            for member, score in mapping.items():
+                score = float(score)
+                current = zset.scores.get(member)
+                if (current is None and xx) or (current is not None and nx):
+                    continue
+                if current is not None and ((gt and score <= current) or (lt and score >= current)):
+                    continue
+                added += current is None
+                zset.add(member, score)
+                changed = True
+            if changed:
+                self._touch(key, zset)
+            return added
+
+    def zrem(self, key, *members):
+        with self._lock:
+            zset = self._get(key, _ZSet)
+            if zset is None:
+                return 0
+            removed = sum(1 for m in members if zset.remove(m))
+            self._touch(key, zset)
+            return removed
+
+    def zscore(self, key, member):
+        with self._lock:
+            zset = self._get(key, _ZSet)
+            return None if zset is None else zset.scores.get(member)
+
+    def zcard(self, key):
+        with self._lock:
+            zset = self._get(key, _ZSet)
+            return 0 if zset is None else len(zset.scores)
+
+    def zrangebyscore(self, key, min_score, max_score, withscores=False):
+        with self._lock:
+            zset = self._get(key, _ZSet)
+            if zset is None:
+                return []
+            members = [m for m in dict.fromkeys(zset.due(float(max_score))) if zset.scores[m] >= float(min_score)]
+            if withscores:
+                return [(m, float(zset.scores[m])) for m in members]
+            return members
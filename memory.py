@@ -1,37 +1,280 @@
 import os
-import json
 import time
-import redis
-from dotenv import load_dotenv
+import threading
 
-load_dotenv()
+from analytics import queue_message_stats
+from codec import decode, encode
+from local_store import register_script_impl
+from redis_conn import REDIS_PREFIX, get_redis
 
-REDIS_ENABLED = os.getenv("CACHE_REDIS_ENABLED", "false").lower() == "true"
-REDIS_URI = os.getenv("CACHE_REDIS_URI", "redis://localhost:6379/0")
-REDIS_PREFIX = os.getenv("CACHE_REDIS_PREFIX_KEY", "evolution")
+# Resumo incremental: turnos que saem da janela vao para a fila de "fold" e
+# sao resumidos em background quando a fila atinge SUMMARY_FOLD_BATCH itens.
+SUMMARY_ENABLED = os.getenv("SUMMARY_ENABLED", "true").lower() == "true"
+SUMMARY_FOLD_BATCH = int(os.getenv("SUMMARY_FOLD_BATCH", "6"))
+SUMMARY_TTL_SECONDS = int(os.getenv("SUMMARY_TTL_SECONDS", str(7 * 24 * 60 * 60)))
+# Arquivamento write-behind (archive.py): cada item gravado tambem vai para um
+# stream, no mesmo script. Limite de itens do stream se o arquivador parar.
+ARCHIVE_ENABLED = os.getenv("ARCHIVE_ENABLED", "true").lower() == "true"
+ARCHIVE_STREAM_MAXLEN = int(os.getenv("ARCHIVE_STREAM_MAXLEN", "100000"))
 
-r = redis.Redis.from_url(REDIS_URI, decode_responses=True) if REDIS_ENABLED else None
+r = get_redis()
+# Listas de historico/buffer guardam bytes do codec: leitura sem decode.
+rb = get_redis(binary=True)
 
-def _chat_key(phone: str) -> str:
-    return f"{REDIS_PREFIX}:chat:{phone}"
+# `prefix` e o namespace da loja (tenants.Tenant.prefix); None = REDIS_PREFIX.
+def _chat_key(phone: str, prefix: str | None = None) -> str:
+    return f"{prefix or REDIS_PREFIX}:chat:{phone}"
 
-def mem_get(phone: str, max_items: int = 12):
+def _summary_key(phone: str, prefix: str | None = None) -> str:
+    return f"{prefix or REDIS_PREFIX}:summary:{phone}"
+
+def _fold_key(phone: str, prefix: str | None = None) -> str:
+    return f"{prefix or REDIS_PREFIX}:fold:{phone}"
+
+# Versao do chat: +1 a cada item gravado (e a cada limpeza). O item i de uma
+# lista com L itens tem seq = versao - L + 1 + i; e o cursor do painel.
+def _version_key(phone: str, prefix: str | None = None) -> str:
+    return f"{prefix or REDIS_PREFIX}:chatver:{phone}"
+
+def mem_get(phone: str, max_items: int = 12, prefix: str | None = None):
     if not r:
         return []
-    items = r.lrange(_chat_key(phone), -max_items, -1)
+    return _decode_items(rb.lrange(_chat_key(phone, prefix), -max_items, -1))
+
+def archive_stream_key() -> str:
+    # Um stream por instalacao; a loja vai no campo "ns" de cada entrada.
+    return f"{REDIS_PREFIX}:archive"
+
+def mem_version(phone: str, prefix: str | None = None) -> int:
+    """Versao atual do chat (0 = sem historico); nao le a lista."""
+    if not r:
+        return 0
+    return int(r.get(_version_key(phone, prefix)) or 0)
+
+def mem_since(phone: str, since: int | None, max_items: int = 200, prefix: str | None = None):
+    """Itens com seq > since: (versao, [(seq, item)], reset).
+
+    reset=True quando o cursor nao encaixa na lista atual (itens ja sairam da
+    janela, chat limpo ou expirado): o chamador deve trocar o que tem pelos
+    itens retornados em vez de acrescentar. since=None devolve a cauda da lista
+    (ultimos max_items), sempre com reset=True.
+    """
+    if not r:
+        return 0, [], since is None
+    version, reset, raw = _since_script(
+        keys=[_chat_key(phone, prefix), _version_key(phone, prefix)],
+        args=[-1 if since is None else int(since), int(max_items)],
+    )
+    version = int(version or 0)
+    first = version - len(raw) + 1
+    items = []
+    for offset, it in enumerate(raw):
+        try:
+            items.append((first + offset, decode(it)))
+        except Exception:
+            pass
+    return version, items, bool(int(reset))
+
+def _decode_items(raw_items) -> list[dict]:
     out = []
-    for it in items:
+    for it in raw_items:
         try:
-            out.append(json.loads(it))
+            out.append(decode(it))
         except Exception:
             pass
     return out
 
-def mem_add(phone: str, role: str, content: str, max_items: int = 12, ttl_sec: int = 6 * 60 * 60):
+# Append + trim + expire numa unica ida ao Redis. Os itens que saem da janela
+# vao para a fila de fold (ARGV[3] == "1") e, com ARGV[8] > 0, o item tambem
+# entra no stream de arquivamento. Retorna o tamanho da fila de fold.
+_APPEND_LUA = """
+local size = redis.call('RPUSH', KEYS[1], ARGV[5])
+redis.call('INCR', KEYS[3])
+redis.call('EXPIRE', KEYS[3], tonumber(ARGV[2]))
+local overflow = size - tonumber(ARGV[1])
+local pending = 0
+if overflow > 0 then
+  if ARGV[3] == '1' then
+    local old = redis.call('LRANGE', KEYS[1], 0, overflow - 1)
+    pending = redis.call('RPUSH', KEYS[2], unpack(old))
+    redis.call('EXPIRE', KEYS[2], tonumber(ARGV[4]))
+  end
+  redis.call('LTRIM', KEYS[1], -tonumber(ARGV[1]), -1)
+end
+redis.call('EXPIRE', KEYS[1], tonumber(ARGV[2]))
+if tonumber(ARGV[8]) > 0 then
+  redis.call('XADD', KEYS[4], 'MAXLEN', '~', ARGV[8], '*', 'ns', ARGV[6], 'p', ARGV[7], 'd', ARGV[5])
+end
+return pending
+"""
+
+def _append_local(store, keys, args):
+    # Mesmo comportamento do _APPEND_LUA para o backend em memoria.
+    chat_key, fold_key, version_key, archive_key = keys
+    max_items, ttl_sec, fold, fold_ttl, item, ns, phone, archive_maxlen = args
+    size = store.rpush(chat_key, item)
+    store.incr(version_key)
+    store.expire(version_key, int(ttl_sec))
+    overflow = size - int(max_items)
+    pending = 0
+    if overflow > 0:
+        if str(fold) == "1":
+            pending = store.rpush(fold_key, *store.lrange(chat_key, 0, overflow - 1))
+            store.expire(fold_key, int(fold_ttl))
+        store.ltrim(chat_key, -int(max_items), -1)
+    store.expire(chat_key, int(ttl_sec))
+    if int(archive_maxlen) > 0:
+        store.xadd(archive_key, {"ns": ns, "p": phone, "d": item}, maxlen=int(archive_maxlen))
+    return pending
+
+register_script_impl(_APPEND_LUA, _append_local)
+_append_script = r.register_script(_APPEND_LUA) if r else None
+
+# Versao e cauda da lista lidas juntas (um append no meio mudaria as seqs).
+# ARGV[1] = cursor (-1 = sem cursor, devolve a cauda). Chat gravado antes do
+# contador de versao existir (versao < LLEN) semeia a versao com o tamanho da
+# lista e responde como reset.
+_SINCE_LUA = """
+local version = tonumber(redis.call('GET', KEYS[2]) or '0')
+local length = redis.call('LLEN', KEYS[1])
+local reset = 0
+if version < length then
+  version = length
+  reset = 1
+  redis.call('SET', KEYS[2], version)
+  local ttl = redis.call('TTL', KEYS[1])
+  if ttl > 0 then redis.call('EXPIRE', KEYS[2], ttl) end
+end
+local missing = version - tonumber(ARGV[1])
+if reset == 1 or missing < 0 or missing > length then
+  reset = 1
+  missing = length
+end
+local count = math.min(missing, tonumber(ARGV[2]))
+local items = {}
+if count > 0 then
+  items = redis.call('LRANGE', KEYS[1], -count, -1)
+end
+return {version, reset, items}
+"""
+
+def _since_local(store, keys, args):
+    # Mesmo comportamento do _SINCE_LUA para o backend em memoria.
+    chat_key, version_key = keys
+    since, max_items = int(args[0]), int(args[1])
+    version = int(store.get(version_key) or 0)
+    length = store.llen(chat_key)
+    reset = 0
+    if version < length:
+        version = length
+        reset = 1
+        store.set(version_key, str(version))
+        ttl = store.ttl(chat_key)
+        if ttl > 0:
+            store.expire(version_key, ttl)
+    missing = version - since
+    if reset or missing < 0 or missing > length:
+        reset = 1
+        missing = length
+    count = min(missing, max_items)
+    items = store.lrange(chat_key, -count, -1) if count > 0 else []
+    return [version, reset, items]
+
+register_script_impl(_SINCE_LUA, _since_local)
+_since_script = rb.register_script(_SINCE_LUA) if rb else None
+
+def _queue_append(client, phone: str, role: str, content: str, max_items: int, ttl_sec: int, prefix=None):
+    item = encode({"t": int(time.time()), "role": role, "content": content})
+    _append_script(
+        keys=[_chat_key(phone, prefix), _fold_key(phone, prefix), _version_key(phone, prefix), archive_stream_key()],
+        args=[
+            max_items,
+            ttl_sec,
+            "1" if SUMMARY_ENABLED else "0",
+            SUMMARY_TTL_SECONDS,
+            item,
+            prefix or REDIS_PREFIX,
+            phone,
+            ARCHIVE_STREAM_MAXLEN if ARCHIVE_ENABLED else 0,
+        ],
+        client=client,
+    )
+
+def mem_add(phone: str, role: str, content: str, max_items: int = 12, ttl_sec: int = 6 * 60 * 60, prefix=None, source=None):
+    if not r:
+        return
+    mem_add_many([(phone, role, content)], max_items=max_items, ttl_sec=ttl_sec, prefix=prefix, source=source)
+
+def mem_add_many(entries, pipe=None, max_items: int = 12, ttl_sec: int = 6 * 60 * 60, prefix=None, source=None):
+    """Enfileira varios (phone, role, content) num pipeline.
+
+    Sem `pipe`, executa na hora (uma ida ao Redis). Com `pipe`, so enfileira: o
+    chamador executa e repassa os resultados destes itens para mem_check_folds
+    (os primeiros len(entries) resultados). `source` ("llm", "human") separa as
+    respostas nas estatisticas.
+    """
+    if not r or not entries:
+        return
+    own = pipe is None
+    client = r.pipeline(transaction=False) if own else pipe
+    for phone, role, content in entries:
+        _queue_append(client, phone, role, content, max_items, ttl_sec, prefix)
+    queue_message_stats(client, entries, prefix or REDIS_PREFIX, source)
+    if own:
+        mem_check_folds(entries, client.execute(), prefix=prefix)
+
+def mem_check_folds(entries, results, prefix=None):
+    # Dispara o resumo em background quando a fila de fold enche.
+    scheduled = set()
+    for (phone, _, _), pending in zip(entries, results):
+        if phone in scheduled:
+            continue
+        try:
+            if int(pending or 0) >= SUMMARY_FOLD_BATCH:
+                scheduled.add(phone)
+                _schedule_fold(phone, prefix)
+        except (TypeError, ValueError):
+            pass
+
+def mem_summary(phone: str, prefix: str | None = None) -> str:
+    if not r:
+        return ""
+    return r.get(_summary_key(phone, prefix)) or ""
+
+def mem_clear(phone: str, prefix: str | None = None):
     if not r:
         return
-    item = json.dumps({"t": int(time.time()), "role": role, "content": content}, ensure_ascii=False)
-    key = _chat_key(phone)
-    r.rpush(key, item)
-    r.ltrim(key, -max_items, -1)
-    r.expire(key, ttl_sec)
+    pipe = r.pipeline()
+    pipe.delete(_chat_key(phone, prefix), _summary_key(phone, prefix), _fold_key(phone, prefix))
+    # A versao continua subindo para o painel perceber a limpeza (reset).
+    pipe.incr(_version_key(phone, prefix))
+    pipe.expire(_version_key(phone, prefix), 6 * 60 * 60)
+    pipe.execute()
+
+def _schedule_fold(phone: str, prefix: str | None = None):
+    threading.Thread(target=_fold_summary, args=(phone, prefix), daemon=True).start()
+
+def _fold_summary(phone: str, prefix: str | None = None):
+    lock_key = f"{prefix or REDIS_PREFIX}:summarizing:{phone}"
+    if not r.set(lock_key, "1", ex=120, nx=True):
+        return
+    try:
+        fold_key = _fold_key(phone, prefix)
+        raw = rb.lrange(fold_key, 0, -1)
+        if not raw:
+            return
+        items = _decode_items(raw)
+
+        from ai_service import summarize_conversation
+
+        summary = summarize_conversation(mem_summary(phone, prefix), items)
+        if not summary:
+            return
+        pipe = r.pipeline()
+        pipe.set(_summary_key(phone, prefix), summary, ex=SUMMARY_TTL_SECONDS)
+        pipe.ltrim(fold_key, len(raw), -1)
+        pipe.execute()
+    except Exception as e:
+        print(f"[memory][{phone}] falha ao resumir historico:", e)
+    finally:
+        r.delete(lock_key)
@@ -0,0 +1,203 @@
+"""Metricas no formato texto do Prometheus, sem dependencias externas.
+
+Os valores sao por processo: sob gunicorn com varios workers, cada scrape de
+/metrics ve o worker que atendeu a requisicao.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+_registry = []
+_registry_lock = threading.Lock()
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape(v) -> str:
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(key: tuple, extra: tuple = ()) -> str:
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _fmt(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if not float(v).is_integer() else str(int(v))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def _header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, help_text):
+        super().__init__(name, help_text)
+        self._values = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(_label_key(labels), 0)
+
+    def render(self) -> list[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return self._header() + [f"{self.name}{_format_labels(k)} {_fmt(v)}" for k, v in items]
+
+
+class Gauge(_Metric):
+    """Gauge lido na hora do scrape por uma funcao (ex.: tamanho da fila)."""
+
+    kind = "gauge"
+
+    def __init__(self, name, help_text, fn=None):
+        super().__init__(name, help_text)
+        self._fn = fn
+        self._values = {}
+
+    def set_function(self, fn):
+        self._fn = fn
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[_label_key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels) -> float:
+        return self._values.get(_label_key(labels), 0)
+
+    def render(self) -> list[str]:
+        with self._lock:
+            items = list(self._values.items())
+        if self._fn is not None:
+            try:
+                items = [((), float(self._fn()))]
+            except Exception:
+                items = []
+        return self._header() + [f"{self.name}{_format_labels(k)} {_fmt(v)}" for k, v in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [contagem por bucket..., soma, total]
+        self._values = {}
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = [0] * len(self.buckets) + [0.0, 0]
+                self._values[key] = state
+            for i, b in enumerate(self.buckets):
+                if value <= b:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0, **labels)
+
+    def count(self, **labels) -> int:
+        state = self._values.get(_label_key(labels))
+        return state[-1] if state else 0
+
+    def render(self) -> list[str]:
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._values.items()]
+        lines = self._header()
+        for key, state in items:
+            for i, b in enumerate(self.buckets):
+                lines.append(f"{self.name}_bucket{_format_labels(key, (('le', _fmt(b)),))} {state[i]}")
+            lines.append(f"{self.name}_bucket{_format_labels(key, (('le', '+Inf'),))} {state[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {_fmt(state[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {state[-1]}")
+        return lines
+
+
+def render_all() -> str:
+    with _registry_lock:
+        metrics = list(_registry)
+    lines = []
+    for m in metrics:
+        lines.extend(m.render())
+    return "\n".join(lines) + "\n"
+
+
+def register_metrics_route(app):
+    from flask import Response
+
+    @app.get("/metrics")
+    def metrics_endpoint():
+        return Response(render_all(), mimetype="text/plain; version=0.0.4")
+
+
+# ---- metricas do pipeline de resposta ------------------------------------
+
+WEBHOOK_REQUESTS = Counter("webhook_requests_total", "Requisicoes recebidas em /webhook por resultado.")
+WEBHOOK_SECONDS = Histogram("webhook_duration_seconds", "Tempo de processamento de /webhook.")
+WEBHOOK_MESSAGES = Counter("webhook_messages_total", "Mensagens do webhook por tipo e destino.")
+DEDUPE_HITS = Counter("dedupe_hits_total", "Mensagens ignoradas por ja terem sido processadas.")
+DEBOUNCE_WAIT_SECONDS = Histogram(
+    "debounce_wait_seconds",
+    "Tempo entre a primeira mensagem no buffer e o flush.",
+    buckets=(1, 2, 5, 10, 20, 30, 60, 90, 120, 180, 300, 600),
+)
+REPLY_STAGE_SECONDS = Histogram("reply_stage_seconds", "Duracao das etapas de generate_reply.")
+REPLY_SECONDS = Histogram("reply_duration_seconds", "Duracao total do processamento de um telefone no worker.")
+REPLIES = Counter("replies_total", "Respostas do worker por resultado.")
+SEND_TEXT_SECONDS = Histogram("send_text_duration_seconds", "Latencia do envio pela Evolution API.")
+SEND_TEXT_FAILURES = Counter("send_text_failures_total", "Falhas no envio pela Evolution API.")
+TRANSCRIPTION_SECONDS = Histogram("transcription_duration_seconds", "Download + transcricao de audio.")
+PENDING_DEPTH = Gauge("pending_zset_depth", "Telefones aguardando flush no debounce.")
+WORKER_ACTIVE = Gauge("worker_active_jobs", "Telefones sendo processados agora pelo worker.")
+ARCHIVED_MESSAGES = Counter("archived_messages_total", "Mensagens gravadas na tabela messages pelo arquivador.")
+ARCHIVE_FAILURES = Counter("archive_failures_total", "Lotes do arquivador que falharam ao gravar no banco.")
+ARCHIVE_BACKLOG = Gauge("archive_stream_length", "Entradas aguardando arquivamento no stream.")
+DISPATCH_WAIT_SECONDS = Histogram(
+    "dispatch_wait_seconds",
+    "Espera na fila do worker (vencimento no pending_zset ate o despacho) por classe de prioridade.",
+    buckets=(0.5, 1, 2, 5, 10, 30, 60, 120, 300, 600),
+)
+DISPATCH_DEFERRED = Counter("dispatch_deferred_total", "Telefones vencidos que ficaram para o proximo tick, por motivo e classe.")
+IMAGE_DESCRIPTIONS = Counter("image_descriptions_total", "Fotos de clientes descritas, por origem (cache ou modelo).")
@@ -46,7 +46,47 @@ def extract_item(data: dict) -> dict | None:
     if msg.get("messageType") == "audioMessage" or "audioMessage" in m:
         audio = m.get("audioMessage") or {}
         mimetype = audio.get("mimetype") or "audio/ogg"  # fallback comum p/ ptt opus
-        return {"type": "audio", "phone": phone, "id": msg_id, "mime": mimetype}
+        seconds = audio.get("seconds")
+        return {
+            "type": "audio",
+            "phone": phone,
+            "id": msg_id,
+            "mime": mimetype,
+            "seconds": int(seconds) if isinstance(seconds, (int, float)) else None,
+        }
 
-    # ... seus outros tipos (text, image, etc)
+    if msg.get("messageType") == "imageMessage" or "imageMessage" in m:
+        # Mesmo filtro do texto: so conversa individual.
+        jid = key.get("remoteJidAlt") or remote
+        if "@s.whatsapp.net" not in jid:
+            return None
+        image = m.get("imageMessage") or {}
+        sha = image.get("fileSha256")
+        return {
+            "type": "image",
+            "phone": jid.split("@")[0].lstrip("+"),
+            "id": msg_id,
+            "mime": image.get("mimetype") or "image/jpeg",
+            "caption": str(image.get("caption") or "").strip(),
+            "sha": sha if isinstance(sha, str) else None,
+        }
+
+    # ... seus outros tipos (text, etc)
     return None
+
+
+def extract_presences(payload: dict) -> list[tuple[str, str]]:
+    """[(telefone, estado)] de um evento presence.update da Evolution.
+
+    Estados: composing, recording, paused, available, unavailable.
+    """
+    data = payload.get("data") or {}
+    presences = data.get("presences") if isinstance(data, dict) else None
+    out = []
+    for jid, info in (presences or {}).items():
+        if "@s.whatsapp.net" not in str(jid) or not isinstance(info, dict):
+            continue
+        state = info.get("lastKnownPresence")
+        if state:
+            out.append((str(jid).split("@")[0].lstrip("+"), str(state)))
+    return out
@@ -0,0 +1,101 @@
+"""Profiling sob demanda: amostra as pilhas de todas as threads por N segundos.
+
+cProfile so enxerga a thread que o ligou; como cada resposta roda numa thread
+propria do worker, aqui usamos amostragem de pilha (sys._current_frames) e
+agregamos por funcao e por pilha colapsada (formato do flamegraph.pl/speedscope).
+
+Rota: POST /debug/profile?seconds=10&interval_ms=5[&format=collapsed]
+com o header X-Admin-Token igual a ADMIN_TOKEN. Sem ADMIN_TOKEN a rota fica
+desligada.
+"""
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "").strip()
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "60"))
+
+_running = threading.Lock()
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}"
+
+
+def sample_stacks(seconds: float, interval_sec: float = 0.005, max_depth: int = 64) -> dict:
+    """Amostra todas as threads (menos a propria) e devolve o perfil agregado."""
+    me = threading.get_ident()
+    names = {t.ident: t.name for t in threading.enumerate()}
+    stacks = Counter()
+    self_counts = Counter()
+    total_counts = Counter()
+    samples = 0
+
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            labels = []
+            while frame is not None and len(labels) < max_depth:
+                labels.append(_frame_label(frame))
+                frame = frame.f_back
+            if not labels:
+                continue
+            labels.reverse()
+            thread = names.get(ident) or str(ident)
+            stacks[";".join([thread.split("-")[0]] + labels)] += 1
+            self_counts[labels[-1]] += 1
+            for label in set(labels):
+                total_counts[label] += 1
+            samples += 1
+        time.sleep(interval_sec)
+
+    def _top(counter, n=40):
+        return [
+            {"frame": label, "samples": c, "pct": round(100.0 * c / samples, 2) if samples else 0.0}
+            for label, c in counter.most_common(n)
+        ]
+
+    return {
+        "seconds": seconds,
+        "interval_ms": interval_sec * 1000,
+        "samples": samples,
+        "top_self": _top(self_counts),
+        "top_cumulative": _top(total_counts),
+        "stacks": stacks,
+    }
+
+
+def collapsed(profile: dict) -> str:
+    return "\n".join(f"{stack} {count}" for stack, count in profile["stacks"].most_common()) + "\n"
+
+
+def register_profiling_route(app):
+    from flask import Response, jsonify, request
+
+    @app.post("/debug/profile")
+    def debug_profile():
+        if not ADMIN_TOKEN or request.headers.get("X-Admin-Token") != ADMIN_TOKEN:
+            return jsonify({"ok": False, "error": "FORBIDDEN"}), 403
+
+        try:
+            seconds = min(PROFILE_MAX_SECONDS, max(0.1, float(request.args.get("seconds", "10"))))
+            interval_ms = min(1000.0, max(1.0, float(request.args.get("interval_ms", "5"))))
+        except ValueError:
+            return jsonify({"ok": False, "error": "INVALID_ARGS"}), 400
+
+        if not _running.acquire(blocking=False):
+            return jsonify({"ok": False, "error": "PROFILE_RUNNING"}), 409
+        try:
+            profile = sample_stacks(seconds, interval_ms / 1000.0)
+        finally:
+            _running.release()
+
+        if request.args.get("format") == "collapsed":
+            return Response(collapsed(profile), mimetype="text/plain")
+        profile["stacks"] = dict(profile["stacks"].most_common(200))
+        return jsonify({"ok": True, **profile})
@@ -0,0 +1,182 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from redis_conn import get_redis, key
+
+CONTEXT_CACHE_ENABLED = os.getenv("CONTEXT_CACHE_ENABLED", "true").lower() == "true"
+CONTEXT_CACHE_TTL_SECONDS = int(os.getenv("CONTEXT_CACHE_TTL_SECONDS", "3600"))
+# Depois de uma falha (ex.: prompt abaixo do minimo de tokens do modelo),
+# espera esse tempo antes de tentar criar o cache de novo.
+CONTEXT_CACHE_RETRY_SECONDS = int(os.getenv("CONTEXT_CACHE_RETRY_SECONDS", "600"))
+# Handles mantidos por processo (um por modelo + prompt; no multi-loja, um por loja).
+CONTEXT_CACHE_MAX_ENTRIES = int(os.getenv("CONTEXT_CACHE_MAX_ENTRIES", "64"))
+# save_store no painel (outro processo) chega aos workers em ate este tempo.
+CONTEXT_CACHE_EPOCH_CHECK_SECONDS = float(os.getenv("CONTEXT_CACHE_EPOCH_CHECK_SECONDS", "5"))
+_RENEW_MARGIN_SECONDS = 60
+_STRIPES = 16
+_UNSET = object()
+
+
+def prompt_version(system_prompt: str) -> str:
+    return hashlib.sha256((system_prompt or "").encode("utf-8")).hexdigest()[:16]
+
+
+def _epoch_key() -> str:
+    return key("prompt_cache", "epoch")
+
+
+def request_invalidation():
+    """Pede a todos os processos que apaguem seus handles (save_store no painel).
+
+    O painel nao chama o provedor e nao tem handles; a epoca no Redis faz os
+    workers apagarem os deles no Gemini no proximo get.
+    """
+    r = get_redis()
+    if r is None:
+        return
+    try:
+        r.incr(_epoch_key())
+    except Exception as e:
+        print("[cache] falha ao propagar invalidacao:", e)
+
+
+class PromptCache:
+    """Handles de context caching do Gemini para o system prompt renderizado.
+
+    Um handle por (modelo, versao do prompt), num LRU de ate `max_entries`:
+    lojas que se revezam reaproveitam cada uma o seu. Um handle so e apagado no
+    servidor quando sai do LRU ou vence (renovado RENEW_MARGIN antes), ou quando
+    request_invalidation() (save_store no painel) muda a epoca no Redis: cada
+    processo apaga todos os seus em ate CONTEXT_CACHE_EPOCH_CHECK_SECONDS.
+    A criacao e a remocao remotas rodam fora do lock global, com um lock por
+    chave (em faixas), entao uma loja criando handle nao segura as respostas
+    das outras.
+    Qualquer falha devolve None e o chamador manda o prompt completo.
+    """
+
+    def __init__(
+        self,
+        ttl_sec: int = CONTEXT_CACHE_TTL_SECONDS,
+        retry_sec: int = CONTEXT_CACHE_RETRY_SECONDS,
+        max_entries: int = CONTEXT_CACHE_MAX_ENTRIES,
+    ):
+        self.ttl_sec = ttl_sec
+        self.retry_sec = retry_sec
+        self.max_entries = max(1, max_entries)
+        self._lock = threading.Lock()
+        self._stripes = [threading.Lock() for _ in range(_STRIPES)]
+        # (model, versao) -> {"name", "expires_at"}, do menos para o mais usado
+        self._entries = OrderedDict()
+        self._epoch = _UNSET
+        self._epoch_checked_at = 0.0
+
+    def _check_epoch(self, client, now: float):
+        with self._lock:
+            if now - self._epoch_checked_at < CONTEXT_CACHE_EPOCH_CHECK_SECONDS:
+                return
+            self._epoch_checked_at = now
+        r = get_redis()
+        if r is None:
+            return
+        try:
+            epoch = r.get(_epoch_key())
+        except Exception:
+            return
+        with self._lock:
+            changed = self._epoch is not _UNSET and epoch != self._epoch
+            self._epoch = epoch
+        if changed:
+            print("[cache] prompt alterado no painel; apagando handles de contexto")
+            self.invalidate(client)
+
+    def _fresh(self, key, now: float) -> dict | None:
+        entry = self._entries.get(key)
+        if entry and entry["expires_at"] - _RENEW_MARGIN_SECONDS > now:
+            self._entries.move_to_end(key)
+            return entry
+        return None
+
+    def get(self, client, model: str, system_prompt: str) -> str | None:
+        entry_key = (model, prompt_version(system_prompt))
+        now = time.time()
+        self._check_epoch(client, now)
+        with self._lock:
+            entry = self._fresh(entry_key, now)
+            if entry:
+                return entry["name"]
+
+        with self._stripes[hash(entry_key) % _STRIPES]:
+            # Outra thread pode ter criado o handle enquanto esta esperava.
+            with self._lock:
+                entry = self._fresh(entry_key, now)
+                if entry:
+                    return entry["name"]
+                stale = self._entries.pop(entry_key, None)
+            if stale and stale.get("name"):
+                self._delete_remote(client, stale["name"])
+
+            name = self._create_remote(client, model, entry_key[1], system_prompt)
+            expires_at = now + (self.ttl_sec if name else self.retry_sec)
+            with self._lock:
+                self._entries[entry_key] = {"name": name, "expires_at": expires_at}
+                evicted = self._evict(now)
+        for old in evicted:
+            self._delete_remote(client, old)
+        return name
+
+    def _evict(self, now: float) -> list:
+        """Tira os vencidos e o excedente do LRU; devolve os nomes a apagar."""
+        names = []
+        for k in [k for k, e in self._entries.items() if e["expires_at"] <= now]:
+            entry = self._entries.pop(k)
+            if entry.get("name"):
+                names.append(entry["name"])
+        while len(self._entries) > self.max_entries:
+            _, entry = self._entries.popitem(last=False)
+            if entry.get("name"):
+                names.append(entry["name"])
+        return names
+
+    def _create_remote(self, client, model: str, version: str, system_prompt: str) -> str | None:
+        try:
+            from google.genai import types
+
+            cache = client.caches.create(
+                model=model,
+                config=types.CreateCachedContentConfig(
+                    display_name=f"system-prompt-{version}",
+                    system_instruction=system_prompt,
+                    ttl=f"{self.ttl_sec}s",
+                ),
+            )
+            return getattr(cache, "name", None)
+        except Exception as e:
+            print("[cache] contexto nao criado, usando prompt completo:", e)
+            return None
+
+    def invalidate(self, client, model: str | None = None, system_prompt: str | None = None):
+        """Apaga os handles (todos, de um modelo, ou so de um prompt dele)."""
+        version = prompt_version(system_prompt) if system_prompt is not None else None
+        with self._lock:
+            keys = [
+                k for k in self._entries
+                if (model is None or k[0] == model) and (version is None or k[1] == version)
+            ]
+            entries = [self._entries.pop(k) for k in keys]
+        for entry in entries:
+            if entry.get("name"):
+                self._delete_remote(client, entry["name"])
+
+    @staticmethod
+    def _delete_remote(client, name: str):
+        try:
+            client.caches.delete(name=name)
+        except Exception:
+            # Se ja expirou no servidor, nada a fazer.
+            pass
+
+
+PROMPT_CACHE = PromptCache()
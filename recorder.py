@@ -0,0 +1,156 @@
+"""Gravacao opcional dos payloads do /webhook para replay (bench/replay.py).
+
+Com WEBHOOK_RECORD_FILE definido, cada POST /webhook vira uma linha JSONL
+{"t": <chegada unix>, "payload": <payload sanitizado>}. A escrita e feita por
+uma thread de fundo; se a fila encher, a linha e descartada.
+
+Sanitizacao:
+- telefones/JIDs viram numeros pseudonimos estaveis (mesmo telefone -> mesmo
+  pseudonimo, com o mesmo comprimento e DDI/DDD preservados);
+- pushName, apikey, miniaturas, chaves e URLs de midia sao removidos;
+- no texto, e-mails sao mascarados e grupos de digitos com 6 ou mais
+  digitos, mesmo separados por espaco, ponto, hifen ou parenteses
+  ("(11) 98765-4321", "123.456.789-00"), tem todos os digitos trocados,
+  mantendo os separadores (WEBHOOK_RECORD_REDACT_TEXT=true troca o texto
+  inteiro por "x").
+"""
+import hashlib
+import json
+import os
+import queue
+import re
+import threading
+import time
+
+WEBHOOK_RECORD_FILE = os.getenv("WEBHOOK_RECORD_FILE", "").strip()
+WEBHOOK_RECORD_SALT = os.getenv("WEBHOOK_RECORD_SALT", "iawhatsapp")
+WEBHOOK_RECORD_REDACT_TEXT = os.getenv("WEBHOOK_RECORD_REDACT_TEXT", "false").lower() == "true"
+
+_DROP_KEYS = {
+    "pushName",
+    "apikey",
+    "jpegThumbnail",
+    "thumbnail",
+    "mediaKey",
+    "fileSha256",
+    "fileEncSha256",
+    "directPath",
+    "url",
+    "base64",
+    "waveform",
+    "profilePicUrl",
+    "server_url",
+}
+_JID_KEYS = {"remoteJid", "participant", "sender", "owner", "number", "remoteJidAlt"}
+_TEXT_KEYS = {"conversation", "text", "caption"}
+_JID_RE = re.compile(r"^\+?(\d{6,})(@.*)?$")
+# Digitos com separadores no meio; so vira mascara com _MIN_TEXT_DIGITS ou mais.
+_DIGITS_RE = re.compile(r"\+?\d(?:[ \t().\-]*\d)+")
+_MIN_TEXT_DIGITS = 6
+_EMAIL_RE = re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+")
+
+
+def _pseudo_digits(digits: str, keep_len: int = 4) -> str:
+    keep = digits[:keep_len]
+    h = hashlib.sha256((WEBHOOK_RECORD_SALT + digits).encode()).hexdigest()
+    tail = str(int(h, 16))[: len(digits) - len(keep)]
+    return keep + tail.rjust(len(digits) - len(keep), "0")
+
+
+def _sanitize_jid(value: str) -> str:
+    m = _JID_RE.match(value)
+    if not m:
+        return value
+    return _pseudo_digits(m.group(1)) + (m.group(2) or "")
+
+
+def _sanitize_text(value: str) -> str:
+    if WEBHOOK_RECORD_REDACT_TEXT:
+        return "x" * len(value)
+    value = _EMAIL_RE.sub("<email>", value)
+    return _DIGITS_RE.sub(_mask_digits, value)
+
+
+def _mask_digits(m) -> str:
+    group = m.group(0)
+    digits = re.sub(r"\D", "", group)
+    if len(digits) < _MIN_TEXT_DIGITS:
+        return group
+    # No texto nada do numero original fica, nem o DDD.
+    fake = iter(_pseudo_digits(digits, keep_len=0))
+    return re.sub(r"\d", lambda _: next(fake), group)
+
+
+def _is_jid(value) -> bool:
+    return isinstance(value, str) and "@" in value and bool(_JID_RE.match(value))
+
+
+def sanitize_payload(obj):
+    """Copia o payload sem dados pessoais, mantendo a forma e os tamanhos."""
+    if isinstance(obj, dict):
+        out = {}
+        for k, v in obj.items():
+            if k in _DROP_KEYS:
+                continue
+            # presence.update usa o JID como chave ({"presences": {jid: ...}}) e em data.id.
+            if _is_jid(k):
+                k = _sanitize_jid(k)
+            if isinstance(v, str) and (k in _JID_KEYS or _is_jid(v)):
+                out[k] = _sanitize_jid(v)
+            elif isinstance(v, str) and k in _TEXT_KEYS:
+                out[k] = _sanitize_text(v)
+            else:
+                out[k] = sanitize_payload(v)
+        return out
+    if isinstance(obj, list):
+        return [sanitize_payload(v) for v in obj]
+    return obj
+
+
+class WebhookRecorder:
+    def __init__(self, path: str, max_queue: int = 10000):
+        self.path = path
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        threading.Thread(target=self._run, daemon=True, name="webhook-recorder").start()
+
+    def record(self, payload, arrived_at: float | None = None):
+        line = {"t": arrived_at or time.time(), "payload": sanitize_payload(payload)}
+        try:
+            self._queue.put_nowait(line)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            lines = [self._queue.get()]
+            while True:
+                try:
+                    lines.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    for line in lines:
+                        f.write(json.dumps(line, ensure_ascii=False) + "\n")
+            except Exception as e:
+                print("[recorder] falha ao gravar payloads:", e)
+
+
+def register_recorder(app, path: str = "/webhook", record_file: str = WEBHOOK_RECORD_FILE):
+    """Grava os POSTs em `path` antes do handler; nao faz nada sem arquivo."""
+    if not record_file:
+        return None
+    from flask import request
+
+    recorder = WebhookRecorder(record_file)
+    print("[recorder] gravando payloads do webhook em", record_file)
+
+    @app.before_request
+    def _record_webhook():
+        if request.method == "POST" and request.path == path:
+            payload = request.get_json(silent=True)
+            if payload is not None:
+                recorder.record(payload)
+
+    return recorder
@@ -0,0 +1,97 @@
+"""Acesso unico ao Redis: pools compartilhados, cliente asyncio e prefixo de chaves.
+
+Todos os modulos (memory, webhook, app) pegam clientes daqui, entao o numero de
+conexoes por processo fica limitado por REDIS_MAX_CONNECTIONS.
+"""
+import os
+import threading
+
+from dotenv import load_dotenv
+
+from local_store import LocalRedis
+
+load_dotenv()
+
+REDIS_ENABLED = os.getenv("CACHE_REDIS_ENABLED", "false").lower() == "true"
+REDIS_URI = os.getenv("CACHE_REDIS_URI", "redis://localhost:6379/0")
+REDIS_PREFIX = (
+    os.getenv("CACHE_REDIS_PREFIX_KEY")
+    or os.getenv("CACHE_REDIS_PREFIX")
+    or "evolution"
+)
+# Sem Redis, usa o backend em memoria do proprio processo (historico e debounce
+# continuam funcionando num unico no). false = comportamento antigo, sem estado.
+LOCAL_STORE_ENABLED = os.getenv("LOCAL_STORE_ENABLED", "true").lower() == "true"
+
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "50"))
+# Quanto uma thread espera por conexao livre antes de erro (pool cheio).
+REDIS_POOL_TIMEOUT = float(os.getenv("REDIS_POOL_TIMEOUT", "5"))
+REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", "5"))
+REDIS_CONNECT_TIMEOUT = float(os.getenv("REDIS_CONNECT_TIMEOUT", "3"))
+REDIS_HEALTH_CHECK_INTERVAL = int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL", "30"))
+REDIS_SOCKET_KEEPALIVE = os.getenv("REDIS_SOCKET_KEEPALIVE", "true").lower() == "true"
+
+_lock = threading.Lock()
+_clients = {}
+_local = None
+
+
+def key(*parts) -> str:
+    """Chave com o prefixo da instalacao: key("chat", phone) -> "evolution:chat:<phone>"."""
+    return ":".join([REDIS_PREFIX, *[str(p) for p in parts]])
+
+
+def _pool_kwargs(binary: bool) -> dict:
+    return {
+        "max_connections": REDIS_MAX_CONNECTIONS,
+        "socket_timeout": REDIS_SOCKET_TIMEOUT,
+        "socket_connect_timeout": REDIS_CONNECT_TIMEOUT,
+        "socket_keepalive": REDIS_SOCKET_KEEPALIVE,
+        "health_check_interval": REDIS_HEALTH_CHECK_INTERVAL,
+        "decode_responses": not binary,
+    }
+
+
+def _local_store():
+    global _local
+    if _local is None:
+        _local = LocalRedis()
+    return _local
+
+
+def get_redis(binary: bool = False):
+    """Cliente sincrono compartilhado (texto ou binario), LocalRedis ou None.
+
+    O pool bloqueia quando atinge o limite em vez de abrir conexoes extras; o
+    redis-py recria as conexoes apos fork, entao e seguro sob gunicorn.
+    """
+    if not REDIS_ENABLED:
+        return _local_store() if LOCAL_STORE_ENABLED else None
+    with _lock:
+        client = _clients.get(("sync", binary))
+        if client is None:
+            import redis
+
+            pool = redis.BlockingConnectionPool.from_url(
+                REDIS_URI, timeout=REDIS_POOL_TIMEOUT, **_pool_kwargs(binary)
+            )
+            client = redis.Redis(connection_pool=pool)
+            _clients[("sync", binary)] = client
+        return client
+
+
+def get_async_redis(binary: bool = False):
+    """Cliente asyncio compartilhado; criar e usar dentro do mesmo event loop."""
+    if not REDIS_ENABLED:
+        return None
+    import redis.asyncio as aioredis
+
+    with _lock:
+        client = _clients.get(("async", binary))
+        if client is None:
+            pool = aioredis.BlockingConnectionPool.from_url(
+                REDIS_URI, timeout=REDIS_POOL_TIMEOUT, **_pool_kwargs(binary)
+            )
+            client = aioredis.Redis(connection_pool=pool)
+            _clients[("async", binary)] = client
+        return client
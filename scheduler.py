@@ -0,0 +1,133 @@
+"""Eleicao do processo que roda o debounce worker, via leases no Redis.
+
+Cada processo HTTP (ex.: workers do gunicorn) chama start_elected(); so quem
+segura um dos SCHEDULER_SLOTS leases executa o tick. Se o lider morrer, o
+lease expira em SCHEDULER_LEASE_SECONDS e outro processo assume.
+"""
+import os
+import socket
+import threading
+import uuid
+
+from local_store import register_script_impl
+from redis_conn import key
+
+SCHEDULER_SLOTS = int(os.getenv("SCHEDULER_SLOTS", "1"))
+SCHEDULER_LEASE_SECONDS = float(os.getenv("SCHEDULER_LEASE_SECONDS", "10"))
+
+# Renova/solta so se o lease ainda for deste processo.
+_RENEW_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+_RELEASE_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+def _renew_local(store, keys, args):
+    if store.get(keys[0]) != args[0]:
+        return 0
+    return 1 if store.expire(keys[0], max(1, int(args[1]) // 1000)) else 0
+
+
+def _release_local(store, keys, args):
+    if store.get(keys[0]) != args[0]:
+        return 0
+    return store.delete(keys[0])
+
+
+register_script_impl(_RENEW_LUA, _renew_local)
+register_script_impl(_RELEASE_LUA, _release_local)
+
+
+class LeaderLease:
+    def __init__(self, r, name: str = "scheduler", slots: int = SCHEDULER_SLOTS, ttl_sec: float = SCHEDULER_LEASE_SECONDS):
+        self.r = r
+        self.name = name
+        self.slots = max(1, slots)
+        self.ttl_ms = int(ttl_sec * 1000)
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.slot = None
+        self._renew = r.register_script(_RENEW_LUA)
+        self._release = r.register_script(_RELEASE_LUA)
+
+    def _slot_key(self, slot: int) -> str:
+        return key(self.name, "slot", slot)
+
+    def hold(self) -> bool:
+        """Renova o lease atual ou tenta pegar um slot livre. True = e lider."""
+        if self.slot is not None:
+            try:
+                if self._renew(keys=[self._slot_key(self.slot)], args=[self.owner, self.ttl_ms]):
+                    return True
+            except Exception as e:
+                print("[scheduler] falha ao renovar lease:", e)
+            print(f"[scheduler] {self.owner} perdeu o slot {self.slot}")
+            self.slot = None
+
+        for slot in range(self.slots):
+            if self.r.set(self._slot_key(slot), self.owner, px=self.ttl_ms, nx=True):
+                self.slot = slot
+                print(f"[scheduler] {self.owner} assumiu o slot {slot}")
+                return True
+        return False
+
+    def release(self):
+        if self.slot is None:
+            return
+        try:
+            self._release(keys=[self._slot_key(self.slot)], args=[self.owner])
+        finally:
+            self.slot = None
+
+
+def run_elected(r, tick, interval_sec: float = 2.0, stop_event: threading.Event | None = None, name: str = "scheduler"):
+    """Executa tick() a cada intervalo enquanto este processo for lider."""
+    lease = LeaderLease(r, name=name)
+    # O lease precisa ser renovado bem antes de expirar.
+    interval_sec = min(interval_sec, lease.ttl_ms / 3000.0)
+    stop_event = stop_event or threading.Event()
+    try:
+        while not stop_event.is_set():
+            try:
+                if lease.hold():
+                    tick()
+            except Exception as e:
+                print("[scheduler] erro:", e)
+            stop_event.wait(interval_sec)
+    finally:
+        lease.release()
+
+
+_thread = None
+_start_lock = threading.Lock()
+_stop = threading.Event()
+
+
+def start_elected(r, tick, interval_sec: float = 2.0, name: str = "scheduler") -> bool:
+    """Sobe a thread de eleicao uma vez por processo."""
+    global _thread
+    with _start_lock:
+        if _thread is not None or r is None:
+            return False
+        _thread = threading.Thread(
+            target=run_elected,
+            args=(r, tick),
+            kwargs={"interval_sec": interval_sec, "stop_event": _stop, "name": name},
+            daemon=True,
+        )
+        _thread.start()
+    return True
+
+
+def stop_elected(timeout_sec: float = 5.0):
+    # Solta o lease ao sair para o proximo lider assumir sem esperar o TTL.
+    _stop.set()
+    if _thread is not None:
+        _thread.join(timeout_sec)
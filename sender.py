@@ -1,7 +1,11 @@
 import os
+import time
 import requests
 from dotenv import load_dotenv
 
+from metrics import SEND_TEXT_FAILURES, SEND_TEXT_SECONDS
+from tracing import span
+
 load_dotenv()
 
 EVOLUTION_SEND_URL = (os.getenv("EVOLUTION_API") or "").strip().strip('"').strip("'")
@@ -9,11 +13,21 @@ API_KEY = os.getenv("AUTHENTICATION_API_KEY") or ""
 
 HEADERS = {"Content-Type": "application/json", "apikey": API_KEY}
 
-def send_text(phone: str, text: str) -> dict:
-    if not EVOLUTION_SEND_URL:
+def send_text(phone: str, text: str, url: str | None = None) -> dict:
+    """Envia pela Evolution; `url` troca a instancia (multi-loja)."""
+    url = url or EVOLUTION_SEND_URL
+    if not url:
         raise RuntimeError("EVOLUTION_API não configurada no .env")
 
     payload = {"number": phone, "text": text}
-    resp = requests.post(EVOLUTION_SEND_URL, json=payload, headers=HEADERS, timeout=30)
-    resp.raise_for_status()
+    t0 = time.perf_counter()
+    try:
+        with span("send_text"):
+            resp = requests.post(url, json=payload, headers=HEADERS, timeout=30)
+            resp.raise_for_status()
+    except Exception:
+        SEND_TEXT_FAILURES.inc()
+        raise
+    finally:
+        SEND_TEXT_SECONDS.observe(time.perf_counter() - t0)
     return resp.json() if resp.content else {"ok": True}
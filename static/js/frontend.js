@@ -15,6 +15,10 @@ const state = {
   chats: [],
   active: null,
   history: [],
+  // Cursor do historico carregado: chat, ultima seq e ETag da ultima resposta.
+  historyFor: null,
+  version: 0,
+  etag: null,
   pollTimer: null,
   lastChatNumero: null,
   isEditingContact: false,
@@ -198,7 +202,18 @@ async function loadChats() {
 
 async function loadActiveHistory() {
   if (!state.active) return;
-  const data = await apiGet(`/api/chat/${encodeURIComponent(state.active.numero)}`);
+  const numero = state.active.numero;
+  const sameChat = state.historyFor === numero;
+  // Mesmo chat: pede so o que veio depois da ultima seq; 304 = nada mudou.
+  const query = sameChat ? `?since=${state.version}` : "";
+  const headers = sameChat && state.etag ? { "If-None-Match": state.etag } : {};
+  const url = `/api/chat/${encodeURIComponent(numero)}${query}`;
+  const r = await fetch(url, { headers });
+  if (r.status === 304) return;
+  if (!r.ok) throw new Error(`GET ${url} falhou`);
+  const data = await r.json();
+  if (state.active?.numero !== numero) return;
+
   state.active = {
     numero: data.numero,
     contact_name: data.contact_name || "",
@@ -207,7 +222,11 @@ async function loadActiveHistory() {
     updated_at: data.updated_at,
     last_preview: data.last_preview || "",
   };
-  state.history = data.history || [];
+  const incoming = data.history || [];
+  state.history = sameChat && !data.reset ? state.history.concat(incoming).slice(-200) : incoming;
+  state.historyFor = numero;
+  state.version = data.version || 0;
+  state.etag = r.headers.get("ETag");
   renderHeader();
   renderMessages();
   renderChats();
@@ -0,0 +1,190 @@
+"""Roteamento multi-loja pela instancia da Evolution (campo "instance" do payload).
+
+Com MULTI_TENANT_ENABLED=false (padrao) tudo roda como antes: uma loja,
+store_profile.json, REDIS_PREFIX e EVOLUTION_API.
+
+Com MULTI_TENANT_ENABLED=true, cada instancia vira um Tenant com:
+- prefixo proprio no Redis ({REDIS_PREFIX}:i:{instancia}) para historico,
+  resumo, buffer, locks e dedupe;
+- membro proprio no pending_zset ("instancia|telefone"), entao uma unica
+  varredura agenda todas as lojas;
+- system prompt do cliente (db.get_prompt_for_client);
+- URL de envio da Evolution com a instancia trocada.
+
+Instancia sem cliente no banco, ou cliente sem prompt ativo, nao e atendida
+(resolve_tenant devolve None e o webhook ignora o payload): responder com o
+prompt de outra loja seria pior do que nao responder.
+
+A instancia padrao (INSTACE/INSTANCE) continua usando REDIS_PREFIX puro, sem
+migracao das chaves existentes. Os dados vem do banco por um cache com TTL;
+invalidate() (ou POST /api/tenants/invalidate) incrementa uma epoca no Redis e
+os outros processos descartam o cache em ate TENANT_EPOCH_CHECK_SECONDS.
+"""
+import os
+import threading
+import time
+
+from redis_conn import REDIS_PREFIX, get_redis
+from sender import EVOLUTION_SEND_URL
+
+MULTI_TENANT_ENABLED = os.getenv("MULTI_TENANT_ENABLED", "false").lower() == "true"
+DEFAULT_INSTANCE = (os.getenv("INSTACE") or os.getenv("INSTANCE") or "").strip().strip('"').strip("'")
+TENANT_CACHE_TTL_SECONDS = float(os.getenv("TENANT_CACHE_TTL_SECONDS", "300"))
+# Instancia sem cliente (ou sem prompt) no banco e consultada de novo antes.
+TENANT_NEGATIVE_TTL_SECONDS = float(os.getenv("TENANT_NEGATIVE_TTL_SECONDS", "60"))
+TENANT_EPOCH_CHECK_SECONDS = float(os.getenv("TENANT_EPOCH_CHECK_SECONDS", "5"))
+# Respostas simultaneas por loja no worker (0 = sem limite); evita que uma
+# loja com pico ocupe todas as threads.
+TENANT_MAX_CONCURRENT = int(os.getenv("TENANT_MAX_CONCURRENT", "4"))
+
+_MEMBER_SEP = "|"
+
+
+class Tenant:
+    __slots__ = ("instance", "client_id", "prefix", "system_prompt", "send_url")
+
+    def __init__(self, instance: str, client_id=None, prefix: str = REDIS_PREFIX, system_prompt: str | None = None, send_url: str = ""):
+        self.instance = instance
+        self.client_id = client_id
+        self.prefix = prefix
+        # None = prompt do store_profile.json (so a loja padrao).
+        self.system_prompt = system_prompt
+        # Vazio = EVOLUTION_API (sender.send_text decide na hora do envio).
+        self.send_url = send_url
+
+    @property
+    def is_default(self) -> bool:
+        return self.prefix == REDIS_PREFIX
+
+    @property
+    def label(self) -> str:
+        return self.instance or "default"
+
+    def member(self, phone: str) -> str:
+        """Membro do pending_zset; a loja padrao mantem o telefone puro."""
+        return phone if self.is_default else f"{self.instance}{_MEMBER_SEP}{phone}"
+
+
+DEFAULT_TENANT = Tenant(DEFAULT_INSTANCE)
+
+
+def parse_member(member: str) -> tuple[str | None, str]:
+    instance, sep, phone = member.rpartition(_MEMBER_SEP)
+    return (instance, phone) if sep else (None, member)
+
+
+def _send_url_for(instance: str) -> str:
+    if not EVOLUTION_SEND_URL:
+        return ""
+    # .../message/sendText/<instancia>
+    return EVOLUTION_SEND_URL.rstrip("/").rsplit("/", 1)[0] + "/" + instance
+
+
+class TenantLookupError(Exception):
+    """Banco fora do ar: nao da para saber se a instancia e de uma loja."""
+
+
+def _load_tenant(instance: str) -> Tenant | None:
+    """Tenant da instancia; None = sem cliente ou sem prompt ativo no banco."""
+    try:
+        from db import get_client_id_by_instance, get_prompt_for_client
+
+        client_id = get_client_id_by_instance(instance)
+        prompt = (get_prompt_for_client(client_id, default="") or "").strip() if client_id else ""
+    except Exception as e:
+        raise TenantLookupError(f"falha ao carregar a instancia {instance}: {e}") from e
+    if not client_id:
+        print(f"[tenants] instancia {instance} sem cliente cadastrado; ignorada")
+        return None
+    if not prompt:
+        print(f"[tenants] cliente {client_id} ({instance}) sem prompt ativo; ignorado")
+        return None
+    return Tenant(
+        instance,
+        client_id=client_id,
+        prefix=f"{REDIS_PREFIX}:i:{instance}",
+        system_prompt=prompt,
+        send_url=_send_url_for(instance),
+    )
+
+
+class TenantCache:
+    def __init__(self, ttl_sec: float = TENANT_CACHE_TTL_SECONDS, negative_ttl_sec: float = TENANT_NEGATIVE_TTL_SECONDS):
+        self.ttl_sec = ttl_sec
+        self.negative_ttl_sec = negative_ttl_sec
+        self._lock = threading.Lock()
+        # instancia -> (tenant, expira_em)
+        self._entries = {}
+        self._epoch = None
+        self._epoch_checked_at = 0.0
+
+    def _epoch_key(self) -> str:
+        return f"{REDIS_PREFIX}:tenants:epoch"
+
+    def _check_epoch(self, now: float):
+        if now - self._epoch_checked_at < TENANT_EPOCH_CHECK_SECONDS:
+            return
+        self._epoch_checked_at = now
+        r = get_redis()
+        if r is None:
+            return
+        try:
+            epoch = r.get(self._epoch_key())
+        except Exception:
+            return
+        if epoch != self._epoch:
+            if self._epoch is not None:
+                self._entries.clear()
+            self._epoch = epoch
+
+    def get(self, instance: str | None) -> Tenant | None:
+        """None = instancia sem loja; TenantLookupError = banco fora do ar."""
+        if not MULTI_TENANT_ENABLED or not instance or instance == DEFAULT_INSTANCE:
+            return DEFAULT_TENANT
+        now = time.monotonic()
+        with self._lock:
+            self._check_epoch(now)
+            entry = self._entries.get(instance)
+            if entry and entry[1] > now:
+                return entry[0]
+        # Consulta ao banco fora do lock; duas threads podem carregar a mesma
+        # instancia ao mesmo tempo, o resultado e igual. Falha do banco nao
+        # entra no cache.
+        tenant = _load_tenant(instance)
+        ttl = self.ttl_sec if tenant is not None else self.negative_ttl_sec
+        with self._lock:
+            self._entries[instance] = (tenant, now + ttl)
+        return tenant
+
+    def invalidate(self, instance: str | None = None):
+        with self._lock:
+            if instance:
+                self._entries.pop(instance, None)
+            else:
+                self._entries.clear()
+        r = get_redis()
+        if r is not None:
+            try:
+                r.incr(self._epoch_key())
+            except Exception as e:
+                print("[tenants] falha ao propagar invalidacao:", e)
+
+
+TENANTS = TenantCache()
+
+
+def resolve_tenant(instance: str | None) -> Tenant | None:
+    return TENANTS.get(instance)
+
+
+def register_tenant_routes(app):
+    from flask import jsonify, request
+
+    @app.post("/api/tenants/invalidate")
+    def tenants_invalidate():
+        token = os.getenv("ADMIN_TOKEN", "").strip()
+        if not token or request.headers.get("X-Admin-Token") != token:
+            return jsonify({"ok": False, "error": "FORBIDDEN"}), 403
+        instance = (request.args.get("instance") or "").strip() or None
+        TENANTS.invalidate(instance)
+        return jsonify({"ok": True, "instance": instance})
@@ -0,0 +1,165 @@
+"""Ciclo de vida do PromptCache contra um client.caches falso."""
+import itertools
+import threading
+
+import pytest
+
+import prompt_cache
+from local_store import LocalRedis
+from prompt_cache import PromptCache
+
+
+class FakeCaches:
+    def __init__(self):
+        self._ids = itertools.count(1)
+        self.live = {}
+        self.created = []
+        self.deleted = []
+        self.fail_create = False
+
+    def create(self, model, config):
+        if self.fail_create:
+            raise RuntimeError("prompt abaixo do minimo de tokens")
+        name = f"cachedContents/{next(self._ids)}"
+        self.live[name] = config.system_instruction
+        self.created.append(name)
+        return type("Cache", (), {"name": name})()
+
+    def delete(self, name):
+        self.deleted.append(name)
+        if self.live.pop(name, None) is None:
+            raise RuntimeError("not found")
+
+
+class FakeClient:
+    def __init__(self):
+        self.caches = FakeCaches()
+
+
+class Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture(autouse=True)
+def store(monkeypatch):
+    # Epoca de invalidacao num store em memoria, sem Redis.
+    r = LocalRedis()
+    monkeypatch.setattr(prompt_cache, "get_redis", lambda: r)
+    return r
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    c = Clock()
+    monkeypatch.setattr(prompt_cache.time, "time", c.time)
+    return c
+
+
+def test_create_then_reuse(clock):
+    client, cache = FakeClient(), PromptCache(ttl_sec=3600, retry_sec=600)
+    name = cache.get(client, "m", "prompt A")
+    assert name == "cachedContents/1"
+    clock.now += 1800
+    assert cache.get(client, "m", "prompt A") == name
+    assert client.caches.created == [name]
+    assert client.caches.live == {name: "prompt A"}
+
+
+def test_tenants_taking_turns_keep_their_handles(clock):
+    client, cache = FakeClient(), PromptCache()
+    a = cache.get(client, "m", "prompt A")
+    b = cache.get(client, "m", "prompt B")
+    assert a != b
+    for _ in range(3):
+        assert cache.get(client, "m", "prompt A") == a
+        assert cache.get(client, "m", "prompt B") == b
+    assert client.caches.created == [a, b]
+    assert client.caches.deleted == []
+
+
+def test_lru_eviction_deletes_least_recent(clock):
+    client, cache = FakeClient(), PromptCache(max_entries=2)
+    a = cache.get(client, "m", "prompt A")
+    b = cache.get(client, "m", "prompt B")
+    cache.get(client, "m", "prompt A")  # A passa a ser o mais recente
+    c = cache.get(client, "m", "prompt C")
+    assert client.caches.deleted == [b]
+    assert set(client.caches.live) == {a, c}
+
+
+def test_create_does_not_hold_other_prompts(clock):
+    client, cache = FakeClient(), PromptCache()
+    a = cache.get(client, "m", "prompt A")
+    started, release = threading.Event(), threading.Event()
+    create = client.caches.create
+
+    def slow_create(model, config):
+        started.set()
+        release.wait(5)
+        return create(model, config)
+
+    client.caches.create = slow_create
+    t = threading.Thread(target=cache.get, args=(client, "m", "prompt B"))
+    t.start()
+    assert started.wait(5)
+    # Com o handle de B sendo criado, A continua respondendo sem esperar.
+    assert cache.get(client, "m", "prompt A") == a
+    release.set()
+    t.join(5)
+
+
+def test_refresh_before_expiry(clock):
+    client, cache = FakeClient(), PromptCache(ttl_sec=3600)
+    old = cache.get(client, "m", "prompt A")
+    # Dentro da margem de renovacao o handle e trocado antes de expirar no servidor.
+    clock.now += 3600 - prompt_cache._RENEW_MARGIN_SECONDS
+    new = cache.get(client, "m", "prompt A")
+    assert new != old
+    assert client.caches.deleted == [old]
+    assert list(client.caches.live) == [new]
+
+
+def test_expired_on_server_is_recreated(clock):
+    client, cache = FakeClient(), PromptCache(ttl_sec=3600)
+    old = cache.get(client, "m", "prompt A")
+    client.caches.live.clear()  # expirou/foi removido do lado do Gemini
+    clock.now += 3600
+    new = cache.get(client, "m", "prompt A")
+    assert new != old
+    assert client.caches.live == {new: "prompt A"}
+
+
+def test_create_failure_backs_off(clock):
+    client, cache = FakeClient(), PromptCache(ttl_sec=3600, retry_sec=600)
+    client.caches.fail_create = True
+    assert cache.get(client, "m", "prompt A") is None
+    client.caches.fail_create = False
+    clock.now += 300
+    assert cache.get(client, "m", "prompt A") is None
+    assert client.caches.created == []
+    clock.now += 300
+    assert cache.get(client, "m", "prompt A") == "cachedContents/1"
+
+
+def test_invalidate_with_client_deletes_now(clock):
+    client, cache = FakeClient(), PromptCache()
+    name = cache.get(client, "m", "prompt A")
+    cache.invalidate(client, "m")
+    assert client.caches.deleted == [name]
+    assert client.caches.live == {}
+
+
+def test_panel_invalidation_reaches_worker(clock, store):
+    client, cache = FakeClient(), PromptCache()
+    a = cache.get(client, "m", "prompt A")
+    b = cache.get(client, "m", "prompt B")
+    prompt_cache.request_invalidation()  # save_store no painel, outro processo
+    assert client.caches.deleted == []
+    clock.now += prompt_cache.CONTEXT_CACHE_EPOCH_CHECK_SECONDS
+    new = cache.get(client, "m", "prompt A")
+    assert sorted(client.caches.deleted) == sorted([a, b])
+    assert client.caches.live == {new: "prompt A"}
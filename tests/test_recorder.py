@@ -0,0 +1,71 @@
+"""sanitize_payload num payload no formato real da Evolution (messages.upsert)."""
+import json
+import re
+
+from recorder import sanitize_payload
+
+PAYLOAD = {
+    "event": "messages.upsert",
+    "instance": "loja",
+    "apikey": "B6D711FCDE4D4FD5936544120E713976",
+    "data": [
+        {
+            "key": {"remoteJid": "5511987654321@s.whatsapp.net", "fromMe": False, "id": "3EB0A1B2C3D4E5F6"},
+            "pushName": "Maria Souza",
+            "message": {
+                "conversation": (
+                    "Oi, meu numero e (11) 98765-4321, o fixo 98765 4321, "
+                    "CPF 123.456.789-00 e e-mail maria.souza@example.com. Quero 2 unidades."
+                )
+            },
+            "messageType": "conversation",
+            "messageTimestamp": 1717171717,
+        },
+        {
+            "key": {"remoteJid": "5511987654321@s.whatsapp.net", "fromMe": False, "id": "3EB0F6E5D4C3B2A1"},
+            "message": {
+                "imageMessage": {
+                    "url": "https://mmg.whatsapp.net/o1/v/t62.7118-24/abc.enc",
+                    "mimetype": "image/jpeg",
+                    "caption": "entregar no +55 11 98765-4321",
+                    "fileSha256": "n7E1sO0mXbTq2a0jJX0h1l0r0wLq3yS7yqkz8iVbW3I=",
+                    "jpegThumbnail": "/9j/4AAQSkZJRgABAQAAAQABAAD",
+                }
+            },
+            "messageType": "imageMessage",
+        },
+    ],
+}
+
+SECRETS = ["98765", "4321", "123.456", "789-00", "maria.souza", "Maria Souza", "B6D711FC", "mmg.whatsapp"]
+
+
+def test_no_personal_data_left():
+    dumped = json.dumps(sanitize_payload(PAYLOAD), ensure_ascii=False)
+    for secret in SECRETS:
+        assert secret not in dumped, secret
+
+
+def test_shape_is_kept():
+    out = sanitize_payload(PAYLOAD)
+    first, image = out["data"]
+    text = first["message"]["conversation"]
+    original = PAYLOAD["data"][0]["message"]["conversation"]
+    # Mesmo tamanho e os mesmos separadores; so os digitos mudam.
+    assert re.sub(r"\d", "0", text.replace("<email>", "")) == re.sub(
+        r"\d", "0", original.replace("maria.souza@example.com", "")
+    )
+    assert "Quero 2 unidades." in text
+    assert "pushName" not in first and "apikey" not in out
+    assert set(image["message"]["imageMessage"]) == {"mimetype", "caption"}
+    assert image["message"]["imageMessage"]["caption"].startswith("entregar no +")
+
+
+def test_jid_pseudonym_is_stable():
+    out = sanitize_payload(PAYLOAD)
+    jids = {item["key"]["remoteJid"] for item in out["data"]}
+    assert len(jids) == 1
+    jid = jids.pop()
+    assert jid != "5511987654321@s.whatsapp.net"
+    assert jid.startswith("5511") and jid.endswith("@s.whatsapp.net")
+    assert len(jid) == len("5511987654321@s.whatsapp.net")
@@ -0,0 +1,213 @@
+"""Spans leves por requisicao, exportados em JSON compativel com OpenTelemetry.
+
+    with span("process_phone", phone=phone):
+        with span("llm", provider="gemini"):
+            ...
+
+O span mais externo de cada thread abre um trace novo. Ao terminar o trace:
+- se demorou mais que SLOW_REPLY_SECONDS, imprime a quebra por etapa;
+- se TRACE_EXPORT_FILE/TRACE_EXPORT_URL estiverem definidos, os spans vao para
+  uma fila e uma thread grava em lote (OTLP/JSON: uma linha por lote no
+  arquivo, ou POST em um coletor, ex.: http://localhost:4318/v1/traces).
+"""
+import contextvars
+import json
+import os
+import queue
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "true").lower() == "true"
+TRACE_EXPORT_FILE = os.getenv("TRACE_EXPORT_FILE", "").strip()
+TRACE_EXPORT_URL = os.getenv("TRACE_EXPORT_URL", "").strip()
+TRACE_SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "iawhatsapp")
+TRACE_QUEUE_MAX = int(os.getenv("TRACE_QUEUE_MAX", "10000"))
+SLOW_REPLY_SECONDS = float(os.getenv("SLOW_REPLY_SECONDS", "15"))
+
+_STATUS_OK = 1
+_STATUS_ERROR = 2
+
+_current = contextvars.ContextVar("trace_span", default=None)
+
+
+class _Trace:
+    __slots__ = ("trace_id", "spans")
+
+    def __init__(self):
+        self.trace_id = secrets.token_hex(16)
+        self.spans = []
+
+
+class Span:
+    __slots__ = ("trace", "name", "span_id", "parent_id", "depth", "attrs", "start_ns", "end_ns", "error")
+
+    def __init__(self, trace: _Trace, name: str, parent, attrs: dict):
+        self.trace = trace
+        self.name = name
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent.span_id if parent else ""
+        self.depth = parent.depth + 1 if parent else 0
+        self.attrs = attrs
+        self.start_ns = time.time_ns()
+        self.end_ns = 0
+        self.error = ""
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    @property
+    def seconds(self) -> float:
+        end = self.end_ns or time.time_ns()
+        return (end - self.start_ns) / 1e9
+
+
+class _NoopSpan:
+    def set(self, **attrs):
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+def current_span():
+    return _current.get()
+
+
+@contextmanager
+def span(name: str, **attrs):
+    if not TRACING_ENABLED:
+        yield _NOOP
+        return
+
+    parent = _current.get()
+    trace = parent.trace if parent else _Trace()
+    s = Span(trace, name, parent, attrs)
+    token = _current.set(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        s.end_ns = time.time_ns()
+        _current.reset(token)
+        trace.spans.append(s)
+        if parent is None:
+            _finish(trace, s)
+
+
+def _finish(trace: _Trace, root: Span):
+    if root.seconds >= SLOW_REPLY_SECONDS:
+        print(format_breakdown(trace, root))
+    if TRACE_EXPORT_FILE or TRACE_EXPORT_URL:
+        _exporter().submit(trace.spans)
+
+
+def format_breakdown(trace: _Trace, root: Span) -> str:
+    attrs = " ".join(f"{k}={v}" for k, v in root.attrs.items())
+    lines = [f"[trace][lento] {root.name} {root.seconds:.2f}s trace={trace.trace_id} {attrs}".rstrip()]
+    # Spans terminam de dentro para fora; ordena pelo inicio para ler em sequencia.
+    for s in sorted(trace.spans, key=lambda x: x.start_ns):
+        if s is root:
+            continue
+        extra = f" erro={s.error}" if s.error else ""
+        lines.append(f"{'  ' * s.depth}{s.name} {s.seconds:.3f}s{extra}")
+    return "\n".join(lines)
+
+
+# ---- exportacao OTLP/JSON ---------------------------------------------------
+
+def _otlp_value(v) -> dict:
+    if isinstance(v, bool):
+        return {"boolValue": v}
+    if isinstance(v, int):
+        return {"intValue": str(v)}
+    if isinstance(v, float):
+        return {"doubleValue": v}
+    return {"stringValue": str(v)}
+
+
+def _otlp_span(s: Span) -> dict:
+    out = {
+        "traceId": s.trace.trace_id,
+        "spanId": s.span_id,
+        "name": s.name,
+        "kind": 1,
+        "startTimeUnixNano": str(s.start_ns),
+        "endTimeUnixNano": str(s.end_ns),
+        "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in s.attrs.items()],
+        "status": {"code": _STATUS_ERROR, "message": s.error} if s.error else {"code": _STATUS_OK},
+    }
+    if s.parent_id:
+        out["parentSpanId"] = s.parent_id
+    return out
+
+
+def to_otlp(spans: list) -> dict:
+    return {
+        "resourceSpans": [
+            {
+                "resource": {
+                    "attributes": [
+                        {"key": "service.name", "value": {"stringValue": TRACE_SERVICE_NAME}},
+                        {"key": "process.pid", "value": {"intValue": str(os.getpid())}},
+                    ]
+                },
+                "scopeSpans": [{"scope": {"name": "iawhatsapp.tracing"}, "spans": [_otlp_span(s) for s in spans]}],
+            }
+        ]
+    }
+
+
+class _Exporter:
+    def __init__(self, path: str, url: str, batch_size: int = 512):
+        self.path = path
+        self.url = url
+        self.batch_size = batch_size
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=TRACE_QUEUE_MAX)
+        threading.Thread(target=self._run, daemon=True, name="trace-exporter").start()
+
+    def submit(self, spans: list):
+        for s in spans:
+            try:
+                self._queue.put_nowait(s)
+            except queue.Full:
+                # Nunca segura a resposta por causa de trace.
+                self.dropped += 1
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get(timeout=0.5))
+                except queue.Empty:
+                    break
+            try:
+                self._write(to_otlp(batch))
+            except Exception as e:
+                print("[trace] falha ao exportar spans:", e)
+
+    def _write(self, body: dict):
+        if self.path:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(body, ensure_ascii=False) + "\n")
+        if self.url:
+            import requests
+
+            requests.post(self.url, json=body, timeout=5).raise_for_status()
+
+
+_exporter_instance = None
+_exporter_lock = threading.Lock()
+
+
+def _exporter() -> _Exporter:
+    global _exporter_instance
+    with _exporter_lock:
+        if _exporter_instance is None:
+            _exporter_instance = _Exporter(TRACE_EXPORT_FILE, TRACE_EXPORT_URL)
+        return _exporter_instance
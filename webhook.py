@@ -6,33 +6,128 @@ import threading
 from flask import Flask, request, jsonify
 from dotenv import load_dotenv
 
-from parser import extract_phone_and_text, extract_item
-from memory import mem_get, mem_add, r
-from ai_service import generate_reply
+from parser import extract_phone_and_text, extract_item, extract_presences
+from memory import mem_get, mem_add, mem_add_many, mem_check_folds, mem_summary, r, rb
+from ai_service import generate_reply, load_profile, resolve_handoff_contact, warmup as ai_warmup
 from sender import send_text
-from buffer import buffer_add, buffer_pop_all, try_lock, unlock, PENDING_ZSET
+from redis_conn import REDIS_ENABLED, REDIS_PREFIX, REDIS_URI
+from scheduler import run_elected, start_elected
+from tenants import (
+    DEFAULT_TENANT,
+    TENANT_MAX_CONCURRENT,
+    TenantLookupError,
+    parse_member,
+    register_tenant_routes,
+    resolve_tenant,
+)
+from metrics import (
+    DEBOUNCE_WAIT_SECONDS,
+    DEDUPE_HITS,
+    PENDING_DEPTH,
+    REPLIES,
+    REPLY_SECONDS,
+    TRANSCRIPTION_SECONDS,
+    WEBHOOK_MESSAGES,
+    WEBHOOK_REQUESTS,
+    WEBHOOK_SECONDS,
+    WORKER_ACTIVE,
+    register_metrics_route,
+)
+from tracing import span
+from profiling import register_profiling_route
+from recorder import register_recorder
+from health import READINESS, register_health_routes, run_startup
+from dedupe import filter_processed
+from dispatch import DISPATCH_MAX_CONCURRENT, Candidate, FairScheduler, ai_flag_key, ai_paused, mark_handoff
+from archive import start_archiver
+from analytics import record_reply_latency
+from buffer import (
+    DEBOUNCE_ADAPTIVE,
+    PENDING_ZSET,
+    _resolve_buffer_delay_seconds,
+    buffer_add,
+    buffer_pop_all,
+    buffer_requeue,
+    presence_update,
+)
+from leases import LeaseLost, acquire_phone_lease
 
 load_dotenv(dotenv_path=".env", override=True)
 
 app = Flask(__name__)
+register_metrics_route(app)
+register_profiling_route(app)
+register_recorder(app)
+register_health_routes(app)
+register_tenant_routes(app)
 
 WEBHOOK_ENABLED = os.getenv("WEBHOOK_ENABLED", "false").lower() == "true"
-REDIS_ENABLED = os.getenv("CACHE_REDIS_ENABLED", "false").lower() == "true"
-REDIS_URI = os.getenv("CACHE_REDIS_URI", "redis://localhost:6379/0")
-REDIS_PREFIX = (
-    os.getenv("CACHE_REDIS_PREFIX_KEY")
-    or os.getenv("CACHE_REDIS_PREFIX")
-    or "evolution"
-)
-PROCESSED_MSG_TTL_SECONDS = int(os.getenv("PROCESSED_MSG_TTL_SECONDS", "21600"))
 
-if REDIS_ENABLED:
+if r is not None:
+    PENDING_DEPTH.set_function(lambda: r.zcard(PENDING_ZSET) if r is not None else 0)
+
+
+WORKER_POLL_SECONDS = float(os.getenv("WORKER_POLL_SECONDS", "2"))
+
+
+# Respostas em andamento por loja (so no processo lider, que despacha).
+_inflight = {}
+_inflight_lock = threading.Lock()
+_scheduler = FairScheduler()
+
+
+def _dispatch_due():
+    now = time.time()
+    due = r.zrangebyscore(PENDING_ZSET, 0, now, withscores=True)
+    if not due:
+        return
+
+    cands = []
+    for member, score in due:
+        instance, phone = parse_member(member)
+        try:
+            tenant = resolve_tenant(instance) if instance else DEFAULT_TENANT
+        except TenantLookupError as e:
+            # Banco fora do ar: continua no zset para o proximo tick.
+            print("[worker]", e)
+            continue
+        if tenant is None:
+            # Loja removida (ou sem prompt) depois que a mensagem entrou no buffer.
+            print(f"[worker] {member}: instancia sem loja, descartado")
+            r.zrem(PENDING_ZSET, member)
+            continue
+        cands.append(Candidate(member, phone, tenant, score))
+
+    with _inflight_lock:
+        slots = DISPATCH_MAX_CONCURRENT - sum(_inflight.values()) if DISPATCH_MAX_CONCURRENT else len(cands)
+    for cand in _scheduler.plan(r, cands, now):
+        if slots <= 0:
+            # O resto fica no zset e volta no proximo tick (finish conta).
+            break
+        tenant = cand.tenant
+        with _inflight_lock:
+            if TENANT_MAX_CONCURRENT and _inflight.get(tenant.label, 0) >= TENANT_MAX_CONCURRENT:
+                _scheduler.deferred(cand, "tenant_cap")
+                continue
+        lease = acquire_phone_lease(r, tenant.prefix, cand.phone)
+        if lease is None:
+            _scheduler.deferred(cand, "locked")
+            continue
+        with _inflight_lock:
+            _inflight[tenant.label] = _inflight.get(tenant.label, 0) + 1
+        slots -= 1
+        _scheduler.served(cand, now)
+
+        threading.Thread(target=_run_dispatched, args=(cand.phone, tenant, cand.member, lease), daemon=True).start()
+    _scheduler.finish(r, now)
+
+
+def _run_dispatched(phone, tenant, member, lease):
     try:
-        r.ping()
-        print("[redis] conectado:", REDIS_URI)
-    except Exception as e:
-        print("[redis] falha ao conectar, debounce desativado:", e)
-        r = None
+        _process_phone(phone, tenant=tenant, member=member, lease=lease)
+    finally:
+        with _inflight_lock:
+            _inflight[tenant.label] -= 1
 
 
 def worker_loop():
@@ -40,72 +135,253 @@ def worker_loop():
         print("[worker] Redis desativado; debounce nao vai funcionar.")
         return
 
-    print("[worker] rodando debounce worker...")
+    print("[worker] rodando debounce worker (eleito por lease)...")
+    run_elected(r, _dispatch_due, interval_sec=WORKER_POLL_SECONDS)
 
-    while True:
-        try:
-            now = int(time.time())
-            phones = r.zrangebyscore(PENDING_ZSET, 0, now)
 
-            for phone in phones:
-                if not try_lock(r, REDIS_PREFIX, phone, ttl_sec=60):
-                    continue
+def start_worker() -> bool:
+    """Sobe o worker eleito neste processo (chamado por processo, ex.: post_worker_init)."""
+    if not r:
+        print("[worker] Redis desativado; debounce nao vai funcionar.")
+        return False
+    return start_elected(r, _dispatch_due, interval_sec=WORKER_POLL_SECONDS)
+
 
-                threading.Thread(target=_process_phone, args=(phone,), daemon=True).start()
+def _startup_steps():
+    global r
+    # Nada conecta no import; a ordem aqui define o que fica pronto primeiro.
+    if REDIS_ENABLED:
+        if READINESS.check("redis", r.ping, required=False):
+            print("[redis] conectado:", REDIS_URI)
+        else:
+            print("[redis] falha ao conectar, debounce desativado:", READINESS.snapshot()["checks"]["redis"]["detail"])
+            r = None
+    elif r is not None:
+        print("[local] Redis desativado; historico e debounce em memoria deste processo.")
+    start_worker()
+    if r is not None:
+        start_archiver(r, rb)
 
-        except Exception as e:
-            print("[worker] erro:", e)
+    def _db_warmup():
+        import db
 
-        time.sleep(2)
+        db.warmup()
 
+    READINESS.check("db", _db_warmup, required=False)
+    READINESS.check("ai", ai_warmup, required=False)
 
-def _message_already_processed(msg_id: str | None) -> bool:
-    if not r or not msg_id:
-        return False
-    key = f"{REDIS_PREFIX}:processed:{msg_id}"
-    # set nx = primeira vez; se falhar, já foi processada.
-    was_set = r.set(key, "1", ex=PROCESSED_MSG_TTL_SECONDS, nx=True)
-    return not bool(was_set)
+
+def startup(background: bool = True):
+    """Fase de inicializacao do processo (chamada por processo, ex.: post_worker_init)."""
+    return run_startup(_startup_steps, background=background)
+
+
+def _filter_processed(msg_ids: list, prefix: str = REDIS_PREFIX) -> list[bool]:
+    """Verifica e marca todos os ids numa unica ida ao Redis; True = ja processada."""
+    return filter_processed(r, prefix, msg_ids)
+
+
+def _kind(m) -> str:
+    return m.get("type") if isinstance(m, dict) else "text"
+
+
+def _is_audio(m) -> bool:
+    return _kind(m) == "audio"
+
+
+def _is_media(m) -> bool:
+    return _kind(m) in ("audio", "image")
+
+
+def _image_text(caption: str, description: str) -> str:
+    # Descricao no texto do cliente: a busca do catalogo e o LLM usam os termos.
+    marker = f"[Imagem: {description}]" if description else "[Imagem]"
+    return f"{marker} {caption}".strip()
 
 
-def _process_phone(phone: str):
+def _buffered_text(msgs: list, phone: str, tenant) -> list:
+    """Texto de cada item do buffer; audios e imagens vao juntos, um pedido por tipo.
+
+    Audio: transcricao, "" (sem fala/falhou) ou None (nota curta pulada).
+    Imagem: "[Imagem: descricao] legenda".
+    """
+    texts = []
+    for m in msgs:
+        if not isinstance(m, dict):
+            texts.append(str(m))
+        else:
+            texts.append(m.get("content") if _kind(m) == "text" else None)
+    audio_idx = [i for i, m in enumerate(msgs) if _is_audio(m)]
+    if audio_idx:
+        try:
+            from audio import transcribe_batch
+
+            with TRANSCRIPTION_SECONDS.time(), span("transcribe", phone=phone, audios=len(audio_idx)):
+                transcripts = transcribe_batch([msgs[i] for i in audio_idx], instance=tenant.instance or None)
+        except Exception as e:
+            print(f"[AUDIO][ERRO] {e}", file=sys.stderr)
+            transcripts = [""] * len(audio_idx)
+        for i, text in zip(audio_idx, transcripts):
+            texts[i] = text
+            if text:
+                print(f"[AUDIO] Transcricao de {phone}: {text}")
+
+    image_idx = [i for i, m in enumerate(msgs) if _kind(m) == "image"]
+    if image_idx:
+        try:
+            from images import describe_images
+
+            with span("describe_images", phone=phone, images=len(image_idx)):
+                descriptions = describe_images([msgs[i] for i in image_idx], instance=tenant.instance or None, r=r)
+        except Exception as e:
+            print(f"[image][ERRO] {e}", file=sys.stderr)
+            descriptions = [""] * len(image_idx)
+        for i, description in zip(image_idx, descriptions):
+            texts[i] = _image_text(msgs[i].get("caption") or "", description)
+    return texts
+
+
+def _requeue_items(msgs: list, texts: list) -> list:
+    # Midias ja estao no historico com o texto extraido: voltam como texto, para
+    # quem assumir nao transcrever/descrever (nem gravar no historico) de novo.
+    items = []
+    for m, text in zip(msgs, texts):
+        if not _is_media(m):
+            items.append(m)
+        elif text:
+            items.append({"type": "text", "content": text, **({"t": m["t"]} if m.get("t") else {})})
+    return items
+
+
+def _passed_handoff(answer: str) -> bool:
+    """A resposta passou o contato humano? (o cliente passa a esperar um atendente)"""
     try:
-        r.zrem(PENDING_ZSET, phone)
-
-        msgs = buffer_pop_all(r, REDIS_PREFIX, phone)
-        if not msgs:
-            return
-
-        user_text = "\n".join(
-            [
-                m["content"]
-                if isinstance(m, dict) and m.get("type") == "text"
-                else str(m)
-                for m in msgs
+        contact = resolve_handoff_contact(load_profile())
+    except Exception:
+        return False
+    return bool(contact) and contact in answer
+
+
+def _process_phone(phone: str, tenant=None, member: str | None = None, lease=None):
+    """Responde o buffer do telefone; `lease` (leases.PhoneLease) e solto no fim."""
+    tenant = tenant or DEFAULT_TENANT
+    WORKER_ACTIVE.inc()
+    t0 = time.perf_counter()
+    result = "empty"
+    # Itens ja retirados do buffer que voltam para ele se o lease for perdido.
+    requeue = []
+    with span("process_phone", phone=phone, tenant=tenant.label) as root:
+        try:
+            with span("buffer_pop"):
+                r.zrem(PENDING_ZSET, member or tenant.member(phone))
+                msgs = buffer_pop_all(rb, tenant.prefix, phone)
+            if not msgs:
+                return
+
+            arrivals = [m.get("t") for m in msgs if isinstance(m, dict) and m.get("t")]
+            if arrivals:
+                waited = max(0.0, time.time() - float(min(arrivals)))
+                DEBOUNCE_WAIT_SECONDS.observe(waited)
+                root.set(debounce_wait_s=round(waited, 3), messages=len(msgs))
+
+            texts = _buffered_text(msgs, phone, tenant)
+            # Textos ja foram salvos no historico no webhook; audios e imagens
+            # entram agora, com marcador para o painel.
+            media_entries = [
+                (phone, "user", f"[Audio] {t}" if _is_audio(m) else t) for m, t in zip(msgs, texts) if _is_media(m) and t
             ]
-        ).strip()
-
-        # Mensagens do cliente ja foram salvas no historico no webhook.
-        history = mem_get(phone)
-        pending_count = len(msgs)
-        base_history = history[:-pending_count] if len(history) >= pending_count else []
-
-        answer = generate_reply(base_history, user_text)
-        mem_add(phone, "assistant", answer)
-        send_text(phone, answer)
-        print(f"[worker] respondeu {phone}: {answer[:80]}")
-    except Exception as e:
-        print(f"[worker][{phone}] erro:", e)
-    finally:
-        unlock(r, REDIS_PREFIX, phone)
+            if media_entries:
+                mem_add_many(media_entries, prefix=tenant.prefix)
+            if ai_paused(r.get(ai_flag_key(phone))):
+                # IA pausada no painel: o atendente ve as mensagens no historico.
+                result = "paused"
+                return
+            requeue = _requeue_items(msgs, texts)
+            user_text = "\n".join(t for t in texts if t).strip()
+            if not user_text:
+                if any(_is_audio(m) and t == "" for m, t in zip(msgs, texts)):
+                    if lease is not None:
+                        lease.check()
+                    send_text(phone, "Nao consegui transcrever o audio.", url=tenant.send_url)
+                return
+
+            with span("history_read"):
+                history = mem_get(phone, prefix=tenant.prefix)
+                summary = mem_summary(phone, prefix=tenant.prefix)
+            pending_count = sum(1 for m in msgs if not _is_media(m)) + len(media_entries)
+            base_history = history[:-pending_count] if len(history) >= pending_count else []
+
+            answer = generate_reply(base_history, user_text, summary=summary, system_prompt=tenant.system_prompt)
+            # Cerca: se o lease passou para outro worker durante o LLM, nao envia
+            # nem grava; os itens voltam ao buffer para quem assumiu.
+            if lease is not None:
+                lease.check()
+            send_text(phone, answer, url=tenant.send_url)
+            requeue = []
+            with span("history_write"):
+                mem_add(phone, "assistant", answer, prefix=tenant.prefix, source="llm")
+            if _passed_handoff(answer):
+                mark_handoff(r, tenant.prefix, phone)
+            if arrivals:
+                record_reply_latency(r, time.time() - float(min(arrivals)), tenant.prefix)
+            result = "ok"
+            print(f"[worker] respondeu {phone}: {answer[:80]}")
+        except LeaseLost as e:
+            result = "fenced"
+            print(f"[worker][{phone}] resposta descartada, devolvendo {len(requeue)} itens ao buffer:", e)
+            try:
+                buffer_requeue(r, tenant.prefix, phone, requeue, member=member or tenant.member(phone))
+            except Exception as e2:
+                print(f"[worker][{phone}] falha ao devolver itens ao buffer:", e2)
+        except Exception as e:
+            result = "error"
+            print(f"[worker][{phone}] erro:", e)
+        finally:
+            if lease is not None:
+                lease.release()
+            WORKER_ACTIVE.dec()
+            REPLIES.inc(result=result, tenant=tenant.label)
+            root.set(result=result)
+            if result not in ("empty", "paused"):
+                REPLY_SECONDS.observe(time.perf_counter() - t0)
 
 
 @app.post("/webhook")
 def webhook():
+    with WEBHOOK_SECONDS.time(), span("webhook") as root:
+        resp, status = _handle_webhook()
+        root.set(status=status)
+    WEBHOOK_REQUESTS.inc(status=status)
+    return resp, status
+
+
+def _handle_presence(payload):
+    """Digitando/parado so mexe no prazo de quem ja tem mensagem no buffer."""
+    presences = extract_presences(payload)
+    if not r or not DEBOUNCE_ADAPTIVE or not presences:
+        return jsonify({"ok": True, "ignored": True, "reason": "presence"}), 200
+    try:
+        tenant = resolve_tenant(payload.get("instance"))
+    except TenantLookupError:
+        tenant = None
+    if tenant is None:
+        return jsonify({"ok": True, "ignored": True, "reason": "unknown_instance"}), 200
+    delay = _resolve_buffer_delay_seconds()
+    pipe = r.pipeline(transaction=False)
+    for phone, state in presences:
+        WEBHOOK_MESSAGES.inc(kind="presence")
+        presence_update(pipe, tenant.prefix, phone, state, member=tenant.member(phone), max_delay=delay)
+    pipe.execute()
+    return jsonify({"ok": True, "presence": len(presences)}), 200
+
+
+def _handle_webhook():
     if not WEBHOOK_ENABLED:
         return jsonify({"ok": False, "error": "WEBHOOK_DISABLED"}), 403
 
     payload = request.get_json(silent=True) or {}
+    if str(payload.get("event") or "").lower().replace("_", ".") == "presence.update":
+        return _handle_presence(payload)
     data = payload.get("data")
 
     if isinstance(data, list):
@@ -115,92 +391,111 @@ def webhook():
     else:
         return jsonify({"ok": True, "ignored": True, "reason": "no_data"}), 200
 
+    try:
+        tenant = resolve_tenant(payload.get("instance"))
+    except TenantLookupError as e:
+        print("[webhook]", e)
+        return jsonify({"ok": False, "error": "TENANT_LOOKUP_FAILED"}), 503
+    if tenant is None:
+        # Multi-loja: instancia sem cliente/prompt no banco nao e atendida.
+        return jsonify({"ok": True, "ignored": True, "reason": "unknown_instance"}), 200
+
     buffered = 0
     ignored = 0
     audios = 0
+    images = 0
 
+    # 1) Parse de todo o lote antes de tocar no Redis.
+    parsed_items = []
     for item in items:
         key = item.get("key") or {}
         msg_id = key.get("id")
-
-        if _message_already_processed(msg_id):
-            ignored += 1
-            continue
-
         parsed = extract_item({"data": item})
-        if parsed and parsed.get("type") == "audio":
-            audios += 1
-            phone = parsed["phone"]
-            mime = parsed["mime"]
-
-            # Ignora áudio enviado pela própria instância.
+        if parsed and parsed.get("type") in ("audio", "image"):
+            # Ignora mídia enviada pela própria instância.
             if key.get("fromMe") is True:
                 ignored += 1
                 continue
-
-            try:
-                from audio import evolution_get_media_base64, base64_to_bytes, transcribe_with_gemini
-
-                b64 = evolution_get_media_base64(msg_id)
-                audio_bytes = base64_to_bytes(b64)
-                text = transcribe_with_gemini(audio_bytes, mime)
-
-                if text:
-                    print(f"[AUDIO] Transcricao de {phone}: {text}")
-
-                    # Mostra no painel de chat com marcador de audio.
-                    mem_add(phone, "user", f"[Audio] {text}")
-
-                    # Para IA, vai com texto puro da transcricao no buffer.
-                    if r:
-                        text_obj = {"type": "text", "content": text}
-                        ok = buffer_add(r, REDIS_PREFIX, phone, text_obj, msg_id=msg_id)
-                        if ok:
-                            buffered += 1
-                    else:
-                        history = mem_get(phone)
-                        answer = generate_reply(history, text)
-                        mem_add(phone, "assistant", answer)
-                        send_text(phone, answer)
-                else:
-                    send_text(phone, "Nao consegui transcrever o audio.")
-
-            except Exception as e:
-                print(f"[AUDIO][ERRO] {e}", file=sys.stderr)
-                send_text(phone, "Erro ao processar o audio.")
+            parsed_items.append(parsed)
             continue
 
         phone, text = extract_phone_and_text(item)
         if not phone or not text:
             ignored += 1
             continue
+        parsed_items.append({"type": "text", "phone": phone, "id": msg_id, "content": text})
 
-        # Mostra na interface imediatamente quando webhook captura.
-        mem_add(phone, "user", text)
-
-        if r:
-            text_obj = {"type": "text", "content": text}
-            ok = buffer_add(
-                r,
-                REDIS_PREFIX,
-                phone,
-                text_obj,
-                msg_id=msg_id or None,
+    # 2) Dedupe do lote inteiro numa ida ao Redis.
+    with span("dedupe", items=len(parsed_items)):
+        duplicated = _filter_processed([p.get("id") for p in parsed_items], prefix=tenant.prefix)
+
+    # 3) Historico (painel) e buffer (IA) de cada mensagem nova.
+    history_entries = []
+    buffer_entries = []
+    for parsed, dup in zip(parsed_items, duplicated):
+        if dup:
+            ignored += 1
+            DEDUPE_HITS.inc()
+            continue
+        WEBHOOK_MESSAGES.inc(kind=parsed["type"])
+        phone = parsed["phone"]
+
+        if parsed["type"] == "audio":
+            # Transcrito no flush, junto com os outros audios do telefone.
+            audios += 1
+            buffer_entries.append(
+                (phone, {"type": "audio", "id": parsed["id"], "mime": parsed["mime"], "seconds": parsed.get("seconds")})
             )
-            if ok:
-                buffered += 1
-        else:
-            history = mem_get(phone)
-            answer = generate_reply(history, text)
-            mem_add(phone, "assistant", answer)
-            send_text(phone, answer)
+            continue
+
+        if parsed["type"] == "image":
+            # Descrita no flush (images.describe_images), com cache por hash.
+            images += 1
+            buffer_entries.append(
+                (
+                    phone,
+                    {
+                        "type": "image",
+                        "id": parsed["id"],
+                        "mime": parsed["mime"],
+                        "caption": parsed["caption"],
+                        "sha": parsed.get("sha"),
+                    },
+                )
+            )
+            continue
+
+        # Mostra na interface imediatamente quando webhook captura.
+        history_entries.append((phone, "user", parsed["content"]))
+        buffer_entries.append((phone, {"type": "text", "content": parsed["content"]}))
+
+    if r:
+        if history_entries or buffer_entries:
+            with span("redis_write", messages=len(buffer_entries)):
+                pipe = r.pipeline(transaction=False)
+                mem_add_many(history_entries, pipe=pipe, prefix=tenant.prefix)
+                delay = _resolve_buffer_delay_seconds()
+                for phone, data in buffer_entries:
+                    buffer_add(pipe, tenant.prefix, phone, data, delay=delay, member=tenant.member(phone))
+                results = pipe.execute()
+            mem_check_folds(history_entries, results[: len(history_entries)], prefix=tenant.prefix)
+            buffered += len(buffer_entries)
+    else:
+        for phone, data in buffer_entries:
+            text = _buffered_text([data], phone, tenant)[0]
+            if not text:
+                continue
+            mem_add(phone, "user", f"[Audio] {text}" if data["type"] == "audio" else text, prefix=tenant.prefix)
+            history = mem_get(phone, prefix=tenant.prefix)
+            answer = generate_reply(history, text, system_prompt=tenant.system_prompt)
+            mem_add(phone, "assistant", answer, prefix=tenant.prefix, source="llm")
+            send_text(phone, answer, url=tenant.send_url)
 
-    return jsonify({"ok": True, "buffered": buffered, "ignored": ignored, "audios": audios}), 200
+    return jsonify({"ok": True, "buffered": buffered, "ignored": ignored, "audios": audios, "images": images}), 200
 
 
 if __name__ == "__main__":
     if (not app.debug) or (os.environ.get("WERKZEUG_RUN_MAIN") == "true"):
-        t = threading.Thread(target=worker_loop, daemon=True)
-        t.start()
+        startup()
 
     app.run(host="0.0.0.0", port=5000, debug=True)